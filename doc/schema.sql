@@ -20,6 +20,8 @@ CREATE UNIQUE INDEX job_location_id ON job (location, foreign_id);
 CREATE INDEX job_priority ON job (priority);
 CREATE INDEX job_task ON job (task);
 CREATE INDEX job_qa_state ON job (qa_state);
+CREATE INDEX job_queue ON job (location, state, priority DESC, id);
+CREATE INDEX job_queue_task ON job (location, state, task, priority DESC, id);
 
 CREATE TABLE input_file (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -59,6 +61,21 @@ CREATE TABLE log (
 
 CREATE INDEX log_job_id ON log (job_id);
 CREATE INDEX log_state_new ON log (state_new);
+CREATE INDEX log_job_state ON log (job_id, state_new, id);
+
+CREATE TABLE log_archive (
+    id INTEGER NOT NULL PRIMARY KEY,
+    job_id INTEGER NOT NULL,
+    datetime TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    state_prev CHAR(1) NOT NULL DEFAULT "?",
+    state_new CHAR(1) NOT NULL DEFAULT "?",
+    message TEXT NOT NULL DEFAULT "",
+    host VARCHAR(80) NOT NULL DEFAULT "unknown",
+    username VARCHAR(80) NOT NULL DEFAULT "unknown"
+);
+
+CREATE INDEX log_archive_job_id ON log_archive (job_id);
+CREATE INDEX log_archive_job_state ON log_archive (job_id, state_new, id);
 
 CREATE TABLE obsidss (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -142,3 +159,65 @@ CREATE TABLE note (
 );
 
 CREATE INDEX note_job_id ON note (job_id);
+
+CREATE TABLE job_count (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task VARCHAR(80) NOT NULL,
+    location VARCHAR(80) NOT NULL,
+    state CHAR(1) NOT NULL,
+    qa_state CHAR(1) NOT NULL,
+    number INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE UNIQUE INDEX job_count_key ON job_count (task, location, state, qa_state);
+
+CREATE TABLE job_obs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL,
+    obsid VARCHAR(48) NOT NULL,
+    utdate INTEGER DEFAULT NULL,
+    obsnum INTEGER DEFAULT NULL,
+    instrument VARCHAR(8) DEFAULT NULL,
+    obstype VARCHAR(10) DEFAULT NULL,
+    project VARCHAR(32) DEFAULT NULL,
+    survey VARCHAR(10) DEFAULT NULL,
+    scanmode VARCHAR(28) DEFAULT NULL,
+    sourcename VARCHAR(70) DEFAULT NULL,
+    tau DOUBLE DEFAULT NULL,
+    omp_status INTEGER DEFAULT NULL,
+    FOREIGN KEY (job_id) REFERENCES job(id)
+        ON DELETE RESTRICT ON UPDATE RESTRICT
+);
+
+CREATE UNIQUE INDEX job_obs_job_obsid ON job_obs (job_id, obsid);
+CREATE INDEX job_obs_obsid ON job_obs (obsid);
+CREATE INDEX job_obs_utdate ON job_obs (utdate);
+CREATE INDEX job_obs_project ON job_obs (project);
+CREATE INDEX job_obs_survey ON job_obs (survey);
+CREATE INDEX job_obs_instrument ON job_obs (instrument, obstype);
+
+CREATE TABLE job_lease (
+    job_id INTEGER NOT NULL PRIMARY KEY,
+    state CHAR(1) NOT NULL,
+    state_return CHAR(1) NOT NULL,
+    host VARCHAR(80) NOT NULL DEFAULT "unknown",
+    pid INTEGER NOT NULL DEFAULT 0,
+    heartbeat TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (job_id) REFERENCES job(id)
+        ON DELETE RESTRICT ON UPDATE RESTRICT
+);
+
+CREATE INDEX job_lease_heartbeat ON job_lease (heartbeat);
+
+CREATE TABLE schema_version (
+    version INTEGER NOT NULL PRIMARY KEY,
+    description VARCHAR(255) NOT NULL DEFAULT "",
+    applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO schema_version (version, description) VALUES
+    (1, "Add job_count summary table"),
+    (2, "Add composite indexes for job queue and log queries"),
+    (3, "Add job_obs observation information table"),
+    (4, "Add log_archive table for old log entries"),
+    (5, "Add job_lease table for active job heartbeats");
@@ -119,7 +119,7 @@ def _clean_job_directories(dir_function, state, task=None, count=None,
     """
 
     db = get_database()
-    jobs = db.find_jobs(location='JAC', state=state, task=task)
+    jobs = db.iter_jobs(location='JAC', state=state, task=task)
 
     n = 0
     for job in jobs:
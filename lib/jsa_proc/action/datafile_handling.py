@@ -78,18 +78,50 @@ def check_data_already_present(job_id, db):
 
     try:
         input_file_list = db.get_input_files(job_id)
-        inputs = get_jac_input_data(input_file_list)
     except NoRowsError:
-        inputs = []
+        input_file_list = []
 
     try:
         parents = db.get_parents(job_id, with_state=True)
-        parent_files_with_paths = []
+    except NoRowsError:
+        parents = []
+
+    parent_outputs = db.get_output_files_many([p[0] for p in parents])
+
+    return find_data_already_present(input_file_list, parents, parent_outputs)
+
+
+def find_data_already_present(input_file_list, parents, parent_outputs):
+    """
+    Check if all data are present already on disk, given the
+    information about a job retrieved from the database.
+
+    This performs the filesystem checks for check_data_already_present.
+    It allows the database information for a number of jobs to
+    be retrieved in bulk, and does not itself access the database.
+
+    input_file_list: list of input file names.
+    parents: list of (parent job id, filters, parent state) tuples.
+    parent_outputs: dictionary of lists of output files by parent job id.
+    """
+
+    inputs = get_jac_input_data(input_file_list)
+
+    try:
         for p, filts, parent_state in parents:
             if parent_state not in JSAProcState.STATE_POST_RUN:
                 raise ParentNotReadyError('Parent job {} is not ready'.format(p))
 
-            outputs = db.get_output_files(p)
+        for p, filts, parent_state in parents:
+            outputs = parent_outputs[p]
+            if not outputs:
+                # Treat a parent without output files as get_output_files
+                # would have done.
+                raise NoRowsError(
+                    'output_file',
+                    'SELECT filename FROM output_file WHERE job_id = ' +
+                    str(p))
+
             parent_files = filter_file_list(outputs, filts)
             for f in parent_files:
                 filepath = is_file_in_a_dir(f, get_output_dir(p))
@@ -132,7 +164,13 @@ def write_input_list(job_id, input_file_list):
 
     input_directory = get_input_dir(job_id)
     if not os.path.exists(input_directory):
-        os.makedirs(input_directory)
+        try:
+            os.makedirs(input_directory)
+        except OSError:
+            # The directory (or one of its parents) may have been
+            # created concurrently by another thread.
+            if not os.path.isdir(input_directory):
+                raise
     fname = os.path.join(input_directory, input_list_name)
     f = open(fname, 'w')
     for i in input_file_list:
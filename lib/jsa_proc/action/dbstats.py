@@ -0,0 +1,81 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, division, absolute_import
+
+import logging
+import os
+
+from jsa_proc.config import get_config
+from jsa_proc.db.stats import read_db_stats, stats_file_pattern
+from jsa_proc.error import CommandError
+
+logger = logging.getLogger(__name__)
+
+
+def show_db_stats(number=None, clear=False):
+    """Display database access statistics.
+
+    Reads the per-process statistics files from the directory
+    given by the "stats_dir" entry of the "database" configuration
+    section and shows the call sites and queries with the greatest
+    total time.  If "number" is given, only that many of each
+    are shown.
+
+    If "clear" is specified, the statistics files are deleted
+    after being read.
+    """
+
+    config = get_config()
+
+    if not config.has_option('database', 'stats_dir'):
+        raise CommandError('Database statistics directory not configured')
+
+    directory = config.get('database', 'stats_dir')
+
+    stats = read_db_stats(directory)
+
+    blocks = sorted(stats.blocks.items(),
+                    key=lambda x: x[1][3], reverse=True)
+    queries = sorted(stats.queries.items(),
+                     key=lambda x: x[1][1], reverse=True)
+
+    if number is not None:
+        blocks = blocks[:number]
+        queries = queries[:number]
+
+    block_format = '{0:<30} {1:>8} {2:>10.3f} {3:>10.3f} ' \
+                   '{4:>10.3f} {5:>10.3f}'
+    query_format = '{0:<30} {1:>8} {2:>10.3f} {3:>10.3f} {4:>10}'
+
+    print('{0:<30} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10}'.format(
+        'Call site', 'Count', 'Wait', 'Max wait', 'Hold', 'Max hold'))
+
+    for (site, values) in blocks:
+        print(block_format.format(site, *values))
+
+    print('')
+    print('{0:<30} {1:>8} {2:>10} {3:>10} {4:>10}'.format(
+        'Call site', 'Count', 'Time', 'Max time', 'Rows'))
+
+    for ((site, query), values) in queries:
+        print(query_format.format(site, *values))
+        print('    ' + query)
+
+    if clear:
+        for filename in os.listdir(directory):
+            if stats_file_pattern.search(filename):
+                logger.debug('Removing statistics file %s', filename)
+                os.unlink(os.path.join(directory, filename))
@@ -17,6 +17,7 @@ import logging
 import os
 
 from jsa_proc.action.decorators import ErrorDecorator
+from jsa_proc.action.lease import JSAProcLease
 from jsa_proc.action.datafile_handling \
     import assemble_input_data_for_job, filter_file_list, \
     assemble_parent_data_for_job, write_input_list
@@ -45,6 +46,7 @@ def fetch(job_id=None, db=None, force=False, replaceparent=False, task=None):
     This will advance the state of the job to WAITING on completion.
     Any error's raised in the process will be logged to the job log.
 
+    Returns the job_id if a job was fetched, or None otherwise.
     """
 
     # Check we have sufficient disk space for fetching to occur.
@@ -60,27 +62,34 @@ def fetch(job_id=None, db=None, force=False, replaceparent=False, task=None):
     if not db:
         db = get_database()
 
-    # Get next job if a job_id is not specified.
+    # Claim the next job if a job_id is not specified.
+    claimed = False
+
     if not job_id:
         force = False
 
         logger.debug('Looking for a job for which to fetch data')
 
-        jobs = db.find_jobs(state=JSAProcState.MISSING, location='JAC',
-                            prioritize=True, number=1, sort=True, task=task)
+        job_ids = db.claim_jobs(
+            JSAProcState.MISSING, JSAProcState.FETCHING,
+            'Data is being assembled', location='JAC', task=task,
+            lease=True)
 
-        if jobs:
-            job_id = jobs[0].id
+        if job_ids:
+            job_id = job_ids[0]
+            claimed = True
 
         else:
             logger.warning('Did not find a job to fetch!')
             return
 
-    fetch_a_job(job_id, db=db, force=force, replaceparent=replaceparent)
+    return fetch_a_job(job_id, db=db, force=force,
+                       replaceparent=replaceparent, claimed=claimed)
 
 
 @ErrorDecorator
-def fetch_a_job(job_id, db=None, force=False, replaceparent=False):
+def fetch_a_job(job_id, db=None, force=False, replaceparent=False,
+                claimed=False):
     """
     Assemble the files required to process a job.
 
@@ -95,6 +104,9 @@ def fetch_a_job(job_id, db=None, force=False, replaceparent=False):
     This will raise an error if job is not in MISSING state to start with.
     This will advance the state of the job to WAITING on completion.
 
+    Option 'claimed' indicates that the job has already been moved to
+    the FETCHING state (e.g. by JSAProcDB.claim_jobs).
+
     """
 
     if not db:
@@ -103,20 +115,33 @@ def fetch_a_job(job_id, db=None, force=False, replaceparent=False):
 
     logger.info('About to fetch data for job %i', job_id)
 
-    try:
-        # Change status of job to 'Fetching', raise error if not in MISSING
-        db.change_state(job_id, JSAProcState.FETCHING,
-                        'Data is being assembled',
-                        state_prev=(None if force else JSAProcState.MISSING))
+    if not claimed:
+        try:
+            # Change status of job to 'Fetching', raise error if not in
+            # MISSING.
+            db.change_state(
+                job_id, JSAProcState.FETCHING,
+                'Data is being assembled',
+                state_prev=(None if force else JSAProcState.MISSING))
 
-    except NoRowsError:
-        # If the job was not in the MISSING state, it is likely that another
-        # process is also trying to fetch it.  Trap the error so that the
-        # ErrorDecorator does not put the job into the ERROR state as that
-        # will cause the other process to fail to set the job to WAITING.
-        logger.error('Job %i cannot be fetched because it is not missing',
-                     job_id)
-        return
+        except NoRowsError:
+            # If the job was not in the MISSING state, it is likely that
+            # another process is also trying to fetch it.  Trap the error
+            # so that the ErrorDecorator does not put the job into the ERROR
+            # state as that will cause the other process to fail to set
+            # the job to WAITING.
+            logger.error('Job %i cannot be fetched because it is not missing',
+                         job_id)
+            return
+
+    with JSAProcLease(db, job_id, JSAProcState.FETCHING,
+                      claimed=claimed) as lease:
+        return _fetch_a_job(job_id, db, replaceparent, lease)
+
+
+def _fetch_a_job(job_id, db, replaceparent, lease):
+    """Private function to assemble the files for a job which is
+    in the FETCHING state, held under the given lease."""
 
     # Assemble any files listed in the input files tree
     try:
@@ -137,7 +162,18 @@ def fetch_a_job(job_id, db=None, force=False, replaceparent=False):
                     job_id, p)
                 raise ParentNotReadyError('Parent job {} is not ready'.format(p))
 
-            outputs = db.get_output_files(p)
+        parent_outputs = db.get_output_files_many([p[0] for p in parents])
+
+        for p, f, parent_state in parents:
+            outputs = parent_outputs[p]
+            if not outputs:
+                # Treat a parent without output files as get_output_files
+                # would have done.
+                raise NoRowsError(
+                    'output_file',
+                    'SELECT filename FROM output_file WHERE job_id = ' +
+                    str(p))
+
             parent_files = filter_file_list(outputs, f)
             parent_files_with_paths += assemble_parent_data_for_job(
                 job_id, p, parent_files, force_new=replaceparent)
@@ -149,10 +185,9 @@ def fetch_a_job(job_id, db=None, force=False, replaceparent=False):
     list_name_path = write_input_list(job_id, files_list)
 
     # Advance the state of the job to 'Waiting'.
-    db.change_state(
-        job_id, JSAProcState.WAITING,
-        'Data has been assembled for job and job can now be executed',
-        state_prev=JSAProcState.FETCHING)
+    lease.change_state(
+        JSAProcState.WAITING,
+        'Data has been assembled for job and job can now be executed')
 
     logger.info('Done fetching data for job %i', job_id)
 
@@ -166,44 +201,71 @@ def fetch_output(job_id=None, location=None, task=None,
     logger.debug('Connecting to JSA processing database')
     db = get_database()
 
-    # Find next job if not specified.
+    # Find (and claim, unless this is a dry run) the next job if not
+    # specified.
+    claimed = False
+
     if job_id is None:
         force = False
 
+        # Check we have sufficient disk space before claiming a job.
+        if not _check_output_space(force):
+            return
+
         logger.debug('Looking for a job to fetch output data for')
 
-        jobs = db.find_jobs(
-            state=JSAProcState.INGEST_QUEUE, location=location, task=task,
-            prioritize=True, number=1, sort=True)
+        if dry_run:
+            job_ids = [x.id for x in db.find_jobs(
+                state=JSAProcState.INGEST_QUEUE, location=location, task=task,
+                prioritize=True, number=1, sort=True)]
+
+        else:
+            job_ids = db.claim_jobs(
+                JSAProcState.INGEST_QUEUE, JSAProcState.INGEST_FETCH,
+                'Output data are being retrieved',
+                location=location, task=task, lease=True)
+            claimed = True
 
-        if jobs:
-            job_id = jobs[0].id
+        if job_ids:
+            job_id = job_ids[0]
 
         else:
             logger.warning('Did not find a job to fetch output data for!')
             return
 
-    _fetch_job_output(job_id, db=db, force=force, dry_run=dry_run)
+    _fetch_job_output(job_id, db=db, force=force, dry_run=dry_run,
+                      claimed=claimed)
 
 
-@ErrorDecorator
-def _fetch_job_output(job_id, db, force=False, dry_run=False):
-    """Private function to perform retrieval of job output files from CADC.
-    """
+def _check_output_space(force):
+    """Check we have sufficient disk space for fetching output to occur."""
 
-    # Check we have sufficient disk space for fetching to occur.
     output_space = get_output_dir_space()
     required_space = float(get_config().get('disk_limit', 'fetch_min_space'))
 
     if output_space < required_space and not force:
         logger.warning('Insufficient disk space: %f / %f GiB required',
                        output_space, required_space)
+        return False
+
+    return True
+
+
+@ErrorDecorator
+def _fetch_job_output(job_id, db, force=False, dry_run=False, claimed=False):
+    """Private function to perform retrieval of job output files from CADC.
+
+    If "claimed" is specified, the job has already been moved to the
+    INGEST_FETCH state and the disk space checked.
+    """
+
+    if not (claimed or _check_output_space(force)):
         return
 
     logger.info('About to retreive output data for job %i', job_id)
 
     # Change state from INGEST_QUEUE to INGEST_FETCH.
-    if not dry_run:
+    if not (dry_run or claimed):
         try:
             db.change_state(
                 job_id, JSAProcState.INGEST_FETCH,
@@ -214,6 +276,19 @@ def _fetch_job_output(job_id, db, force=False, dry_run=False):
                          ' as it not waiting for reingestion', job_id)
             return
 
+    if dry_run:
+        return _fetch_job_output_files(job_id, db, dry_run, None)
+
+    with JSAProcLease(db, job_id, JSAProcState.INGEST_FETCH,
+                      claimed=claimed) as lease:
+        return _fetch_job_output_files(job_id, db, dry_run, lease)
+
+
+def _fetch_job_output_files(job_id, db, dry_run, lease):
+    """Private function to retrieve the missing output files for a job
+    which is in the INGEST_FETCH state, held under the given lease
+    (unless this is a dry run)."""
+
     # Check state of output files.
     output_dir = get_output_dir(job_id)
     output_files = db.get_output_files(job_id, with_info=True)
@@ -269,7 +344,6 @@ def _fetch_job_output(job_id, db, force=False, dry_run=False):
 
     # Finally set the state to INGESTION.
     if not dry_run:
-        db.change_state(
-            job_id, JSAProcState.INGESTION,
-            'Output data have been retrieved',
-            state_prev=JSAProcState.INGEST_FETCH)
+        lease.change_state(
+            JSAProcState.INGESTION,
+            'Output data have been retrieved')
@@ -0,0 +1,159 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Leases on jobs in active states.
+
+While a process is fetching, running or ingesting a job, it holds a
+lease on the job (in the job_lease table) and periodically renews its
+heartbeat.  If the process is killed, or its node crashes, the
+heartbeat stops and the state machine's poll returns the job to
+the state from which it was taken (see JSAProcDB.reap_leases).
+"""
+
+from __future__ import absolute_import
+
+import logging
+from threading import Event, Thread
+
+from jsa_proc.config import get_config
+from jsa_proc.error import JSAProcError, LeaseLostError
+from jsa_proc.state import JSAProcState
+
+logger = logging.getLogger(__name__)
+
+# States in which jobs can be leased, and the states to which they
+# are returned if the lease expires.
+lease_states = {
+    JSAProcState.FETCHING: JSAProcState.MISSING,
+    JSAProcState.RUNNING: JSAProcState.WAITING,
+    JSAProcState.INGEST_FETCH: JSAProcState.INGEST_QUEUE,
+    JSAProcState.INGESTING: JSAProcState.INGESTION,
+}
+
+
+def get_lease_config():
+    """Read the "lease" section of the configuration file.
+
+    Returns a tuple of the heartbeat interval and the time after which
+    leases expire (both in seconds).
+    """
+
+    config = get_config()
+
+    def get_option(name, default):
+        if config.has_option('lease', name):
+            return float(config.get('lease', name))
+        return default
+
+    return (get_option('heartbeat_interval', 300.0),
+            get_option('timeout', 3600.0))
+
+
+class JSAProcLease(object):
+    """Context manager holding a lease on a job.
+
+    On entry a lease is recorded for the job, and a thread is started
+    which renews it every "interval" seconds (by default the configured
+    heartbeat interval).  On exit the thread is stopped and the lease
+    removed.  The job should already have been moved into the given
+    state, and any following state change should be made before exit.
+
+    If "claimed" is specified, the lease was already recorded when the
+    job was claimed (see JSAProcDB.claim_jobs).
+
+    The job should be moved out of the leased state using the
+    change_state method, which only changes the job if the lease is
+    still held.  If the lease has been lost (e.g. the job was reclaimed
+    by the state machine while this process was unresponsive), the
+    "lost" attribute is set and any exception raised in the block is
+    logged and suppressed, so that the job is not marked as failed.
+    """
+
+    def __init__(self, db, job_id, state, interval=None, claimed=False):
+        if state not in lease_states:
+            raise JSAProcError(
+                'Jobs can not be leased in state {0}'.format(state))
+
+        if interval is None:
+            (interval, timeout) = get_lease_config()
+
+        self.db = db
+        self.job_id = job_id
+        self.state = state
+        self.interval = interval
+        self.claimed = claimed
+        self.lost = False
+
+        self._released = False
+        self._stop = Event()
+        self._thread = None
+
+    def __enter__(self):
+        if not self.claimed:
+            self.db.add_lease(
+                self.job_id, self.state, lease_states[self.state])
+
+        self._thread = Thread(
+            target=self._heartbeat, name='lease-{0}'.format(self.job_id))
+        self._thread.daemon = True
+        self._thread.start()
+
+        return self
+
+    def __exit__(self, type_, value, tb):
+        self._stop.set()
+        self._thread.join()
+
+        if type_ is not None and not self.lost:
+            self.lost = not self.db.renew_lease(self.job_id)
+
+        if not self._released:
+            self.db.remove_lease(self.job_id)
+
+        if type_ is not None and self.lost:
+            logger.error('Lease on job %i was lost, not changing state: %s',
+                         self.job_id, value)
+            return True
+
+    def change_state(self, newstate, message):
+        """Move the job out of the leased state and release the lease.
+
+        Raises LeaseLostError (and sets the "lost" attribute) if the
+        lease is no longer held, in which case the job is not changed.
+        """
+
+        try:
+            self.db.release_lease(self.job_id, newstate, message)
+
+        except LeaseLostError:
+            self.lost = True
+            raise
+
+        self._released = True
+
+    def _heartbeat(self):
+        """Renew the lease until stopped, or until it is lost."""
+
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.db.renew_lease(self.job_id):
+                    logger.warning('Lease on job %i has been lost',
+                                   self.job_id)
+                    self.lost = True
+                    break
+
+            except Exception:
+                logger.exception('Error renewing lease on job %i',
+                                 self.job_id)
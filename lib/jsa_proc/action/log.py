@@ -29,7 +29,7 @@ logger = logging.getLogger(__name__)
 def search_log_files(
         pattern, filename_pattern, task,
         project=None, state=None, after_context=None):
-    db = get_database()
+    db = get_database(read_replica=True)
 
     re_pattern = re.compile(pattern)
     re_filename = re.compile(filename_pattern)
@@ -50,9 +50,8 @@ def search_log_files(
     if project is not None:
         search_kwargs['obsquery'] = {'project': project}
 
-    jobs = [x.id for x in db.find_jobs(**search_kwargs)]
-
-    for job_id in jobs:
+    for job in db.iter_jobs(**search_kwargs):
+        job_id = job.id
         logger.debug('Checking log files for job %i', job_id)
 
         log_dir = get_log_dir(job_id)
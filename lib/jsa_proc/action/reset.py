@@ -13,6 +13,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import defaultdict
 import logging
 
 from jsa_proc.config import get_database
@@ -49,8 +50,9 @@ def reset_jobs(task, date_start, date_end, instrument=None,
         state = JSAProcState.lookup_name(state)
 
     n_active = 0
+    reset = defaultdict(list)
 
-    for job in db.find_jobs(location='JAC', task=task, obsquery=obsquery,
+    for job in db.iter_jobs(location='JAC', task=task, obsquery=obsquery,
                             state=state):
         state_info = JSAProcState.get_info(job.state)
 
@@ -64,9 +66,17 @@ def reset_jobs(task, date_start, date_end, instrument=None,
         logger.info('Resetting status of job %i (was %s)',
                     job.id, state_info.name)
 
-        if not dry_run:
-            db.change_state(job.id, JSAProcState.UNKNOWN,
-                            'Resetting job', state_prev=job.state)
+        # Group the jobs by their current state so that they can be
+        # reset together.
+        reset[job.state].append(job.id)
+
+    if not dry_run:
+        for (state_prev, job_ids) in reset.items():
+            for job_id in db.change_states(job_ids, JSAProcState.UNKNOWN,
+                                           'Resetting job',
+                                           state_prev=state_prev):
+                logger.warning('Job %i was not reset: its state changed',
+                               job_id)
 
     if n_active:
         raise CommandError(
@@ -24,6 +24,7 @@ from jsa_proc.config import get_config, get_database
 from jsa_proc.state import JSAProcState
 from jsa_proc.error import JSAProcError, NoRowsError
 from jsa_proc.action.decorators import ErrorDecorator
+from jsa_proc.action.lease import JSAProcLease
 from jsa_proc.action.datafile_handling import get_output_files, input_list_name, \
     get_output_log_files
 from jsa_proc.action.job_running import jsawrapdr_run
@@ -52,6 +53,8 @@ def run_job(job_id=None, db=None, force=False, task=None):
     If insufficient disk space is available (as configured by the disk_limit
     section of the configuration file) then this function returns without
     doing anything.
+
+    Returns the job_id if a job was run, or None otherwise.
     """
 
     # Check we have sufficient disk space for running to occur.
@@ -75,27 +78,38 @@ def run_job(job_id=None, db=None, force=False, task=None):
     if not db:
         db = get_database()
 
-    # Get next job if a job id is not specified
+    # Claim the next job if a job id is not specified
+    claimed = False
+
     if not job_id:
         force = False
 
         logger.debug('Looking for a job to run')
 
-        jobs = db.find_jobs(state=JSAProcState.WAITING, location='JAC',
-                            prioritize=True, number=1, sort=True, task=task)
+        job_ids = db.claim_jobs(
+            JSAProcState.WAITING, JSAProcState.RUNNING,
+            _run_message(), location='JAC', task=task, lease=True)
 
-        if jobs:
-            job_id = jobs[0].id
+        if job_ids:
+            job_id = job_ids[0]
+            claimed = True
 
         else:
             logger.warning('Did not find a job to run!')
             return
 
-    run_a_job(job_id, db=db, force=force)
+    return run_a_job(job_id, db=db, force=force, claimed=claimed)
+
+
+def _run_message():
+    """Prepare the log message for a job about to be run on this host."""
+
+    return 'Job is about to be run on host {0}'.format(
+        gethostname().partition('.')[0])
 
 
 @ErrorDecorator
-def run_a_job(job_id, db=None, force=False):
+def run_a_job(job_id, db=None, force=False, claimed=False):
     """
     Run the JSA processing of the given job_id (integer).
 
@@ -103,6 +117,9 @@ def run_a_job(job_id, db=None, force=False):
     config. Optionally a database object can be given for testing
     purposes.
 
+    If "claimed" is specified, the job has already been moved to the
+    RUNNING state (e.g. by JSAProcDB.claim_jobs).
+
     """
 
     if not db:
@@ -111,22 +128,32 @@ def run_a_job(job_id, db=None, force=False):
 
     logger.info('About to run job %i', job_id)
 
-    try:
-        # Change status of job to Running, raise an error if not currently in
-        # WAITING state.
-        db.change_state(job_id, JSAProcState.RUNNING,
-                        'Job is about to be run on host {0}'.format(
-                            gethostname().partition('.')[0]),
-                        state_prev=(None if force else JSAProcState.WAITING))
+    if not claimed:
+        try:
+            # Change status of job to Running, raise an error if not
+            # currently in WAITING state.
+            db.change_state(
+                job_id, JSAProcState.RUNNING, _run_message(),
+                state_prev=(None if force else JSAProcState.WAITING))
+
+        except NoRowsError:
+            # If the job was not in the WAITING state, it is likely that
+            # another process is also trying to run it.  Trap the error so
+            # that the ErrorDecorator does not put the job into the ERROR
+            # state as that will cause the other process to fail to set the
+            # job to PROCESSED.
+            logger.error('Job %i cannot be run because it is not waiting',
+                         job_id)
+            return
 
-    except NoRowsError:
-        # If the job was not in the WAITING state, it is likely that another
-        # process is also trying to run it.  Trap the error so that the
-        # ErrorDecorator does not put the job into the ERROR state as that
-        # will cause the other process to fail to set the job to PROCESSED.
-        logger.error('Job %i cannot be run because it is not waiting',
-                     job_id)
-        return
+    with JSAProcLease(db, job_id, JSAProcState.RUNNING,
+                      claimed=claimed) as lease:
+        return _run_a_job(job_id, db, lease)
+
+
+def _run_a_job(job_id, db, lease):
+    """Private function to run a job which is in the RUNNING state,
+    held under the given lease."""
 
     # Input file_list -- this should be better? or in jsawrapdr?
 
@@ -147,18 +174,15 @@ def run_a_job(job_id, db=None, force=False):
             logstring = 'Input file %s for job %i has gone missing' % (
                 input_file, job_id)
             logger.error(logstring)
-            logs = db.get_logs(job_id)
-            states = [i.state_new for i in logs]
 
             # If it has only been in the state MISSING twice before, then try
             # again.
-            if states.count(JSAProcState.MISSING) <= 2:
+            if db.count_state_entries(job_id, JSAProcState.MISSING) <= 2:
                 logstring += ': moving to missing.'
                 logger.warning('Moving job %i to state MISSING due to '
                                'missing file(s) %s',
                                job_id, input_file)
-                db.change_state(job_id, JSAProcState.MISSING,
-                                logstring, state_prev=JSAProcState.RUNNING)
+                lease.change_state(JSAProcState.MISSING, logstring)
                 return job_id
 
             else:
@@ -262,10 +286,9 @@ def run_a_job(job_id, db=None, force=False):
 
 
     # Change state of job.
-    db.change_state(
-        job_id, JSAProcState.PROCESSED,
-        'Job has been successfully processed',
-        state_prev=JSAProcState.RUNNING)
+    lease.change_state(
+        JSAProcState.PROCESSED,
+        'Job has been successfully processed')
 
     logger.info('Done running job %i', job_id)
 
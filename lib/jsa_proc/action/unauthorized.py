@@ -53,7 +53,7 @@ def investigate_unauthorized_errors(location, check_at_cadc=True):
     caom2 = CADCTap()
 
     logger.debug('Fetching list of jobs in the error state')
-    job_logs = db.find_errors_logs(location=location)
+    job_logs = db.find_errors_logs(location=location, latest_only=True)
 
     logger.debug('Filtering for jobs with unauthorized errors')
     filter = JSAProcErrorFilter('unauthorized')
@@ -63,6 +63,13 @@ def investigate_unauthorized_errors(location, check_at_cadc=True):
     category = {'unknown': []}
     job_info = {}
 
+    logger.debug('Fetching observation info')
+    job_obs_info = db.get_obs_info_many(list(job_logs.keys()))
+
+    if check_at_cadc:
+        logger.debug('Retrieving input file lists')
+        job_input_files = db.get_input_files_many(list(job_logs.keys()))
+
     for job_id in job_logs.keys():
         logger.debug('Checking job %i', job_id)
 
@@ -72,8 +79,7 @@ def investigate_unauthorized_errors(location, check_at_cadc=True):
             # Find the observation IDs and use it to determine whether the
             # job uses any observations which are not yet public.
 
-            logger.debug('Fetching observation info')
-            obs_info = db.get_obs_info(job_id)
+            obs_info = job_obs_info[job_id]
             job_info[job_id] = {'obs': obs_info}
 
             if not obs_info:
@@ -112,8 +118,7 @@ def investigate_unauthorized_errors(location, check_at_cadc=True):
 
             # Check whether all of the files are at CADC.
             if check_at_cadc:
-                logger.debug('Retrieving input file list')
-                files = db.get_input_files(job_id)
+                files = job_input_files[job_id]
 
                 logger.debug('Checking for files at CADC')
                 found = check_cadc_files(files)
@@ -58,26 +58,7 @@ def validate_job(job_id, db):
         except NoRowsError:
             parents = None
 
-        if not input and not parents:
-            raise ValidationError(
-                'Neither input file list nor parents could be retrieved')
-
-        # Check that the job has a mode string which jsawrapdr will
-        # acccept.
-        if job.mode not in valid_modes:
-            raise ValidationError('invalid mode: {0}'.format(job.mode))
-
-        # Check that we have some input files.
-        if not input and not parents:
-            raise ValidationError('input file list is empty')
-
-        # Ensure input filenames are plain names without path or
-        # extension.
-        if input:
-            for file in input:
-                if not valid_file.match(file):
-                    raise ValidationError(
-                        'invalid input file: {0}'.format(file))
+        _check_job(job, input, parents)
 
     except ValidationError as e:
         logger.error('Job %i failed validation: %s', job_id, e.args[0])
@@ -94,6 +75,76 @@ def validate_job(job_id, db):
                         state_prev=JSAProcState.UNKNOWN)
 
 
+def validate_jobs(job_ids, db):
+    """Attempt to validate a number of jobs.
+
+    This is equivalent to calling validate_job for each job ID except
+    that the information about the jobs is retrieved together
+    and the jobs which pass validation are moved to the QUEUED state
+    together.
+
+    Returns a list of the identifiers of jobs which did not exist or
+    were no longer in the UNKNOWN state, and so could not be updated.
+    """
+
+    jobs = db.get_jobs_many(job_ids)
+    inputs = db.get_input_files_many(job_ids)
+    parents = db.get_parents_many(job_ids)
+
+    passed = []
+    unmatched = [x for x in job_ids if x not in jobs]
+
+    for (job_id, job) in sorted(jobs.items()):
+        try:
+            _check_job(job, inputs[job.id], parents[job.id])
+
+        except ValidationError as e:
+            logger.error('Job %i failed validation: %s', job.id, e.args[0])
+            unmatched.extend(db.change_states(
+                [job.id], JSAProcState.ERROR,
+                'Job failed validation: ' + e.args[0],
+                state_prev=JSAProcState.UNKNOWN))
+
+        else:
+            logger.debug('Job %i passed validation', job.id)
+            passed.append(job.id)
+
+    if passed:
+        unmatched.extend(db.change_states(
+            passed, JSAProcState.QUEUED, 'Job passed validation',
+            state_prev=JSAProcState.UNKNOWN))
+
+    return unmatched
+
+
+def _check_job(job, input, parents):
+    """Check a job, given its input files and parents.
+
+    Raises ValidationError if the job is not valid.
+    """
+
+    if not input and not parents:
+        raise ValidationError(
+            'Neither input file list nor parents could be retrieved')
+
+    # Check that the job has a mode string which jsawrapdr will
+    # acccept.
+    if job.mode not in valid_modes:
+        raise ValidationError('invalid mode: {0}'.format(job.mode))
+
+    # Check that we have some input files.
+    if not input and not parents:
+        raise ValidationError('input file list is empty')
+
+    # Ensure input filenames are plain names without path or
+    # extension.
+    if input:
+        for file in input:
+            if not valid_file.match(file):
+                raise ValidationError(
+                    'invalid input file: {0}'.format(file))
+
+
 def validate_output(job_id, db, dry_run=False):
     """Attempt to validate a job's output file list.
 
@@ -0,0 +1,327 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Long-running daemon hosting the processing stages.
+
+Rather than starting a separate process (e.g. from cron) for each
+invocation of the poll, fetch, run, transfer, ingest and ptransfer
+commands, the daemon runs a loop for each of these stages in a thread
+of a single process.  The stages therefore share the database access
+object (and its connection pool and caches) and the configuration.
+
+Each loop repeatedly performs one "step" of its stage.  When a step
+finds work to do (e.g. a job was fetched), the next step is performed
+immediately.  Otherwise the loop backs off, waiting for an interval
+which starts at min_interval and doubles after each idle step, up to
+max_interval.  Steps of the transfer, ingest and ptransfer stages
+process all of the available work, so these are always followed by
+an interval.
+
+The fetch, run and ingest stages claim jobs atomically, so they
+can have several worker threads.  (When using MySQL, the connection
+pool_size should then be increased.)  For the poll stage, the number
+of workers is passed to the state machine, which operates in
+concurrent mode if it is greater than one.  The poll stage also uses
+a scheduler (see jsa_proc.admin.scheduler) so that jobs waiting for
+parent jobs are only considered once their parents are ready.
+"""
+
+from __future__ import absolute_import
+
+import logging
+import signal
+from threading import Event, Thread
+import time
+
+from jsa_proc.action.lease import get_lease_config
+from jsa_proc.config import get_config
+from jsa_proc.error import JSAProcError
+
+logger = logging.getLogger(__name__)
+
+# Stages which can be run by the daemon, in the order in which they
+# are started.
+daemon_stages = ('poll', 'fetch', 'run', 'transfer', 'ingest', 'ptransfer')
+
+# Stages which claim jobs atomically, and so can run several
+# worker threads.
+daemon_multiple_stages = set(('fetch', 'run', 'ingest'))
+
+
+def get_daemon(db, stages=None, task=None):
+    """Construct a daemon object using the "daemon" section of the
+    configuration file.
+
+    The stages to run are given by the "stages" argument, or otherwise
+    the "stages" entry (a comma-separated list), defaulting to all stages.
+    The number of workers for each stage is given by entries such
+    as "run_workers" (default 1).  The lease timeout is read from
+    the "lease" section.
+    """
+
+    config = get_config()
+
+    def get_option(name, default):
+        if config.has_option('daemon', name):
+            return config.get('daemon', name)
+        return default
+
+    if stages is None:
+        stages = [
+            x.strip() for x in get_option('stages', '').split(',')
+            if x.strip()] or daemon_stages
+
+    workers = {}
+    for stage in stages:
+        workers[stage] = int(get_option(stage + '_workers', 1))
+
+    (heartbeat_interval, lease_timeout) = get_lease_config()
+
+    return JSAProcDaemon(
+        db, stages=stages, workers=workers, task=task,
+        min_interval=float(get_option('min_interval', 1.0)),
+        max_interval=float(get_option('max_interval', 60.0)),
+        full_poll_interval=float(get_option('full_poll_interval', 600.0)),
+        lease_timeout=lease_timeout)
+
+
+class JSAProcDaemon(object):
+    """Class running the processing stages in a single process."""
+
+    def __init__(self, db, stages=daemon_stages, workers=None, task=None,
+                 min_interval=1.0, max_interval=60.0,
+                 full_poll_interval=600.0, lease_timeout=None):
+        """Construct daemon object.
+
+        Arguments:
+            db: database access object.
+            stages: list of names of stages to run.
+            workers: dictionary of numbers of workers by stage
+                (default 1).
+            task: list of tasks to which the fetch, run, transfer
+                and ingest stages should be restricted.
+            min_interval: initial interval (seconds) after an idle step.
+            max_interval: maximum interval after idle steps.
+            full_poll_interval: interval at which the poll stage
+                considers all jobs, rather than only those for which
+                state change events have been seen.
+            lease_timeout: time (seconds) after which full polls
+                reclaim jobs whose leases have not been renewed.
+        """
+
+        for stage in stages:
+            if stage not in daemon_stages:
+                raise JSAProcError('Unknown daemon stage "{0}"'.format(stage))
+
+        if workers is None:
+            workers = {}
+
+        for (stage, n_workers) in workers.items():
+            if n_workers < 1:
+                raise JSAProcError(
+                    'Number of {0} workers must be positive'.format(stage))
+            if n_workers > 1 and stage not in daemon_multiple_stages \
+                    and stage != 'poll':
+                raise JSAProcError(
+                    'Stage {0} can not have multiple workers'.format(stage))
+
+        self.db = db
+        self.stages = [x for x in daemon_stages if x in stages]
+        self.workers = workers
+        self.task = task
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.full_poll_interval = full_poll_interval
+        self.lease_timeout = lease_timeout
+
+        self._stop = Event()
+
+        # State of the poll stage.
+        self._state_machine = None
+        self._since_id = None
+        self._next_full_poll = None
+
+    def stop(self):
+        """Request that the daemon stops.
+
+        Each stage finishes its current step (which may take a long
+        time, e.g. when running a job) and then exits.
+        """
+
+        if not self._stop.is_set():
+            logger.info('Stopping daemon')
+            self._stop.set()
+
+    def stopping(self):
+        """Determine whether the daemon has been asked to stop."""
+
+        return self._stop.is_set()
+
+    def run(self):
+        """Run the stages until the daemon is stopped.
+
+        If called from the main thread, SIGTERM and SIGINT are handled
+        by stopping the daemon gracefully.
+        """
+
+        previous_handlers = {}
+
+        try:
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                previous_handlers[signum] = signal.signal(
+                    signum, lambda signum, frame: self.stop())
+
+        except ValueError:
+            # Not in the main thread: signals can not be handled.
+            pass
+
+        try:
+            threads = []
+
+            for stage in self.stages:
+                n_threads = 1 if stage == 'poll' \
+                    else self.workers.get(stage, 1)
+
+                for i in range(n_threads):
+                    thread = Thread(
+                        target=self._stage_loop, args=(stage,),
+                        name='{0}-{1}'.format(stage, i))
+                    thread.start()
+                    threads.append(thread)
+
+            logger.info('Started daemon with %i threads', len(threads))
+
+            # Join with a timeout so that signals continue to be handled.
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1.0)
+
+            logger.info('Daemon stopped')
+
+        finally:
+            for (signum, handler) in previous_handlers.items():
+                signal.signal(signum, handler)
+
+    def _stage_loop(self, stage):
+        """Repeatedly perform steps of the given stage, backing off
+        while no work is found, until the daemon is stopped."""
+
+        step = getattr(self, '_step_' + stage)
+        interval = self.min_interval
+
+        logger.debug('Starting %s stage', stage)
+
+        while not self.stopping():
+            try:
+                found_work = step()
+
+            except Exception:
+                logger.exception('Error in %s stage', stage)
+                found_work = False
+
+            if found_work:
+                interval = self.min_interval
+                continue
+
+            logger.debug('No work for %s stage, waiting %f seconds',
+                         stage, interval)
+            self._stop.wait(interval)
+            interval = min(interval * 2, self.max_interval)
+
+        logger.debug('Finished %s stage', stage)
+
+    def _step_poll(self):
+        """Update the status of JAC jobs.
+
+        Periodically all jobs in states handled by the state machine
+        are considered, and jobs with expired leases are reclaimed.
+        Otherwise only jobs for which there have been state change
+        events are considered.
+        """
+
+        if self._state_machine is None:
+            from jsa_proc.admin.scheduler import JSAProcParentScheduler
+            from jsa_proc.admin.statemachine import JSAProcStateMachine
+
+            n_workers = self.workers.get('poll', 1)
+            self._state_machine = JSAProcStateMachine(
+                self.db, workers=(n_workers if n_workers > 1 else None),
+                scheduler=JSAProcParentScheduler(self.db),
+                lease_timeout=self.lease_timeout)
+
+        now = time.time()
+
+        if self._next_full_poll is None or now >= self._next_full_poll:
+            # Read the event cursor first so that changes made during
+            # the poll are seen by the next step.
+            self._since_id = self.db.get_last_event_id()
+            self._state_machine.poll_jac_jobs()
+            self._next_full_poll = now + self.full_poll_interval
+            return True
+
+        (events, self._since_id) = self.db.wait_for_events(
+            self._since_id, states=list(self._state_machine.handlers.keys()),
+            timeout=0)
+
+        job_ids = set(event.job_id for event in events)
+
+        # Include queued jobs whose parents have become ready.
+        job_ids.update(self._state_machine.scheduler.update())
+
+        if not job_ids:
+            return False
+
+        job_ids = sorted(job_ids)
+
+        self._state_machine.poll_jac_jobs(job_ids=job_ids)
+        return True
+
+    def _step_fetch(self):
+        """Fetch the data for the next job in the MISSING state."""
+
+        from jsa_proc.action.fetch import fetch
+
+        return fetch(db=self.db, task=self.task) is not None
+
+    def _step_run(self):
+        """Run the next job in the WAITING state."""
+
+        from jsa_proc.action.run import run_job
+
+        return run_job(db=self.db, task=self.task) is not None
+
+    def _step_transfer(self):
+        """Transfer the output of jobs in the PROCESSED state."""
+
+        from jsa_proc.action.transfer import transfer_poll
+
+        transfer_poll(self.db, task=self.task)
+        return False
+
+    def _step_ingest(self):
+        """Ingest the output of jobs waiting for ingestion."""
+
+        from jsa_proc.cadc.ingest import ingest_output
+
+        ingest_output(None, location='JAC', task=self.task, db=self.db)
+        return False
+
+    def _step_ptransfer(self):
+        """Put files from the e-transfer directories into the archive."""
+
+        from jsa_proc.cadc.ptransfer import ptransfer_poll
+
+        ptransfer_poll()
+        return False
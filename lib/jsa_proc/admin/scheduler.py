@@ -0,0 +1,174 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""In-memory scheduling of jobs which depend on parent jobs.
+
+Jobs with parents (e.g. coadds) remain in the QUEUED state until all
+of their parents have been processed.  Without a scheduler, the state
+machine checks the parents of each such job on every poll.  The
+JSAProcParentScheduler class instead keeps the relationships between
+queued jobs and their parents in memory, with a count for each job
+of the parents which are not yet ready.  These counts are updated
+from the job state change events in the log table, so that a job
+is only passed to the state machine once all of its parents are
+ready.
+
+The scheduler only acts as a filter: the state machine still checks
+the parents of the jobs which it is given.
+"""
+
+from __future__ import absolute_import
+
+from collections import defaultdict
+import logging
+
+from jsa_proc.state import JSAProcState
+
+logger = logging.getLogger(__name__)
+
+
+class JSAProcParentScheduler(object):
+    """Dependency graph of queued jobs and their parents."""
+
+    def __init__(self, db):
+        self.db = db
+
+        # Event cursor: the identifier of the last log entry applied.
+        self._since_id = None
+
+        # Queued jobs whose parents have been loaded.
+        self._queued = set()
+
+        # Graph edges: parents of each queued job, and queued
+        # children of each parent.
+        self._parents = {}
+        self._children = defaultdict(set)
+
+        # Whether each parent is ready, and the number of parents
+        # of each queued job which are not ready.
+        self._ready = {}
+        self._n_waiting = {}
+
+    def update(self):
+        """Apply the job state change events since the last update.
+
+        Returns a list of the identifiers of queued jobs for which the
+        last parents became ready as a result.
+        """
+
+        if self._since_id is None:
+            self._since_id = self.db.get_last_event_id()
+            return []
+
+        released = set()
+
+        while True:
+            (events, self._since_id) = self.db.wait_for_events(
+                self._since_id, timeout=0)
+
+            if not events:
+                break
+
+            for event in events:
+                released.update(self._apply(event.job_id, event.state_new))
+
+        # A job may since have been blocked again, or left the queue.
+        return sorted(
+            x for x in released
+            if x in self._queued and not self._n_waiting[x])
+
+    def filter_jobs(self, jobs):
+        """Filter a list of queued jobs, removing those which are
+        known to be waiting for parent jobs.
+
+        The parents of jobs which have not been seen before are
+        retrieved from the database (for all such jobs together).
+        update() should be called first so that the event cursor is
+        set before the parents' states are read.
+        """
+
+        new_job_ids = [job.id for job in jobs if job.id not in self._queued]
+
+        if new_job_ids:
+            self._load(new_job_ids)
+
+        result = [job for job in jobs if not self._n_waiting[job.id]]
+
+        logger.debug('%i of %i queued jobs are waiting for parents',
+                     len(jobs) - len(result), len(jobs))
+
+        return result
+
+    def _load(self, job_ids):
+        """Load the parents of the given queued jobs."""
+
+        for (job_id, parents) in self.db.get_parents_many(
+                job_ids, with_state=True).items():
+            self._queued.add(job_id)
+            self._parents[job_id] = set()
+            self._n_waiting[job_id] = 0
+
+            for (parent, filter_, parent_state) in parents:
+                if parent not in self._ready:
+                    self._ready[parent] = \
+                        parent_state in JSAProcState.STATE_POST_RUN
+
+                self._parents[job_id].add(parent)
+                self._children[parent].add(job_id)
+
+                if not self._ready[parent]:
+                    self._n_waiting[job_id] += 1
+
+    def _apply(self, job_id, state):
+        """Apply a state change event.
+
+        Returns a list of the identifiers of queued jobs whose count of
+        parents which are not ready reached zero.
+        """
+
+        released = []
+
+        if job_id in self._ready:
+            ready = state in JSAProcState.STATE_POST_RUN
+
+            if ready != self._ready[job_id]:
+                self._ready[job_id] = ready
+
+                for child in self._children[job_id]:
+                    if ready:
+                        self._n_waiting[child] -= 1
+                        if not self._n_waiting[child]:
+                            released.append(child)
+                    else:
+                        self._n_waiting[child] += 1
+
+        if job_id in self._queued and state != JSAProcState.QUEUED:
+            self._remove(job_id)
+
+        return released
+
+    def _remove(self, job_id):
+        """Remove a job which is no longer queued from the graph."""
+
+        self._queued.discard(job_id)
+        del self._n_waiting[job_id]
+
+        for parent in self._parents.pop(job_id):
+            children = self._children[parent]
+            children.discard(job_id)
+
+            if not children:
+                del self._children[parent]
+                del self._ready[parent]
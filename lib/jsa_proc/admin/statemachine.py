@@ -13,35 +13,105 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
+import functools
 import logging
 
 from jsa_proc.action.datafile_handling \
-    import get_jac_input_data, write_input_list, check_data_already_present
-from jsa_proc.action.validate import validate_job
+    import get_jac_input_data, write_input_list, \
+    check_data_already_present, find_data_already_present
+from jsa_proc.action.validate import validate_job, validate_jobs
 from jsa_proc.admin.directories import get_output_dir
 from jsa_proc.cadc.preview import fetch_cadc_previews
-from jsa_proc.db.db import Not
-from jsa_proc.error import NotAtJACError, ParentNotReadyError
+from jsa_proc.db.fanout import run_calls
+from jsa_proc.error import JSAProcError, NotAtJACError, ParentNotReadyError
 from jsa_proc.state import JSAProcState
 
 logger = logging.getLogger(__name__)
 
+# Number of jobs handled at a time in concurrent mode.
+concurrent_batch_size = 1000
+
+
+def state_handler(*states):
+    """Decorator for JSAProcStateMachine methods which handle jobs
+    in the given states.
+
+    The decorated method is called with a list of jobs (namedtuples as
+    returned by JSAProcDB.find_jobs) in one of these states, and should
+    return the number of jobs for which errors were encountered.
+    """
+
+    def decorator(method):
+        method.handled_states = states
+        return method
+
+    return decorator
+
 
 class JSAProcStateMachine:
-    def __init__(self, db):
+    """State machine for advancing JAC jobs through their states.
+
+    Only the states for which there is a handler method (tagged
+    with the state_handler decorator) are polled.  Jobs in other states,
+    such as WAITING or RUNNING, are advanced by separate processes.
+
+    If a number of workers is given, the handlers operate in concurrent
+    mode: the information about the jobs is retrieved from the database
+    in bulk, filesystem checks are performed using the given number
+    of threads, and the state changes are applied in batches.
+
+    If a scheduler (jsa_proc.admin.scheduler.JSAProcParentScheduler)
+    is given, queued jobs which it knows to be waiting for parent jobs
+    are not considered.
+
+    If a lease timeout (seconds) is given, each full poll first returns
+    jobs whose leases have expired (see jsa_proc.action.lease) to the
+    states from which they were taken.
+    """
+
+    def __init__(self, db, workers=None, scheduler=None, lease_timeout=None):
         self.db = db
+        self.workers = workers
+        self.scheduler = scheduler
+        self.lease_timeout = lease_timeout
+
+        # Registry of handlers by state, in the order of
+        # JSAProcState.STATE_ALL, which is the order in which they
+        # are polled.
+        handlers = {}
+        for name in dir(self):
+            method = getattr(self, name)
+            for state in getattr(method, 'handled_states', ()):
+                if state in handlers:
+                    raise JSAProcError(
+                        'Multiple handlers for state {0}'.format(state))
+                handlers[state] = method
+
+        self.handlers = OrderedDict(
+            (state, handlers[state]) for state in JSAProcState.STATE_ALL
+            if state in handlers)
 
     def poll(self):
-        self.poll_jac_jobs(self)
+        self.poll_jac_jobs()
 
-    def poll_jac_jobs(self, etransfer=True):
-        """Try to update status of all JAC jobs.
+    def poll_jac_jobs(self, etransfer=True, job_ids=None, batch_size=None):
+        """Try to update status of JAC jobs.
 
-        For all jobs to be run at JAC, look at the current status
-        and move on to the next status if possible.
+        For jobs to be run at JAC, in states for which there is a
+        handler, move on to the next status if possible.  Each handled
+        state is queried separately, in order of job priority.
 
         Arguments:
             etransfer: True to enable e-transfer steps.
+            job_ids: list of job identifiers to consider, otherwise
+                all JAC jobs in handled states are considered (after
+                reaping expired leases, if a lease timeout was given).
+            batch_size: maximum number of jobs in each state to consider
+                (when job_ids is not given).  Remaining jobs are left
+                for the next poll.  Note that jobs which remain in their
+                state (e.g. QUEUED jobs with parents which are not ready)
+                count towards this limit.
 
         Returns true if there were no errors.
         """
@@ -49,89 +119,103 @@ class JSAProcStateMachine:
         logger.info('Starting update of JAC job status')
         n_err = 0
 
-        for job in self.db.find_jobs(location='JAC',
-                                     state=Not(JSAProcState.STATE_FINAL)):
-            logger.debug('Checking state of job %i', job.id)
+        # Reclaim jobs whose worker processes have stopped.
+        if job_ids is None and self.lease_timeout is not None:
+            reaped = self.db.reap_leases(self.lease_timeout)
 
-            try:
-                if job.state == JSAProcState.UNKNOWN:
-                    # Attempt to validate the job and move to QUEUED.
-                    validate_job(job.id, db=self.db)
+            if reaped:
+                logger.warning('Reclaimed %i jobs with expired leases',
+                               len(reaped))
+
+        # Find all of the jobs before handling any, so that jobs are
+        # only advanced by one state in each poll.
+        if job_ids is None:
+            jobs_by_state = OrderedDict(
+                (state, self.db.find_jobs(
+                    location='JAC', state=state,
+                    prioritize=True, number=batch_size))
+                for state in self.handlers.keys())
+
+        else:
+            jobs_by_state = OrderedDict(
+                (state, []) for state in self.handlers.keys())
+
+            for (id_, job) in sorted(self.db.get_jobs_many(job_ids).items()):
+                if job.location == 'JAC' and job.state in jobs_by_state:
+                    jobs_by_state[job.state].append(job)
+
+        if self.scheduler is not None \
+                and JSAProcState.QUEUED in jobs_by_state:
+            self.scheduler.update()
+            jobs_by_state[JSAProcState.QUEUED] = self.scheduler.filter_jobs(
+                jobs_by_state[JSAProcState.QUEUED])
+
+        for (state, jobs) in jobs_by_state.items():
+            logger.debug('Checking %i jobs in state %s',
+                         len(jobs), JSAProcState.get_name(state))
+
+            if not jobs:
+                continue
+
+            handler = self.handlers[state]
+
+            if self.workers is None:
+                n_err += handler(jobs)
+
+            else:
+                for offset in range(0, len(jobs), concurrent_batch_size):
+                    batch = jobs[offset:offset + concurrent_batch_size]
 
-                elif job.state == JSAProcState.QUEUED:
-                    # Check if all data are at JAC:
                     try:
-                        inputs = check_data_already_present(job.id, self.db)
-                        thelist = write_input_list(job.id, inputs)
-                        self.db.change_state(job.id, JSAProcState.WAITING,
-                                             'All files found at JAC',
-                                             state_prev=JSAProcState.QUEUED)
-                        logger.debug('Job %i has found data and been'
-                                     'moved to WAITING', job.id)
-                    except NotAtJACError:
-                        # If the data are not present, change the state to
-                        # MISSING so that a fetching process will
-                        # initiate a download.
-                        self.db.change_state(job.id, JSAProcState.MISSING,
-                                             'Input files are not at JAC',
-                                             state_prev=JSAProcState.QUEUED)
-                        logger.debug('Input files for %i are not at JAC',
-                                     job.id)
-                    except ParentNotReadyError:
-                        # If the parent jobs are not ready, do nothing?
-                        # (Alternative would be to set to missing, but for now
-                        # fetching a job like this is an error.)
-                        logger.debug('Parent jobs for %i are not ready',
-                                     job.id)
-
-                elif job.state == JSAProcState.MISSING:
-                    # Wait for a separate process to fetch the input files.
-                    pass
-
-                elif job.state == JSAProcState.FETCHING:
-                    # A separate process is fetching: do nothing.
-                    # Add a time-out here?
-                    pass
-
-                elif job.state == JSAProcState.WAITING:
-                    # Wait for a separate process to run the job.
-                    pass
-
-                elif job.state == JSAProcState.RUNNING:
-                    # A separate process is running the job: do nothing.
-                    # Add a time-out here?
-                    pass
-
-                elif job.state == JSAProcState.PROCESSED:
-                    # To be done in a separate process -- can be slow to
-                    # send files for e-transfer if CADC access is slow, or
-                    # if using a custom transfer command.
-                    pass
-
-                elif job.state == JSAProcState.TRANSFERRING:
-                    # Check e-transfer status and move to INGESTION if done.
-                    # TODO: implement check of e-transfer status
-                    pass
-
-                elif job.state == JSAProcState.INGEST_QUEUE:
-                    # Wait for another process to fetch the data.
-                    pass
-
-                elif job.state == JSAProcState.INGEST_FETCH:
-                    # Another process is fetching the data.
-                    pass
-
-                elif job.state == JSAProcState.INGESTION:
-                    # Wait for ingestion by a separate process.
-                    pass
-
-                elif job.state == JSAProcState.INGESTING:
-                    # A separate processes is performing an ingestion.
-                    pass
-
-                else:
-                    logger.error('Job %i is in unknown state %s',
-                                 job.id, job.state)
+                        n_err += handler(batch)
+
+                    except Exception:
+                        logger.exception(
+                            'Error while updating state of %i jobs',
+                            len(batch))
+
+                        n_err += len(batch)
+
+        logger.info('Done updating JAC job status')
+
+        return False if n_err else True
+
+    def poll_jac_events(self, since_id, timeout=None, etransfer=True):
+        """Wait for job state change events and update the status of
+        the JAC jobs which have entered a state handled by poll_jac_jobs.
+
+        Arguments:
+            since_id: event cursor, as for JSAProcDB.wait_for_events.
+            timeout: maximum time (seconds) to wait for events.
+            etransfer: True to enable e-transfer steps.
+
+        Returns the event cursor to use for the next call.
+        """
+
+        (events, since_id) = self.db.wait_for_events(
+            since_id, states=list(self.handlers.keys()), timeout=timeout)
+
+        job_ids = sorted(set(event.job_id for event in events))
+
+        if job_ids:
+            self.poll_jac_jobs(etransfer=etransfer, job_ids=job_ids)
+
+        return since_id
+
+    def _handle_each(self, jobs, function):
+        """Call the given function for each job in turn.
+
+        Returns the number of jobs for which the function raised
+        an exception.
+        """
+
+        n_err = 0
+
+        for job in jobs:
+            logger.debug('Checking state of job %i', job.id)
+
+            try:
+                function(job)
 
             except Exception:
                 logger.exception('Error while updating state of job %i',
@@ -139,6 +223,136 @@ class JSAProcStateMachine:
 
                 n_err += 1
 
-        logger.info('Done updating JAC job status')
+        return n_err
 
-        return False if n_err else True
+    def _check_unmatched(self, job_ids, state_prev):
+        """Log errors for jobs which could not be updated because
+        they were no longer in the expected state.
+
+        Returns the number of such jobs.
+        """
+
+        for job_id in job_ids:
+            logger.error('Job %i is no longer in state %s',
+                         job_id, JSAProcState.get_name(state_prev))
+
+        return len(job_ids)
+
+    @state_handler(JSAProcState.UNKNOWN)
+    def _handle_unknown(self, jobs):
+        """Attempt to validate the jobs and move to QUEUED."""
+
+        if self.workers is None:
+            return self._handle_each(
+                jobs, lambda job: validate_job(job.id, db=self.db))
+
+        # Validation only requires information from the database,
+        # so no threads are needed.
+        return self._check_unmatched(
+            validate_jobs([job.id for job in jobs], self.db),
+            JSAProcState.UNKNOWN)
+
+    @state_handler(JSAProcState.QUEUED)
+    def _handle_queued(self, jobs):
+        """Check if all data are at JAC and move to WAITING,
+        or otherwise to MISSING."""
+
+        if self.workers is None:
+            return self._handle_each(jobs, self._handle_queued_job)
+
+        job_ids = [job.id for job in jobs]
+        input_files = self.db.get_input_files_many(job_ids)
+        parents = self.db.get_parents_many(job_ids, with_state=True)
+        parent_outputs = self.db.get_output_files_many(sorted(set(
+            p[0] for job_parents in parents.values() for p in job_parents)))
+
+        def check_job(job_id):
+            try:
+                inputs = find_data_already_present(
+                    input_files[job_id], parents[job_id], parent_outputs)
+                thelist = write_input_list(job_id, inputs)
+                return JSAProcState.WAITING
+            except NotAtJACError:
+                return JSAProcState.MISSING
+            except ParentNotReadyError:
+                logger.debug('Parent jobs for %i are not ready', job_id)
+                return None
+            except Exception:
+                logger.exception('Error while checking data for job %i',
+                                 job_id)
+                return JSAProcState.ERROR
+
+        results = run_calls(
+            OrderedDict(
+                (job_id, functools.partial(check_job, job_id))
+                for job_id in job_ids),
+            self.workers)
+
+        n_err = 0
+
+        for (state, message) in (
+                (JSAProcState.WAITING, 'All files found at JAC'),
+                (JSAProcState.MISSING, 'Input files are not at JAC')):
+            state_job_ids = [
+                job_id for (job_id, result) in results.items()
+                if result == state]
+
+            if state_job_ids:
+                logger.debug('Moving %i jobs to %s',
+                             len(state_job_ids), JSAProcState.get_name(state))
+
+                n_err += self._check_unmatched(
+                    self.db.change_states(
+                        state_job_ids, state, message,
+                        state_prev=JSAProcState.QUEUED),
+                    JSAProcState.QUEUED)
+
+        n_err += sum(
+            1 for result in results.values() if result == JSAProcState.ERROR)
+
+        return n_err
+
+    def _handle_queued_job(self, job):
+        """Check if all data are at JAC for a single job."""
+
+        try:
+            inputs = check_data_already_present(job.id, self.db)
+            thelist = write_input_list(job.id, inputs)
+            self.db.change_state(job.id, JSAProcState.WAITING,
+                                 'All files found at JAC',
+                                 state_prev=JSAProcState.QUEUED)
+            logger.debug('Job %i has found data and been'
+                         'moved to WAITING', job.id)
+        except NotAtJACError:
+            # If the data are not present, change the state to
+            # MISSING so that a fetching process will
+            # initiate a download.
+            self.db.change_state(job.id, JSAProcState.MISSING,
+                                 'Input files are not at JAC',
+                                 state_prev=JSAProcState.QUEUED)
+            logger.debug('Input files for %i are not at JAC',
+                         job.id)
+        except ParentNotReadyError:
+            # If the parent jobs are not ready, do nothing?
+            # (Alternative would be to set to missing, but for now
+            # fetching a job like this is an error.)
+            logger.debug('Parent jobs for %i are not ready',
+                         job.id)
+
+    # Other states are handled by separate processes:
+    #
+    # MISSING: wait for a separate process to fetch the input files.
+    # FETCHING: a separate process is fetching (reclaimed by the poll if
+    #     its lease expires).
+    # WAITING: wait for a separate process to run the job.
+    # RUNNING: a separate process is running the job (reclaimed by the
+    #     poll if its lease expires).
+    # PROCESSED: to be done in a separate process -- can be slow to
+    #     send files for e-transfer if CADC access is slow, or
+    #     if using a custom transfer command.
+    # TRANSFERRING: check e-transfer status and move to INGESTION if done.
+    #     (TODO: implement check of e-transfer status as a handler.)
+    # INGEST_QUEUE: wait for another process to fetch the data.
+    # INGEST_FETCH: another process is fetching the data.
+    # INGESTION: wait for ingestion by a separate process.
+    # INGESTING: a separate processes is performing an ingestion.
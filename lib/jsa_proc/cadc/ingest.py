@@ -20,84 +20,186 @@ import os.path
 import subprocess
 
 from jsa_proc.action.decorators import ErrorDecorator
+from jsa_proc.action.lease import JSAProcLease
 from jsa_proc.admin.directories import get_output_dir, \
     open_log_file, make_temp_scratch_dir
 from jsa_proc.config import get_database
+from jsa_proc.db.db import Not
 from jsa_proc.error import JSAProcError, CommandError, NoRowsError
 from jsa_proc.state import JSAProcState
 from jsa_proc.util import restore_signals
 
+# Python2/3 compatability:
+try:
+    basestring
+except NameError:
+    basestring = str
+
 logger = logging.getLogger(__name__)
 
 
 def ingest_output(
-        job_id, location=None, task=None, dry_run=False, force=False):
-    """High-level output ingestion function for use from scripts."""
-
-    logger.debug('Connecting to JSA processing database')
-    db = get_database()
+        job_id, location=None, task=None, dry_run=False, force=False,
+        db=None):
+    """High-level output ingestion function for use from scripts.
 
-    if job_id is not None:
-        jobs = [db.get_job(id_=job_id)]
+    If no job_id is given, jobs waiting for ingestion are claimed one at
+    a time (using JSAProcDB.claim_jobs) until none remain, so that several
+    copies of this routine can run simultaneously without contention.
+    """
 
-    else:
-        jobs = db.find_jobs(
-            state=JSAProcState.INGESTION,
-            location=location,
-            task=task, prioritize=True)
+    if db is None:
+        logger.debug('Connecting to JSA processing database')
+        db = get_database()
 
     # Get full list of tasks.
     task_info = db.get_task_info()
 
-    for job in jobs:
-        job_task_info = task_info.get(job.task)
+    if job_id is not None or dry_run:
+        if job_id is not None:
+            jobs = [db.get_job(id_=job_id)]
 
-        command_ingest = None
-        description = 'into CAOM-2'
+        else:
+            jobs = db.find_jobs(
+                state=JSAProcState.INGESTION,
+                location=location,
+                task=task, prioritize=True)
+
+        for job in jobs:
+            (command_ingest, description) = _ingestion_command(
+                task_info, job)
+
+            if not dry_run:
+                try:
+                    # Change the state from INGESTION to INGESTING, raising
+                    # an error if the job was not already in that state.
+                    db.change_state(
+                        job.id, JSAProcState.INGESTING,
+                        'Job output is being ingested {}'.format(description),
+                        state_prev=(None if force else JSAProcState.INGESTION))
+
+                except NoRowsError:
+                    # This would normally be a "logger.error", but we
+                    # routinely run multiple copies of this ingestion routine
+                    # simultaneously and it is therefore expected that a lot
+                    # of jobs will have already been moved out of the
+                    # INGESTION state by other processes.
+                    logger.debug(
+                        'Job %i can not be ingested as it is not ready',
+                        job.id)
+
+                    continue
+
+                _perform_ingestion(
+                    job_id=job.id, db=db, command_ingest=command_ingest)
 
-        if ((job_task_info is not None)
-                and (job_task_info.command_ingest is not None)):
-            command_ingest = job_task_info.command_ingest
-            description = 'via custom process'
+            else:
+                logger.info(
+                    'Skipping ingestion %s of job %i (DRY RUN)',
+                    description, job.id)
 
-        if not dry_run:
-            try:
-                # Change the state from INGESTION to INGESTING, raising an
-                # error if the job was not already in that state.
-                db.change_state(
-                    job.id, JSAProcState.INGESTING,
+    else:
+        # Claim the jobs for each type of ingestion separately so that
+        # the log message can describe the ingestion.
+        for (group_task, description) in _ingestion_claim_groups(
+                task_info, task):
+            while True:
+                # Move the next job from INGESTION to INGESTING.  Since
+                # jobs are claimed atomically, other copies of this routine
+                # will not attempt to ingest the same job.
+                job_ids = db.claim_jobs(
+                    JSAProcState.INGESTION, JSAProcState.INGESTING,
                     'Job output is being ingested {}'.format(description),
-                    state_prev=(None if force else JSAProcState.INGESTION))
+                    location=location, task=group_task, lease=True)
 
-            except NoRowsError:
-                # This would normally be a "logger.error", but we routinely
-                # run multiple copies of this ingestion routine simultaneously
-                # and it is therefore expected that a lot of jobs will have
-                # already been moved out of the INGESTION state by other
-                # processes.  Therefore a warning or error should not be
-                # logged as these lead to unnecessary warnings in the cron
-                # job monitor.
-                logger.debug('Job %i can not be ingested as it is not ready',
-                             job.id)
+                if not job_ids:
+                    break
 
-                continue
+                job = db.get_job(id_=job_ids[0])
 
-            _perform_ingestion(job_id=job.id, db=db, command_ingest=command_ingest)
+                (command_ingest, job_description) = _ingestion_command(
+                    task_info, job)
 
-        else:
-            logger.info(
-                'Skipping ingestion %s of job %i (DRY RUN)',
-                description, job.id)
+                logger.debug('Ingesting job %i %s', job.id, job_description)
+
+                _perform_ingestion(
+                    job_id=job.id, db=db, command_ingest=command_ingest,
+                    claimed=True)
+
+
+def _ingestion_claim_groups(task_info, task):
+    """Determine the groups of tasks for which jobs should be claimed
+    for ingestion, optionally restricted to the given task (or list of
+    tasks).
+
+    Returns a list of tuples of the task restriction to pass to
+    claim_jobs and the description of the ingestion.
+    """
+
+    custom_tasks = sorted(
+        name for (name, info) in task_info.items()
+        if info.command_ingest is not None)
+
+    if task is None:
+        if not custom_tasks:
+            return [(None, 'into CAOM-2')]
+
+        return [
+            (Not(custom_tasks), 'into CAOM-2'),
+            (custom_tasks, 'via custom process'),
+        ]
+
+    if isinstance(task, basestring):
+        task = [task]
+
+    groups = []
+
+    default_tasks = [x for x in task if x not in custom_tasks]
+    if default_tasks:
+        groups.append((default_tasks, 'into CAOM-2'))
+
+    task_custom_tasks = [x for x in task if x in custom_tasks]
+    if task_custom_tasks:
+        groups.append((task_custom_tasks, 'via custom process'))
+
+    return groups
+
+
+def _ingestion_command(task_info, job):
+    """Determine the custom ingestion command (if any) for a job.
+
+    Returns a tuple of the command (or None) and a description.
+    """
+
+    job_task_info = task_info.get(job.task)
+
+    if ((job_task_info is not None)
+            and (job_task_info.command_ingest is not None)):
+        return (job_task_info.command_ingest, 'via custom process')
+
+    return (None, 'into CAOM-2')
 
 
 @ErrorDecorator
-def _perform_ingestion(job_id, db, command_ingest=None):
+def _perform_ingestion(job_id, db, command_ingest=None, claimed=False):
     """Private function to peform the ingestion.
 
     Runs under the ErrorDecorator to capture errors.  Sets the job state
     to COMPLETE if it finishes successfully, or ERROR otherwise.
+
+    If "claimed" is specified, the job (and its lease) were claimed
+    with JSAProcDB.claim_jobs.
     """
 
+    with JSAProcLease(db, job_id, JSAProcState.INGESTING,
+                      claimed=claimed) as lease:
+        _ingest_job_output(job_id, db, command_ingest, lease)
+
+
+def _ingest_job_output(job_id, db, command_ingest, lease):
+    """Private function to ingest the output of a job which is in the
+    INGESTING state, held under the given lease."""
+
     logger.debug('Preparing to ingest ouput for job {0}'.format(job_id))
 
     output_dir = get_output_dir(job_id)
@@ -149,9 +251,8 @@ def _perform_ingestion(job_id, db, command_ingest=None):
                     stderr=subprocess.STDOUT,
                     preexec_fn=restore_signals)
 
-            db.change_state(job_id, JSAProcState.COMPLETE,
-                            'Ingestion completed successfully',
-                            state_prev=JSAProcState.INGESTING)
+            lease.change_state(JSAProcState.COMPLETE,
+                               'Ingestion completed successfully')
 
             logger.info('Done ingesting ouput for job {0}'.format(job_id))
 
@@ -164,7 +265,7 @@ def _perform_ingestion(job_id, db, command_ingest=None):
             content = '\n'.join(log.readlines())
             errorline = content[content.find('\nERROR '):].split('\n')[1]
 
-            db.change_state(job_id, JSAProcState.ERROR,
-                            'Ingestion failed\n' + errorline)
+            lease.change_state(JSAProcState.ERROR,
+                               'Ingestion failed\n' + errorline)
 
             logger.exception('Error during ingestion of job %i', job_id)
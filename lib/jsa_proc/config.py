@@ -21,7 +21,6 @@ except ImportError:
 import os
 
 from jsa_proc.error import JSAProcError
-from jsa_proc.db.mysql import JSAProcMySQL
 
 config_file = 'etc/jsa_proc.ini'
 config = None
@@ -50,18 +49,41 @@ def get_config():
     return config
 
 
-def get_database():
+def get_database(read_replica=False):
     """Construct a database access object.
 
-    In principal this could be configured, but for now it
-    is always an object of the MySQL access class.  A single
+    The type of database is given by the "backend" entry of the
+    "database" section of the configuration file: "mysql" (the default)
+    or "sqlite" (see jsa_proc.db.sqlite.get_sqlite_database).  A single
     object is constructed and returned to all callers.
+
+    If read_replica is specified then read-only methods will use
+    the read replica, if one is configured.  This should only be
+    requested by programs (such as the web interface) which do not
+    need to see their own changes immediately.  Since a single object
+    is constructed, this only has an effect on the first call.
     """
 
     global database
 
     if database is None:
-        database = JSAProcMySQL(get_config())
+        config = get_config()
+
+        backend = 'mysql'
+        if config.has_option('database', 'backend'):
+            backend = config.get('database', 'backend')
+
+        if backend == 'mysql':
+            from jsa_proc.db.mysql import JSAProcMySQL
+            database = JSAProcMySQL(config, read_replica=read_replica)
+
+        elif backend == 'sqlite':
+            from jsa_proc.db.sqlite import get_sqlite_database
+            database = get_sqlite_database(config, read_replica=read_replica)
+
+        else:
+            raise JSAProcError(
+                'Unknown database backend "{0}"'.format(backend))
 
     return database
 
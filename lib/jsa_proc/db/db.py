@@ -14,9 +14,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import defaultdict, namedtuple, OrderedDict
+from datetime import datetime, timedelta
+import functools
 import logging
+import os
 import re
 from socket import gethostname
+from threading import local
+import time
 
 # Python2/3 compatability:
 try:
@@ -27,7 +32,8 @@ except NameError:
 from getpass import getuser
 
 from jsa_proc.error import \
-    JSAProcError, JSAProcDBError, NoRowsError, ExcessRowsError
+    JSAProcError, JSAProcDBError, NoRowsError, ExcessRowsError, \
+    LeaseLostError
 from jsa_proc.state import JSAProcState
 from jsa_proc.qa_state import JSAQAState
 
@@ -38,6 +44,9 @@ logger = logging.getLogger(__name__)
 JSAProcLog = namedtuple(
     'JSAProcLog',
     'id job_id datetime state_prev state_new message host username')
+JSAProcEvent = namedtuple(
+    'JSAProcEvent',
+    'id job_id state_prev state_new')
 JSAProcQa = namedtuple(
     'JSAProcQa',
     'id job_id datetime status  message username')
@@ -61,6 +70,9 @@ JSAProcErrorInfo = namedtuple(
 JSAProcFileInfo = namedtuple(
     'FileInfo',
     'filename md5')
+JSAProcLease = namedtuple(
+    'JSAProcLease',
+    'job_id state state_return host pid heartbeat')
 JSAProcJobNote = namedtuple(
     'JSAProcJobNote',
     'id message username')
@@ -72,6 +84,29 @@ JSAProcTaskInfo = namedtuple(
 # automatically.
 valid_column = re.compile('^[a-z0-9_]+$')
 
+# Maximum number of values to include in a single "IN (...)" expression.
+chunk_size = 1000
+
+# Default number of jobs to fetch at a time in the iter_jobs method.
+iter_batch_size = 1000
+
+# Default maximum number of events returned by wait_for_events, and
+# interval (seconds) at which it checks for new events.
+event_batch_size = 1000
+event_poll_interval = 5.0
+
+# Observation information columns stored in the job_obs table.  Queries
+# ("obsquery" dictionaries) using only these columns can be answered
+# without referring to jcmt.COMMON.
+job_obs_columns = (
+    'utdate', 'obsnum', 'instrument', 'obstype', 'project', 'survey',
+    'scanmode', 'sourcename', 'tau', 'omp_status')
+
+# Observation information columns which can change after the observation
+# has been taken (e.g. when it is marked as bad in the OMP).  Queries on
+# these columns always refer to the OMP database rather than job_obs.
+job_obs_live_columns = ('omp_status',)
+
 
 class Not:
     """Class representing negative conditions.
@@ -113,22 +148,166 @@ class Range:
         yield self.max
 
 
-class JSAProcDB:
+def read_only(method):
+    """Decorator for JSAProcDB methods which only read from the database.
+
+    If the database access object has a read replica, the method
+    uses it, unless the keyword argument "consistent=True" is given.
+    When called from within another database access method, the
+    database used by the outer method is retained.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        consistent = kwargs.pop('consistent', False)
+        return self._route_call(
+            (self._replica is None or consistent), method, args, kwargs)
+
+    return wrapper
+
+
+def read_write(method):
+    """Decorator for JSAProcDB methods which write to the database.
+
+    The method always uses the primary database, including any
+    read-only methods which it calls.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self._route_call(True, method, args, kwargs)
+
+    return wrapper
+
+
+class JSAProcDB(object):
     """
     JSA Processing database access class.
 
     This is an abstract class -- only database-specific subclasses
     may be constructed.
+
+    Public methods are tagged using the read_only and read_write
+    decorators.  If a read replica is given to the constructor,
+    read-only methods are routed to it.  Methods which are not tagged
+    (such as those reading cached metadata, which should be consistent
+    with the primary database) use the primary database.
     """
 
-    def __init__(self):
+    # SQL dialect of the database, set by the subclass.
+    dialect = None
+
+    # Default lifetime (in seconds) of entries in the metadata cache.
+    cache_ttl = 300.0
+
+    # Number of blocks which can be executed concurrently (e.g. by
+    # jsa_proc.db.fanout.fan_out).  Subclasses with more than one
+    # database connection may increase this.
+    concurrency = 1
+
+    # Locking object for the read replica, if any.
+    _replica = None
+
+    def __init__(self, cache_ttl=None, replica=None):
         """Base class constructor.
 
         This checks that the subclass has created a "db" attribute.
+
+        Information about tasks, which rarely changes, is cached
+        for "cache_ttl" seconds (if not specified, the class default
+        is used).  A TTL of zero disables the cache.
+
+        If given, "replica" should be a locking object (of the same
+        type as the "db" attribute) for a read replica of the database.
         """
 
         assert (hasattr(self, 'db'))
 
+        self._route = local()
+        self._replica = replica
+
+        if cache_ttl is not None:
+            self.cache_ttl = cache_ttl
+
+        self._cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @property
+    def db(self):
+        """Locking object for the database to be used by the current
+        method call in this thread."""
+
+        if (self._replica is not None and
+                getattr(self._route, 'primary', None) is False):
+            return self._replica
+
+        return self._primary
+
+    @db.setter
+    def db(self, value):
+        self._primary = value
+
+    def _route_call(self, primary, method, args, kwargs):
+        """Call a method, recording in thread-local storage whether
+        it should use the primary database.
+
+        The routing of an outer call is retained, except that a call
+        requiring the primary database always uses it.
+        """
+
+        outer = getattr(self._route, 'primary', None)
+
+        if outer is not None and (outer or not primary):
+            return method(self, *args, **kwargs)
+
+        self._route.primary = primary
+
+        try:
+            return method(self, *args, **kwargs)
+
+        finally:
+            self._route.primary = outer
+
+    def clear_cache(self, key=None):
+        """Remove an entry (or by default all entries) from the
+        metadata cache."""
+
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+    def _cached(self, key, function):
+        """Get a value from the metadata cache.
+
+        If there is no unexpired entry for the given key, the function
+        is called to determine the value, which is then stored.
+        """
+
+        now = time.time()
+        entry = self._cache.get(key)
+
+        if entry is not None and entry[0] > now:
+            self.cache_hits += 1
+            return entry[1]
+
+        self.cache_misses += 1
+        value = function()
+
+        if self.cache_ttl > 0:
+            self._cache[key] = (now + self.cache_ttl, value)
+
+        return value
+
+    # Default values for the optional arguments of add_job.
+    _job_spec_defaults = {
+        'input_file_names': None, 'parent_jobs': None, 'filters': None,
+        'foreign_id': None, 'state': '?', 'priority': 0, 'obsidss': None,
+        'tilelist': None,
+    }
+
+    @read_only
     def get_job(self, id_=None, tag=None):
         """
         Get a JSA data processing job from the database.
@@ -161,6 +340,23 @@ class JSAProcDB:
 
         return job
 
+    @read_only
+    def get_jobs_many(self, job_ids):
+        """
+        Get a number of JSA data processing jobs from the database.
+
+        job_ids: list of integer job identifiers.
+
+        Returns: dictionary of JSAProcJob namedtuples by job_id.  Jobs
+        which do not exist are omitted.
+        """
+
+        rows = self._select_many(
+            'SELECT ' + ', '.join(JSAProcJob._fields) +
+            ' FROM job WHERE id IN ({0})', job_ids)
+
+        return dict((row[0], JSAProcJob(*row)) for row in rows)
+
     def _get_job(self, c, name, value):
         """
         Private function to get a job from the database.
@@ -197,6 +393,7 @@ class JSAProcDB:
 
         return job
 
+    @read_write
     def add_job(self, tag, location, mode, parameters, task,
                 input_file_names=None, parent_jobs=None, filters=None,
                 foreign_id=None, state='?',
@@ -260,69 +457,160 @@ class JSAProcDB:
         Returns the job identifier.
         """
 
+        return self.add_jobs([dict(
+            tag=tag, location=location, mode=mode, parameters=parameters,
+            task=task, input_file_names=input_file_names,
+            parent_jobs=parent_jobs, filters=filters, foreign_id=foreign_id,
+            state=state, priority=priority, obsidss=obsidss,
+            tilelist=tilelist)])[0]
+
+    @read_write
+    def add_jobs(self, jobs):
+        """
+        Add a number of JSA data processing jobs to the database.
+
+        Each entry of the "jobs" list is a dictionary of the arguments
+        which would be given to the add_job method (tag, location, mode,
+        parameters and task being required).  All of the jobs are inserted
+        in a single block, with each table's rows being written using
+        "executemany" rather than one statement per row.  Either all of the
+        jobs are added, or (if an error is raised) none are.  (Any
+        observations are looked up in the JCMT and OMP databases
+        beforehand, in a separate block.)
+
+        Returns a list of the new job identifiers, in the same order as
+        the given job specifications.
+        """
+
+        specs = []
+        tags = set()
+
         # Validate input.
-        if not JSAProcState.is_valid(state):
-            raise JSAProcError('State {0} is not recognised'.format(state))
+        for job in jobs:
+            spec = dict(self._job_spec_defaults)
+            spec.update(job)
+            tag = spec['tag']
 
-        if not parent_jobs and not input_file_names:
-            raise JSAProcError(
-                'A Job must have either input files or parent jobs')
+            if not JSAProcState.is_valid(spec['state']):
+                raise JSAProcError(
+                    'State {0} is not recognised'.format(spec['state']))
+
+            if not spec['parent_jobs'] and not spec['input_file_names']:
+                raise JSAProcError(
+                    'A Job must have either input files or parent jobs')
+
+            if spec['parent_jobs']:
+                (_, _, spec['filters']) = _validate_parents(
+                    None, spec['parent_jobs'], filters=spec['filters'])
+
+            if tag in tags:
+                raise JSAProcError(
+                    'a job already exists with the same tag: ' + tag)
 
-        if parent_jobs:
-            job_id, parents, filters = _validate_parents(None, parent_jobs,
-                                                         filters=filters)
+            tags.add(tag)
+            specs.append(spec)
+
+        if not specs:
+            return []
+
+        # Look up the observations first: this requires a separate block
+        # since the JCMT and OMP databases are outside of the locked set.
+        obs_info = self._get_obs_info(
+            o for x in specs if x['obsidss'] for o in x['obsidss'])
 
         with self.db as c:
-            # Check if the tag already exists.  The database constraints
+            self.db.begin_write(c)
+
+            # Check if the tags already exist.  The database constraints
             # should already check for this, but with MySQL's InnoDB
             # engine, a job number is allocated (and lost) if the
-            # insert constraint fails.
-            c.execute('SELECT COUNT(*) FROM job WHERE tag=%s', (tag,))
-            row = c.fetchone()
-            if row[0] != 0:
-                raise JSAProcError('a job already exists with the same tag: ' +
-                                   tag)
-
-            # Insert job into table
-            c.execute(
+            # insert constraint fails.  (With row locking, this also locks
+            # the tag index so that the tags can not be taken concurrently.)
+            for chunk in _chunks([x['tag'] for x in specs]):
+                c.execute(
+                    'SELECT tag FROM job WHERE tag IN ({0})'.format(
+                        ', '.join(('%s',) * len(chunk))) +
+                    self.db.for_update(), chunk)
+                row = c.fetchone()
+                if row is not None:
+                    raise JSAProcError(
+                        'a job already exists with the same tag: ' + row[0])
+
+            # Insert jobs into table
+            c.executemany(
                 'INSERT INTO job '
                 '(tag, state, location, mode, parameters, '
                 'foreign_id, priority, task) '
                 'VALUES (%s, %s, %s, %s, %s, %s, %s, %s)',
-                (tag, state, location, mode, parameters, foreign_id,
-                 priority, task))
-
-            # Get the autoincremented id from job table (job_id in all other
-            # tables).
-            job_id = c.lastrowid
-
-            # Add parent jobs to parent table with filters.
-            if parent_jobs:
-                # Check job_id is not contained within parent_list
-                if job_id in parent_jobs:
-                    raise JSAProcError('Cannot insert a job as its own parent')
-
-                self._insert_parents(job_id, c, parent_jobs, filters)
-
-            # Add input file names to input_file table.
-            if input_file_names:
-                self._set_input_files(c, job_id, input_file_names)
-
-            # Log the job creation
-            self._add_log_entry(c, job_id, JSAProcState.UNKNOWN, state,
-                                'Job added to the database', None)
-
-            # If present, insert the tile list.
-            if tilelist:
-                self._set_tilelist(c, job_id, tilelist)
+                [(x['tag'], x['state'], x['location'], x['mode'],
+                  x['parameters'], x['foreign_id'], x['priority'], x['task'])
+                 for x in specs])
+
+            # Get the autoincremented ids from job table (job_id in all
+            # other tables).  These are looked up by tag as the IDs
+            # allocated by a multi-row insert need not be consecutive.
+            job_ids = {}
+            for chunk in _chunks([x['tag'] for x in specs]):
+                c.execute(
+                    'SELECT tag, id FROM job WHERE tag IN ({0})'.format(
+                        ', '.join(('%s',) * len(chunk))), chunk)
+                job_ids.update(c.fetchall())
+
+            parent_rows = []
+            input_rows = []
+            log_rows = []
+            tile_rows = []
+            obsidss = OrderedDict()
+            counts = defaultdict(int)
+
+            for spec in specs:
+                job_id = job_ids[spec['tag']]
+
+                counts[(spec['task'], spec['location'], spec['state'],
+                        JSAQAState.UNKNOWN)] += 1
+
+                # Add parent jobs to parent table with filters.
+                if spec['parent_jobs']:
+                    # Check job_id is not contained within parent_list
+                    if job_id in spec['parent_jobs']:
+                        raise JSAProcError(
+                            'Cannot insert a job as its own parent')
+
+                    parent_rows.extend(
+                        (job_id, parent, filt) for (parent, filt) in
+                        zip(spec['parent_jobs'], spec['filters']))
+
+                # Add input file names to input_file table.
+                if spec['input_file_names']:
+                    input_rows.extend(
+                        (job_id, x) for x in spec['input_file_names'])
+
+                # Log the job creation
+                log_rows.append((job_id, JSAProcState.UNKNOWN, spec['state'],
+                                 'Job added to the database', None))
+
+                # If present, insert the tile list.
+                if spec['tilelist']:
+                    tile_rows.extend((job_id, x) for x in spec['tilelist'])
+
+                # If present, record the observation list.
+                if spec['obsidss']:
+                    obsidss[job_id] = spec['obsidss']
+
+            self._insert_parents_many(c, parent_rows)
+            self._insert_input_files_many(c, input_rows)
+            self._add_log_entries(c, log_rows)
+            self._update_job_counts(c, counts)
+            self._insert_tiles_many(c, tile_rows)
 
-            # If present, replace/update the observation list.
             if obsidss:
-                self._set_obsidss(c, job_id, obsidss, False)
+                self._set_obsidss_many(c, obsidss, False, obs_info)
 
-        # job_id may not be necessary but sometimes useful.
-        return job_id
+        self._expire_tasks_cache(set(x['task'] for x in specs))
+
+        return [job_ids[x['tag']] for x in specs]
 
+    @read_only
     def get_tilelist(self, job_id=None, task=None):
         """Retrieve the unique list of tiles.
         OPtionally filtered either by job_id or by task (or both)
@@ -358,6 +646,7 @@ class JSAProcDB:
 
         return set(tiles)
 
+    @read_write
     def set_tilelist(self, job_id, tiles):
         """
         Delete and replace the entries for job_id in the tiles tables.
@@ -369,13 +658,35 @@ class JSAProcDB:
         with self.db as c:
             self._set_tilelist(c, job_id, tiles)
 
+    @read_write
+    def set_tilelist_many(self, tiles):
+        """
+        Delete and replace the tile lists of a number of jobs.
+
+        tiles: dictionary of lists of integers, by job_id.
+        """
+
+        with self.db as c:
+            for chunk in _chunks(list(tiles.keys())):
+                c.execute('DELETE FROM tile WHERE job_id IN ({0})'.format(
+                    ', '.join(('%s',) * len(chunk))), chunk)
+
+            self._insert_tiles_many(
+                c, [(job_id, tile) for (job_id, job_tiles) in tiles.items()
+                    for tile in job_tiles])
+
     def _set_tilelist(self, c, job_id, tiles):
         c.execute('DELETE FROM tile WHERE job_id = %s', (job_id,))
-        for tile in tiles:
-            c.execute('INSERT INTO tile (job_id, tile) '
-                      'VALUES (%s, %s)',
-                      (job_id, tile))
+        self._insert_tiles_many(c, [(job_id, tile) for tile in tiles])
+
+    def _insert_tiles_many(self, c, rows):
+        """Insert (job_id, tile) rows into the tile table."""
+
+        if rows:
+            c.executemany('INSERT INTO tile (job_id, tile) '
+                          'VALUES (%s, %s)', rows)
 
+    @read_write
     def change_task(self, job_id, oldtask, newtask):
         """
         Move a job from one task (oldtask) to another (newtask).
@@ -388,15 +699,23 @@ class JSAProcDB:
                 "is the same as newtask (%s)" %
                 (oldtask, newtask))
         with self.db as c:
+            count_key = self._get_job_count_key(c, job_id)
+
             query = 'UPDATE job SET task=%s WHERE id=%s AND task=%s'
             params = (newtask, job_id, oldtask,)
             c.execute(query, params)
             if c.rowcount == 0:
                 raise NoRowsError('job', query % tuple(params))
+
+            self._move_job_count(c, count_key, task=newtask)
+
+        self._expire_tasks_cache([newtask])
+
         logger.debug(
             'Moved job %i from task %s to task %s',
             job_id, oldtask, newtask)
 
+    @read_only
     def get_obs_info(self, job_id):
         """
         Get all entries in the obs table for a given job_id.
@@ -408,53 +727,163 @@ class JSAProcDB:
         List of NamedTuples with entries from obs table.
         """
         logger.debug('Getting observation info for job %i', job_id)
+
+        return self.get_obs_info_many([job_id])[job_id]
+
+    @read_only
+    def get_obs_info_many(self, job_ids):
+        """
+        Get the observation information for a number of jobs.
+
+        job_ids: list of integers, required
+
+        returns:
+
+        Dictionary of lists of JSAProcObs namedtuples by job_id.  Every
+        requested job_id is included, with an empty list if it
+        has no observations.
+        """
+
+        result = OrderedDict((job_id, []) for job_id in job_ids)
+
         with self.db as c:
             # Get all observations with job_id
             self.db.unlock()
-            c.execute(
-                'SELECT job_id, obsidss.obsid, obsidss.obsid_subsysnr, date_obs, date_end, utdate, ' +
-                ' obsnum, ' +
-                ' CASE WHEN instrume="SCUBA-2" AND inbeam like "%%POL" THEN "POL-2" ELSE instrume END as instrume, ' +
-                ' backend, project, survey, obsidss.subsys, '+
-                " CASE WHEN jcmt.COMMON.sam_mode='SCAN' THEN jcmt.COMMON.scan_pat ELSE jcmt.COMMON.sam_mode END AS scanmode, " +
-                ' object, obs_type, ' +
-                " CASE WHEN o.commentstatus is NULL THEN 0 ELSE o.commentstatus END AS omp_status, " +
-                " (wvmtaust + wvmtauen)/2.0 AS tau, " +
-                " (seeingst + seeingen)/2.0 AS seeing " +
-                ' FROM obsidss LEFT JOIN jcmt.COMMON  ON obsidss.obsid=jcmt.COMMON.obsid ' +
-                ' LEFT OUTER JOIN omp.ompobslog AS o ON o.obslogid = (SELECT MAX(obslogid) FROM omp.ompobslog AS o2 WHERE o2.obsid=jcmt.COMMON.obsid ) ' +
-                ' WHERE job_id = %s '
-                ' ORDER BY utdate ASC, obsnum ASC',
-                (job_id,))
-            results = c.fetchall()
 
-        results = [JSAProcObs(*obs) for obs in results]
+            for chunk in _chunks(list(result.keys())):
+                c.execute(
+                    'SELECT job_id, obsidss.obsid, obsidss.obsid_subsysnr, date_obs, date_end, utdate, ' +
+                    ' obsnum, ' +
+                    ' CASE WHEN instrume="SCUBA-2" AND inbeam like "%%POL" THEN "POL-2" ELSE instrume END as instrume, ' +
+                    ' backend, project, survey, obsidss.subsys, '+
+                    " CASE WHEN jcmt.COMMON.sam_mode='SCAN' THEN jcmt.COMMON.scan_pat ELSE jcmt.COMMON.sam_mode END AS scanmode, " +
+                    ' object, obs_type, ' +
+                    " CASE WHEN o.commentstatus is NULL THEN 0 ELSE o.commentstatus END AS omp_status, " +
+                    " (wvmtaust + wvmtauen)/2.0 AS tau, " +
+                    " (seeingst + seeingen)/2.0 AS seeing " +
+                    ' FROM obsidss LEFT JOIN jcmt.COMMON  ON obsidss.obsid=jcmt.COMMON.obsid ' +
+                    ' LEFT OUTER JOIN omp.ompobslog AS o ON o.obslogid = (SELECT MAX(obslogid) FROM omp.ompobslog AS o2 WHERE o2.obsid=jcmt.COMMON.obsid ) ' +
+                    ' WHERE job_id IN ({0}) '.format(
+                        ', '.join(('%s',) * len(chunk))) +
+                    ' ORDER BY utdate ASC, obsnum ASC',
+                    chunk)
+
+                for obs in c.fetchall():
+                    result[obs[0]].append(JSAProcObs(*obs))
 
-        return results
+        return result
 
+    @read_write
     def update_obs_info(self, obsidss, obsinfodict):
         """
-        update the columns and values given in the obsinfodict
-        for all observations with a given obsidss.
+        Update the columns and values given in the obsinfodict
+        in the job_obs table for all jobs including the observation
+        to which the given obsidss belongs.
+
+        This can be used to record a change in the observation
+        information (e.g. the OMP status) without performing a full
+        refresh of the affected jobs.  The columns which can be
+        updated are those listed in job_obs_columns.
         """
+
         columnnames, values = zip(*obsinfodict.items())
         for column in columnnames:
-            if column in ('job_id', 'id', 'obsidss'):
-                raise JSAProcError('Cannot insert private column name '
-                                   + column + ' into obs table')
+            if column not in job_obs_columns:
+                raise JSAProcError('Cannot update column name '
+                                   + column + ' in job_obs table')
 
         # Escape column names with back ticks.
         columnnames = ['`' + i + '`=%s' for i in columnnames]
         column_query = ','.join(columnnames)
 
         with self.db as c:
-
-            query = ('UPDATE obs SET ' + column_query +
-                     ' WHERE obsidss=%s ')
+            query = ('UPDATE job_obs SET ' + column_query +
+                     ' WHERE obsid IN (SELECT obsid FROM obsidss '
+                     'WHERE obsid_subsysnr=%s)')
             params = values + (obsidss,)
-            logging.debug(query % params)
+            logger.debug(query, *params)
             c.execute(query, params)
 
+    @read_write
+    def refresh_job_obs(self, task=None, job_ids=None):
+        """
+        Refresh the job_obs table from jcmt.COMMON and omp.ompobslog.
+
+        Updates the entries for the given jobs, or for all jobs
+        (optionally of a given task) with observations.  This should
+        be done after the job_obs table is created, and can be used
+        to pick up changes to the observation information, such as
+        the OMP status.
+
+        Jobs are processed in chunks, each in a separate block, so that
+        the database is not held for the whole refresh.
+
+        Returns the number of jobs refreshed.
+        """
+
+        if job_ids is None:
+            query = 'SELECT DISTINCT obsidss.job_id FROM obsidss'
+            params = []
+
+            if task is not None:
+                query += ' JOIN job ON job.id = obsidss.job_id ' \
+                    'WHERE job.task = %s'
+                params.append(task)
+
+            with self.db as c:
+                c.execute(query + ' ORDER BY obsidss.job_id', params)
+                job_ids = [x[0] for x in c.fetchall()]
+
+        else:
+            job_ids = list(job_ids)
+
+        for chunk in _chunks(job_ids):
+            with self.db as c:
+                self.db.unlock()
+                self._refresh_job_obs(c, chunk)
+
+            logger.debug('Refreshed observation information for %i jobs',
+                         len(chunk))
+
+        return len(job_ids)
+
+    def _refresh_job_obs(self, c, job_ids):
+        """Private method to refresh the job_obs table for the given jobs.
+
+        The information is copied from jcmt.COMMON and omp.ompobslog,
+        which are outside of the locked set, so the database must
+        have been unlocked.
+        """
+
+        for chunk in _chunks(list(job_ids)):
+            placeholders = ', '.join(('%s',) * len(chunk))
+
+            c.execute(
+                'DELETE FROM job_obs WHERE job_id IN ({0})'.format(
+                    placeholders), chunk)
+
+            c.execute(
+                'INSERT INTO job_obs (job_id, obsid, utdate, obsnum, '
+                'instrument, obstype, project, survey, scanmode, '
+                'sourcename, tau, omp_status) '
+                'SELECT DISTINCT obsidss.job_id, obsidss.obsid, '
+                'jcmt.COMMON.utdate, jcmt.COMMON.obsnum, '
+                'jcmt.COMMON.instrume, jcmt.COMMON.obs_type, '
+                'jcmt.COMMON.project, jcmt.COMMON.survey, '
+                'CASE WHEN jcmt.COMMON.sam_mode=\'SCAN\' '
+                'THEN jcmt.COMMON.scan_pat ELSE jcmt.COMMON.sam_mode END, '
+                'jcmt.COMMON.object, '
+                '(jcmt.COMMON.wvmtaust + jcmt.COMMON.wvmtauen)/2.0, '
+                'CASE WHEN o.commentstatus IS NULL THEN 0 '
+                'ELSE o.commentstatus END '
+                'FROM obsidss '
+                'JOIN jcmt.COMMON ON obsidss.obsid=jcmt.COMMON.obsid '
+                'LEFT OUTER JOIN omp.ompobslog AS o ON o.obslogid = '
+                '(SELECT MAX(obslogid) FROM omp.ompobslog AS o2 '
+                'WHERE o2.obsid=jcmt.COMMON.obsid) '
+                'WHERE obsidss.job_id IN ({0})'.format(placeholders), chunk)
+
+    @read_write
     def set_obsidss(self, job_id, obsidss, replace_all=True):
         """
         Update the obs table with additional observations for a given job.
@@ -469,43 +898,140 @@ class JSAProcDB:
         If set True, delete all existing entries for the job_id before
         updating the table with the obsinfo dictionaries.
         """
+
+        obs_info = self._get_obs_info(obsidss)
+
         with self.db as c:
-            self._set_obsidss(c, job_id, obsidss, replace_all)
+            self._set_obsidss_many(c, {job_id: obsidss}, replace_all, obs_info)
 
-    def _set_obsidss(self, c, job_id, obsidss, replace_all):
+    def _get_obs_info(self, obsidss):
+        """Private method to look up observations in the JCMT and OMP
+        databases.
 
-        # If replace_all is set, then delete the existing observations.
-        if replace_all:
-            c.execute('DELETE FROM obsidss WHERE job_id = %s', (job_id,))
+        These databases are outside of the locked set, so they are read
+        in a separate (unlocked) block.  The information can then be
+        written by _set_obsidss_many in a locked block.
 
-        # Get the obsid from jcmt.FILES
-        self.db.unlock()
+        obsidss: iterable of obsidss values.
 
-        query = 'SELECT obsid_subsysnr, obsid, subsysnr FROM jcmt.FILES WHERE obsid_subsysnr IN ({0}) GROUP BY obsid_subsysnr, obsid'.format(
-            ', '.join(('%s',)*len(obsidss)))
+        Returns: a tuple of a dictionary of lists of (obsid, subsys) pairs
+        by obsidss value, from jcmt.FILES, and a dictionary of job_obs
+        column values (from utdate onwards) by obsid.
+        """
 
-        c.execute(query, tuple(obsidss))
+        obsidss = sorted(set(obsidss))
+        found = {}
+        info = {}
 
-        results = c.fetchall()
+        if not obsidss:
+            return (found, info)
+
+        with self.db as c:
+            self.db.unlock()
 
+            for chunk in _chunks(obsidss):
+                query = 'SELECT obsid_subsysnr, obsid, subsysnr FROM jcmt.FILES WHERE obsid_subsysnr IN ({0}) GROUP BY obsid_subsysnr, obsid'.format(
+                    ', '.join(('%s',)*len(chunk)))
 
-        # Check if any are missing, and warn if so.
-        obsidss_fromquery = [i[0] for i in results]
-        for o in obsidss:
-            if o not in obsidss_fromquery:
-                logger.warning(
-                    'OBSIDSS %s was not added to job %i as no matching OBSID was found in jcmt FILES Table',
-                    o, job_id)
+                c.execute(query, tuple(chunk))
 
-        # Go through each pair of obsid_subsysnr and obsid, and insert
-        # into obsidss for current job.
-        for (obsid_subsysnr, obsid, subsys) in results:
+                for (obsid_subsysnr, obsid, subsys) in c.fetchall():
+                    found.setdefault(obsid_subsysnr, []).append(
+                        (obsid, subsys))
+
+            for chunk in _chunks(sorted(set(
+                    x[0] for pairs in found.values() for x in pairs))):
+                c.execute(
+                    'SELECT jcmt.COMMON.obsid, '
+                    'jcmt.COMMON.utdate, jcmt.COMMON.obsnum, '
+                    'jcmt.COMMON.instrume, jcmt.COMMON.obs_type, '
+                    'jcmt.COMMON.project, jcmt.COMMON.survey, '
+                    'CASE WHEN jcmt.COMMON.sam_mode=\'SCAN\' '
+                    'THEN jcmt.COMMON.scan_pat ELSE jcmt.COMMON.sam_mode END, '
+                    'jcmt.COMMON.object, '
+                    '(jcmt.COMMON.wvmtaust + jcmt.COMMON.wvmtauen)/2.0, '
+                    'CASE WHEN o.commentstatus IS NULL THEN 0 '
+                    'ELSE o.commentstatus END '
+                    'FROM jcmt.COMMON '
+                    'LEFT OUTER JOIN omp.ompobslog AS o ON o.obslogid = '
+                    '(SELECT MAX(obslogid) FROM omp.ompobslog AS o2 '
+                    'WHERE o2.obsid=jcmt.COMMON.obsid) '
+                    'WHERE jcmt.COMMON.obsid IN ({0})'.format(
+                        ', '.join(('%s',) * len(chunk))), chunk)
 
-            c.execute('INSERT INTO obsidss (job_id, obsid_subsysnr, obsid, subsys) ' +
-                      ' VALUES (%s, %s, %s, %s)' ,
-                      (job_id, obsid_subsysnr, obsid, subsys))
+                for row in c.fetchall():
+                    info[row[0]] = tuple(row[1:])
 
+        return (found, info)
 
+    def _set_obsidss_many(self, c, obsidss, replace_all, obs_info):
+        """Private method to set the observations of a number of jobs.
+
+        obsidss: dictionary of lists of obsidss values, by job_id.
+
+        obs_info: information about the observations, as returned
+        by _get_obs_info.
+        """
+
+        (found, info) = obs_info
+
+        # If replace_all is set, then delete the existing observations,
+        # otherwise note which already have observation information.
+        existing = set()
+
+        if replace_all:
+            for chunk in _chunks(list(obsidss.keys())):
+                placeholders = ', '.join(('%s',) * len(chunk))
+                c.execute('DELETE FROM obsidss WHERE job_id IN ({0})'.format(
+                    placeholders), chunk)
+                c.execute('DELETE FROM job_obs WHERE job_id IN ({0})'.format(
+                    placeholders), chunk)
+
+        else:
+            for chunk in _chunks(list(obsidss.keys())):
+                c.execute(
+                    'SELECT job_id, obsid FROM job_obs '
+                    'WHERE job_id IN ({0})'.format(
+                        ', '.join(('%s',) * len(chunk))), chunk)
+                existing.update(tuple(x) for x in c.fetchall())
+
+        rows = []
+        obs_rows = []
+
+        for (job_id, job_obsidss) in obsidss.items():
+            # Check if any are missing, and warn if so.
+            for o in job_obsidss:
+                if o not in found:
+                    logger.warning(
+                        'OBSIDSS %s was not added to job %i as no matching OBSID was found in jcmt FILES Table',
+                        o, job_id)
+
+            # Go through each pair of obsid_subsysnr and obsid, and insert
+            # into obsidss for current job.
+            for obsid_subsysnr in sorted(set(job_obsidss)):
+                for (obsid, subsys) in found.get(obsid_subsysnr, ()):
+                    rows.append((job_id, obsid_subsysnr, obsid, subsys))
+
+                    # Also record the observation information, once for
+                    # each observation of the job.
+                    if (obsid in info) and ((job_id, obsid) not in existing):
+                        existing.add((job_id, obsid))
+                        obs_rows.append((job_id, obsid) + info[obsid])
+
+        if rows:
+            c.executemany(
+                'INSERT INTO obsidss (job_id, obsid_subsysnr, obsid, subsys) ' +
+                ' VALUES (%s, %s, %s, %s)', rows)
+
+        if obs_rows:
+            c.executemany(
+                'INSERT INTO job_obs (job_id, obsid, utdate, obsnum, '
+                'instrument, obstype, project, survey, scanmode, '
+                'sourcename, tau, omp_status) '
+                'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
+                obs_rows)
+
+    @read_write
     def change_state(self, job_id, newstate, message, state_prev=None,
                      username=None):
 
@@ -539,68 +1065,489 @@ class JSAProcDB:
             self._change_state(c, job_id, newstate, message, state_prev,
                                username)
 
+    @read_write
+    def change_states(self, job_ids, newstate, message, state_prev=None,
+                      username=None):
+        """
+        Change the state of a number of jobs.
+
+        This is equivalent to calling change_state for each job, but the
+        jobs are updated together, using a fixed number of statements per
+        chunk of jobs, in a single transaction.  Unlike change_state,
+        no error is raised for jobs which do not exist or which are not
+        in the expected previous state (if state_prev is specified):
+        these are skipped and their identifiers returned.
+
+        Return:
+        list of job_ids which were not matched.
+        """
+
+        # Remove duplicates, preserving the order.
+        job_ids = list(OrderedDict.fromkeys(job_ids))
+
+        with self.db as c:
+            matched = set(self._change_states(
+                c, job_ids, newstate, message, state_prev, username))
+
+        return [x for x in job_ids if x not in matched]
+
     def _change_state(self, c, job_id, newstate, message, state_prev,
                       username):
+        """Private method to change the state of a single job.
+
+        Raises NoRowsError if the job does not exist, or is not in the
+        expected previous state.
+        """
+
+        if not self._change_states(c, [job_id], newstate, message,
+                                   state_prev, username):
+            query = 'SELECT * FROM job WHERE id={0}'.format(job_id)
+            if state_prev is not None:
+                query += ' AND state={0}'.format(state_prev)
+            raise NoRowsError('job', query)
+
+    def _change_states(self, c, job_ids, newstate, message, state_prev,
+                       username):
+        """Private method to change the state of a number of jobs.
+
+        The jobs are first read (and locked, if the database uses row
+        locking) to determine which match and to compute the changes to
+        the job_count table.  The log (and if necessary qa) entries are
+        then written with INSERT ... SELECT statements before the
+        job table itself is updated.
+
+        Return: list of job_ids which were matched and changed.
+        """
+
         # Validate input.
         if not JSAProcState.is_valid(newstate):
             raise JSAProcError('State {0} is not recognised'.format(newstate))
 
-        # Change the state to new state and update the state_prev
-        query = ('UPDATE job SET state_prev = state, state = %s '
-                 'WHERE id = %s')
-        param = [newstate, job_id]
+        # If a non-unknown QA state has been set for any of the jobs,
+        # and they are being reprocessed, it must be reset.
+        reset_qa = newstate in JSAProcState.STATE_PRE_QA
 
-        if state_prev is not None:
-            query += ' AND state=%s'
-            param.append(state_prev)
+        host = gethostname().partition('.')[0]
+        user = getuser()
+
+        self.db.begin_write(c)
+
+        matched = []
+        counts = defaultdict(int)
+
+        for chunk in _chunks(job_ids):
+            where = 'id IN ({0})'.format(', '.join(('%s',) * len(chunk)))
+            param = list(chunk)
+
+            if state_prev is not None:
+                where += ' AND state=%s'
+                param.append(state_prev)
+
+            c.execute(
+                'SELECT id, task, location, state, qa_state FROM job '
+                'WHERE ' + where + self.db.for_update(), param)
+
+            chunk_matched = []
+            reset_qa_chunk = False
+
+            for (job_id, task, location, state, qa_state) in c.fetchall():
+                chunk_matched.append(job_id)
+
+                if state == newstate:
+                    logger.warning('Job %i already in state %s',
+                                   job_id, newstate)
+
+                new_qa_state = qa_state
+                if reset_qa and qa_state != JSAQAState.UNKNOWN:
+                    new_qa_state = JSAQAState.UNKNOWN
+                    reset_qa_chunk = True
+
+                counts[(task, location, state, qa_state)] -= 1
+                counts[(task, location, newstate, new_qa_state)] += 1
+
+            if not chunk_matched:
+                continue
 
-        c.execute(query, param)
+            where = 'id IN ({0})'.format(
+                ', '.join(('%s',) * len(chunk_matched)))
+
+            # Update log table.
+            c.execute(
+                'INSERT INTO log '
+                '(job_id, state_prev, state_new, message, host, username) '
+                'SELECT id, state, %s, %s, %s, %s FROM job WHERE ' + where,
+                [newstate, message, host,
+                 (user if username is None else username)] + chunk_matched)
+
+            # Change the state to new state and update the state_prev.
+            # Also update the QA table and state if appropriate.
+            if reset_qa_chunk:
+                c.execute(
+                    'INSERT INTO qa (job_id, status, message, username) '
+                    'SELECT id, %s, %s, %s FROM job WHERE ' + where +
+                    ' AND qa_state <> %s',
+                    [JSAQAState.UNKNOWN,
+                     'This job is being reprocessed;' +
+                     ' QA state reset automatically.',
+                     user] + chunk_matched + [JSAQAState.UNKNOWN])
+
+                c.execute(
+                    'UPDATE job SET state_prev = state, state = %s, '
+                    'qa_state = %s WHERE ' + where,
+                    [newstate, JSAQAState.UNKNOWN] + chunk_matched)
 
-        if c.rowcount == 0:
-            # (With MySQL) this might be because the job was already in the
-            # requested state.  Check this now (rather than before since
-            # we expect the state to be changing most times this method is
-            # called).
-            if ((self._get_job(c, 'id', job_id).state == newstate) and
-                    ((state_prev is None) or (state_prev == newstate))):
-                logger.warning('Job %i already in state %s', job_id, newstate)
             else:
-                raise NoRowsError('job', query % tuple(param))
+                c.execute(
+                    'UPDATE job SET state_prev = state, state = %s '
+                    'WHERE ' + where,
+                    [newstate] + chunk_matched)
 
-        elif c.rowcount > 1:
-            raise ExcessRowsError('job', query % tuple(param))
+            matched.extend(chunk_matched)
 
-        # Get state_prev value if we were not given it.
-        if state_prev is None:
-            c.execute('SELECT state_prev FROM job WHERE id=%s',
-                      (job_id,))
-            state_prev = c.fetchall()
+        self._update_job_counts(c, counts)
 
-            if len(state_prev) > 1:
-                raise ExcessRowsError(
-                    'job',
-                    'SELECT state_prev FROM job WHERE id=%s' % (job_id))
+        return matched
 
-            state_prev = state_prev[0][0]
+    def _get_job_count_key(self, c, job_id):
+        """Private method to read (and lock, if the database uses row
+        locking) the job_count key of a job.
 
-        # Update log table.
-        self._add_log_entry(c, job_id, state_prev, newstate, message, username)
+        Return: a tuple of task, location, state and qa_state.
+        """
+
+        self.db.begin_write(c)
+
+        query = 'SELECT task, location, state, qa_state FROM job WHERE id=%s'
+        c.execute(query + self.db.for_update(), (job_id,))
+        rows = c.fetchall()
+
+        if len(rows) == 0:
+            raise NoRowsError('job', query % (job_id,))
+        elif len(rows) > 1:
+            raise ExcessRowsError('job', query % (job_id,))
 
-        # Update QA table if appropriate
-        if newstate in JSAProcState.STATE_PRE_QA:
-            # Check the current QA state:
-            job = self._get_job(c, 'id', job_id)
+        return tuple(rows[0])
+
+    def _move_job_count(self, c, key, **kwargs):
+        """Private method to update the job_count table for a change
+        to a job.
+
+        Takes the job's previous job_count key (as returned by
+        _get_job_count_key) and the new values of the changed
+        columns as keyword arguments.
+        """
 
-            # If a non-unknown QA state has been set, change it to unknown
-            # and update the qa table.
-            if job.qa_state != JSAQAState.UNKNOWN:
-                c.execute('UPDATE job SET qa_state = %s WHERE id= %s',
-                          (JSAQAState.UNKNOWN, job_id))
-                self._add_qa_entry(c, job_id, JSAQAState.UNKNOWN,
-                                   'This job is being reprocessed;' +
-                                   ' QA state reset automatically.',
-                                   getuser())
+        (task, location, state, qa_state) = key
+        new_key = (kwargs.get('task', task),
+                   kwargs.get('location', location),
+                   kwargs.get('state', state),
+                   kwargs.get('qa_state', qa_state))
 
+        if new_key != key:
+            self._update_job_counts(c, {key: -1, new_key: 1})
+
+    def _update_job_counts(self, c, counts):
+        """Private method to apply changes to the job_count table.
+
+        Takes a dictionary of changes to the number of jobs, by tuple of
+        task, location, state and qa_state.  Each is applied with an
+        INSERT which adds to the existing row, if there is one.
+
+        The changes are applied in order of key so that, with row
+        locking, concurrent blocks lock the job_count rows in the same
+        order and can not deadlock.  Note that each row stays locked
+        until the end of the block, so blocks changing jobs with the
+        same task, location and state (e.g. workers claiming jobs from
+        the same queue) are serialized on that row.  Callers should
+        therefore accumulate their changes and apply them once, at the
+        end of the block, as _change_states does.
+        """
+
+        for (key, delta) in sorted(counts.items()):
+            if not delta:
+                continue
+
+            c.execute(
+                'INSERT INTO job_count '
+                '(task, location, state, qa_state, number) '
+                'VALUES (%s, %s, %s, %s, %s)' +
+                self.db.on_duplicate_increment(
+                    ('task', 'location', 'state', 'qa_state'), 'number'),
+                key + (delta,))
+
+    @read_write
+    def rebuild_job_counts(self):
+        """
+        Recompute the job_count table from the job table.
+
+        The job_count table is normally maintained incrementally by the
+        methods which alter the job table, but can be rebuilt by this
+        method if it becomes inconsistent (e.g. after the job table
+        has been edited manually).
+        """
+
+        with self.db as c:
+            c.execute('DELETE FROM job_count')
+            c.execute('INSERT INTO job_count '
+                      '(task, location, state, qa_state, number) '
+                      'SELECT task, location, state, qa_state, COUNT(*) '
+                      'FROM job GROUP BY task, location, state, qa_state')
+
+        self.clear_cache('tasks')
+
+    @read_write
+    def claim_jobs(self, state, new_state, message, task=None, location=None,
+                   limit=1, worker=None, username=None, lease=False):
+        """
+        Atomically select the next jobs in a given state and move them
+        into a new state.
+
+        This is intended for use by queue worker processes: the highest
+        priority jobs are selected and their state changed (with log
+        entries written) in a single locked block, so that concurrent
+        workers never claim the same job.  Jobs locked by another worker
+        are skipped where the database supports it.
+
+        Parameters:
+        state: string, one character, the state in which to look for jobs.
+
+        new_state: string, one character, the state to move the jobs to.
+
+        message: string, log message for the state change.
+
+        task: optional task name (or list of names) to which to restrict
+        the search.
+
+        location: optional location to which to restrict the search.
+
+        limit: maximum number of jobs to claim (integer, default 1).
+
+        worker: optional identifier of the claiming worker, to be
+        included in the log message.
+
+        lease: if specified, a lease on each claimed job is recorded for
+        this process (see add_lease) in the same block, with the original
+        state as the state to which the job should be returned.
+
+        Returns:
+        list of the claimed job identifiers, in priority order.  This is
+        empty if no jobs were available.
+        """
+
+        if not isinstance(state, basestring):
+            raise JSAProcError('Jobs can only be claimed from a single state')
+
+        if worker is not None:
+            message = '{0} (worker {1})'.format(message, worker)
+
+        (where, param) = self._find_jobs_where(
+            state, location, task, None, None, None, None)
+
+        query = 'SELECT job.id FROM job WHERE ' + ' AND '.join(where) + \
+            ' ORDER BY job.priority DESC, job.id ASC LIMIT %s'
+        param.append(int(limit))
+
+        with self.db as c:
+            self.db.begin_write(c)
+
+            c.execute(query + self.db.for_update(skip_locked=True), param)
+            job_ids = [row[0] for row in c.fetchall()]
+
+            self._change_states(c, job_ids, new_state, message, state,
+                                username)
+
+            if lease:
+                for job_id in job_ids:
+                    self._add_lease(c, job_id, new_state, state)
+
+        if job_ids:
+            logger.debug('Claimed jobs %s (%s to %s)',
+                         ', '.join(str(x) for x in job_ids),
+                         state, new_state)
+
+        return job_ids
+
+    @read_write
+    def add_lease(self, job_id, state, state_return):
+        """
+        Record that this process is working on a job.
+
+        The lease identifies the process by host name and process ID,
+        and records the (active) state in which the job is being worked
+        on and the state to which it should be returned if the process
+        stops.  The lease should be renewed periodically with renew_lease,
+        and removed with remove_lease when the work is finished.  Leases
+        which are not renewed are reclaimed by reap_leases.
+
+        Any existing lease on the job is replaced.
+        """
+
+        with self.db as c:
+            self._add_lease(c, job_id, state, state_return)
+
+    def _add_lease(self, c, job_id, state, state_return):
+        """Private method to record a lease on a job for this process."""
+
+        (host, pid) = _lease_holder()
+        (now, now_param) = self.db.utc_timestamp()
+
+        c.execute('DELETE FROM job_lease WHERE job_id = %s', (job_id,))
+
+        c.execute(
+            'INSERT INTO job_lease '
+            '(job_id, state, state_return, host, pid, heartbeat) '
+            'VALUES (%s, %s, %s, %s, %s, ' + now + ')',
+            [job_id, state, state_return, host, pid] + now_param)
+
+    @read_write
+    def renew_lease(self, job_id):
+        """
+        Update the heartbeat of this process's lease on a job.
+
+        Returns: False if the lease is no longer held by this process
+        (e.g. because it was reaped), True otherwise.
+        """
+
+        (host, pid) = _lease_holder()
+        (now, now_param) = self.db.utc_timestamp()
+
+        with self.db as c:
+            c.execute(
+                'UPDATE job_lease SET heartbeat = ' + now + ' '
+                'WHERE job_id = %s AND host = %s AND pid = %s',
+                now_param + [job_id, host, pid])
+
+            return c.rowcount > 0
+
+    @read_write
+    def release_lease(self, job_id, newstate, message):
+        """
+        Change the state of a job on which this process holds a lease,
+        and remove the lease.
+
+        The job is moved out of the state in which the lease was taken,
+        in the same block as the lease is checked, so that a job which
+        has been reclaimed by reap_leases (and perhaps claimed by another
+        process) is not affected.
+
+        Raises LeaseLostError if this process no longer holds the lease.
+        """
+
+        (host, pid) = _lease_holder()
+
+        with self.db as c:
+            self.db.begin_write(c)
+
+            c.execute(
+                'SELECT state FROM job_lease '
+                'WHERE job_id = %s AND host = %s AND pid = %s' +
+                self.db.for_update(),
+                (job_id, host, pid))
+            rows = c.fetchall()
+
+            if not rows:
+                raise LeaseLostError(
+                    'Lease on job {0} is no longer held'.format(job_id))
+
+            self._change_state(c, job_id, newstate, message, rows[0][0], None)
+
+            c.execute(
+                'DELETE FROM job_lease '
+                'WHERE job_id = %s AND host = %s AND pid = %s',
+                (job_id, host, pid))
+
+    @read_write
+    def remove_lease(self, job_id):
+        """
+        Remove this process's lease on a job.
+
+        Leases held by other processes are not affected.
+        """
+
+        (host, pid) = _lease_holder()
+
+        with self.db as c:
+            c.execute(
+                'DELETE FROM job_lease '
+                'WHERE job_id = %s AND host = %s AND pid = %s',
+                (job_id, host, pid))
+
+    @read_only
+    def get_leases(self, expired=None):
+        """
+        Get the current job leases.
+
+        If "expired" is given, only leases whose heartbeat is older than
+        this number of seconds are returned.
+
+        Returns: a list of JSAProcLease namedtuples, in order of job_id.
+        """
+
+        query = 'SELECT ' + ', '.join(JSAProcLease._fields) + \
+            ' FROM job_lease'
+        param = []
+
+        if expired is not None:
+            (cutoff, cutoff_param) = self.db.utc_timestamp(expired)
+            query += ' WHERE heartbeat < ' + cutoff
+            param.extend(cutoff_param)
+
+        with self.db as c:
+            c.execute(query + ' ORDER BY job_id', param)
+
+            return [JSAProcLease(*x) for x in c.fetchall()]
+
+    @read_write
+    def reap_leases(self, timeout):
+        """
+        Return jobs with expired leases to their queue states.
+
+        Leases whose heartbeat is older than "timeout" seconds are
+        removed.  Where the job is still in the state in which the lease
+        was taken, it is moved to the lease's return state (e.g. from
+        RUNNING back to WAITING) with a log message identifying the
+        process which held the lease.  Jobs which have since left that
+        state are not changed.
+
+        Returns: a list of the identifiers of the jobs which were
+        returned to their queue states.
+        """
+
+        (cutoff, cutoff_param) = self.db.utc_timestamp(timeout)
+        reaped = []
+
+        with self.db as c:
+            self.db.begin_write(c)
+
+            c.execute(
+                'SELECT ' + ', '.join(JSAProcLease._fields) +
+                ' FROM job_lease WHERE heartbeat < ' + cutoff +
+                self.db.for_update(),
+                cutoff_param)
+            leases = [JSAProcLease(*x) for x in c.fetchall()]
+
+            for lease in leases:
+                message = 'Lease expired: no heartbeat from {0} ' \
+                    'process {1} since {2}'.format(
+                        lease.host, lease.pid, lease.heartbeat)
+
+                if self._change_states(
+                        c, [lease.job_id], lease.state_return, message,
+                        lease.state, None):
+                    logger.warning('Job %i returned to state %s: %s',
+                                   lease.job_id, lease.state_return, message)
+                    reaped.append(lease.job_id)
+
+            # The selected leases are locked, so can not have been renewed.
+            for chunk in _chunks([x.job_id for x in leases]):
+                c.execute(
+                    'DELETE FROM job_lease WHERE job_id IN (' +
+                    ', '.join(('%s',) * len(chunk)) + ')',
+                    chunk)
+
+        return reaped
+
+    @read_only
     def get_input_files(self, job_id):
         """
         Get the list of input files for specific job from the
@@ -629,6 +1576,26 @@ class JSAProcDB:
 
         return input_files
 
+    @read_only
+    def get_input_files_many(self, job_ids):
+        """
+        Get the lists of input files for a number of jobs.
+
+        Returns a dictionary of lists of file names by job_id.  Every
+        requested job_id is included, with an empty list if it has
+        no input files.
+        """
+
+        result = OrderedDict((job_id, []) for job_id in job_ids)
+
+        for (job_id, filename) in self._select_many(
+                'SELECT job_id, filename FROM input_file '
+                'WHERE job_id IN ({0})', list(result.keys())):
+            result[job_id].append(filename)
+
+        return result
+
+    @read_write
     def set_input_files(self, job_id, input_files):
         """
         Set the list of input files for a specific job.
@@ -637,15 +1604,39 @@ class JSAProcDB:
         with self.db as c:
             self._set_input_files(c, job_id, input_files)
 
+    @read_write
+    def set_input_files_many(self, input_files):
+        """
+        Set the lists of input files for a number of jobs.
+
+        input_files: dictionary of lists of file names, by job_id.
+        """
+
+        with self.db as c:
+            for chunk in _chunks(list(input_files.keys())):
+                c.execute(
+                    'DELETE FROM input_file WHERE job_id IN ({0})'.format(
+                        ', '.join(('%s',) * len(chunk))), chunk)
+
+            self._insert_input_files_many(
+                c, [(job_id, filename)
+                    for (job_id, files) in input_files.items()
+                    for filename in files])
+
     def _set_input_files(self, c, job_id, input_files):
         # Remove any current input files for this job_id.
         c.execute('DELETE FROM input_file WHERE job_id = %s', (job_id,))
 
         # Insert the new input file records.
-        for filename in input_files:
-            c.execute('INSERT INTO input_file (job_id, filename) '
-                      'VALUES (%s, %s)',
-                      (job_id, filename))
+        self._insert_input_files_many(
+            c, [(job_id, filename) for filename in input_files])
+
+    def _insert_input_files_many(self, c, rows):
+        """Insert (job_id, filename) rows into the input_file table."""
+
+        if rows:
+            c.executemany('INSERT INTO input_file (job_id, filename) '
+                          'VALUES (%s, %s)', rows)
 
     def _add_log_entry(self, c, job_id, state_prev, state_new, message,
                        username):
@@ -655,63 +1646,280 @@ class JSAProcDB:
         object as argument "c".
         """
 
-        if username is None:
-            username = getuser()
+        self._add_log_entries(
+            c, [(job_id, state_prev, state_new, message, username)])
+
+    def _add_log_entries(self, c, entries):
+        """Private method to add a number of entries to the log table.
+
+        Each entry is a tuple of job_id, state_prev, state_new, message
+        and username (None for the current user).
+        """
+
+        if not entries:
+            return
+
+        host = gethostname().partition('.')[0]
+        user = getuser()
+
+        c.executemany(
+            'INSERT INTO log '
+            '(job_id, state_prev, state_new, message, host, username) '
+            'VALUES (%s, %s, %s, %s, %s, %s)',
+            [(job_id, state_prev, state_new, message, host,
+              (user if username is None else username))
+             for (job_id, state_prev, state_new, message, username)
+             in entries])
+
+    def _add_qa_entry(self, c, job_id, status, message, username):
+        """
+        Private method: adds an entry to the qa table for a job with job_id.
+
+        Assumes the database is already locked and takes a cursor
+        object as argument "c"
+        """
+
+        # Check status is allowed
+        c.execute('INSERT INTO qa '
+                  '(job_id, status, message, username) '
+                  'VALUES (%s, %s, %s, %s)',
+                  (job_id, status, message, username))
+
+    @read_write
+    def add_qa_entry(self, job_id, status, message, username):
+        """
+        Add an entry to the QA table for a job of given job_id, and
+        update the qa_state in the jobtable for the given job_id.
+
+        Status must be in JSAQAState.STATE_ALL
+        """
+        if status in JSAQAState.STATE_ALL:
+            with self.db as c:
+                count_key = self._get_job_count_key(c, job_id)
+                self._add_qa_entry(c, job_id, status, message, username)
+                c.execute('UPDATE job SET qa_state = %s WHERE id = %s',
+                          (status, job_id))
+                self._move_job_count(c, count_key, qa_state=status)
+        else:
+            raise JSAProcError(
+                'QA status can only be changed to allowed values.')
+
+    @read_write
+    def add_qa_entries(self, job_ids, status, message, username):
+        """
+        Add an entry to the QA table for each of a number of jobs, and
+        update their qa_state in the job table.
+
+        The jobs are updated together in a single transaction.  Jobs
+        which do not exist are skipped and their identifiers returned.
+
+        Status must be in JSAQAState.STATE_ALL
+        """
+
+        if status not in JSAQAState.STATE_ALL:
+            raise JSAProcError(
+                'QA status can only be changed to allowed values.')
+
+        # Remove duplicates, preserving the order.
+        job_ids = list(OrderedDict.fromkeys(job_ids))
+        matched = set()
+
+        with self.db as c:
+            self.db.begin_write(c)
+
+            counts = defaultdict(int)
+
+            for chunk in _chunks(job_ids):
+                where = 'id IN ({0})'.format(', '.join(('%s',) * len(chunk)))
+
+                c.execute(
+                    'SELECT id, task, location, state, qa_state FROM job '
+                    'WHERE ' + where + self.db.for_update(), chunk)
+
+                for (job_id, task, location, state, qa_state) in c.fetchall():
+                    matched.add(job_id)
+                    counts[(task, location, state, qa_state)] -= 1
+                    counts[(task, location, state, status)] += 1
+
+                c.execute(
+                    'INSERT INTO qa (job_id, status, message, username) '
+                    'SELECT id, %s, %s, %s FROM job WHERE ' + where,
+                    [status, message, username] + chunk)
+
+                c.execute(
+                    'UPDATE job SET qa_state = %s WHERE ' + where,
+                    [status] + chunk)
+
+            self._update_job_counts(c, counts)
+
+        return [x for x in job_ids if x not in matched]
+
+    @read_only
+    def get_logs(self, job_id):
+        """
+        Get the full log of states of a given job from the log table.
+
+        Parameters:
+        job_id : integer (id from job table)
+
+        Returns:
+        list of JSAProcLog nametuples, 1 entry per row in log table for that
+        job_id, including entries moved to the log_archive table.
+        """
+
+        return self.get_logs_many([job_id])[job_id]
+
+    @read_only
+    def get_logs_many(self, job_ids):
+        """
+        Get the full logs of states of a number of jobs.
+
+        Returns a dictionary of lists of JSAProcLog namedtuples by job_id.
+        Every requested job_id is included.  Entries which have been
+        moved to the log_archive table are included, and each list
+        is sorted by log entry identifier.
+        """
+
+        result = OrderedDict((job_id, []) for job_id in job_ids)
+
+        # Read both tables in one block, so that entries can not be
+        # moved by archive_logs in between.  (Entries are also checked
+        # for duplicates by identifier, in case the database does not
+        # give a consistent view across the statements of a block.)
+        seen = set()
+
+        with self.db as c:
+            for table in ('log', 'log_archive'):
+                for chunk in _chunks(list(result.keys())):
+                    c.execute(
+                        'SELECT ' + ', '.join(JSAProcLog._fields) +
+                        ' FROM ' + table + ' WHERE job_id IN (' +
+                        ', '.join(('%s',) * len(chunk)) + ')',
+                        chunk)
+
+                    for row in c.fetchall():
+                        log = JSAProcLog(*row)
+                        if log.id not in seen:
+                            seen.add(log.id)
+                            result[log.job_id].append(log)
+
+        for logs in result.values():
+            logs.sort(key=lambda x: x.id)
+
+        return result
+
+    @read_only
+    def count_state_entries(self, job_id, state):
+        """
+        Count the number of times a job has entered a given state.
+
+        This counts the log entries (including those in the log_archive
+        table) for the job with the given new state, without retrieving
+        the whole log.
+
+        Returns: integer
+        """
+
+        number = 0
+
+        with self.db as c:
+            for table in ('log', 'log_archive'):
+                c.execute(
+                    'SELECT COUNT(*) FROM ' + table +
+                    ' WHERE job_id = %s AND state_new = %s',
+                    (job_id, state))
+                number += c.fetchone()[0]
+
+        return number
+
+    @read_write
+    def archive_logs(self, days, task=None):
+        """
+        Move old log entries to the log_archive table.
+
+        Entries older than the given number of days are moved for jobs
+        which are in final states (JSAProcState.STATE_FINAL), optionally
+        only for a given task.  For each job, the entries used by
+        get_last_log, find_errors_logs (with latest_only) and
+        get_processing_time_obs_type are kept in the log table:
+        the latest entry, the latest running and error entries
+        and the latest transition from running to processed.
+
+        Jobs are processed in chunks, each in a separate block.
+
+        Returns the number of log entries moved.
+        """
+
+        cutoff = datetime.utcnow() - timedelta(days=days)
+
+        jobdict = {'state': sorted(JSAProcState.STATE_FINAL)}
+        if task is not None:
+            jobdict['task'] = task
+        (where, param) = _dict_query_where_clause('job', jobdict)
+
+        keep_conditions = [
+            ('', []),
+            (' AND state_new = %s', [JSAProcState.RUNNING]),
+            (' AND state_new = %s', [JSAProcState.ERROR]),
+            (' AND state_prev = %s AND state_new = %s',
+             [JSAProcState.RUNNING, JSAProcState.PROCESSED]),
+        ]
+
+        columns = ', '.join(JSAProcLog._fields)
+
+        with self.db as c:
+            c.execute(
+                'SELECT DISTINCT job.id FROM job '
+                'JOIN log ON log.job_id = job.id '
+                'WHERE ' + where + ' AND log.datetime < %s '
+                'ORDER BY job.id',
+                param + [cutoff])
+            job_ids = [x[0] for x in c.fetchall()]
 
-        c.execute('INSERT INTO log '
-                  '(job_id, state_prev, state_new, message, host, username) '
-                  'VALUES (%s, %s, %s, %s, %s, %s)',
-                  (job_id, state_prev, state_new, message,
-                   gethostname().partition('.')[0], username))
+        n_moved = 0
 
-    def _add_qa_entry(self, c, job_id, status, message, username):
-        """
-        Private method: adds an entry to the qa table for a job with job_id.
+        for chunk in _chunks(job_ids):
+            placeholders = ', '.join(('%s',) * len(chunk))
 
-        Assumes the database is already locked and takes a cursor
-        object as argument "c"
-        """
+            with self.db as c:
+                keep = set()
+                for (condition, condparam) in keep_conditions:
+                    c.execute(
+                        'SELECT MAX(id) FROM log '
+                        'WHERE job_id IN (' + placeholders + ')' +
+                        condition + ' GROUP BY job_id',
+                        chunk + condparam)
+                    keep.update(x[0] for x in c.fetchall())
 
-        # Check status is allowed
-        c.execute('INSERT INTO qa '
-                  '(job_id, status, message, username) '
-                  'VALUES (%s, %s, %s, %s)',
-                  (job_id, status, message, username))
+                c.execute(
+                    'SELECT id FROM log '
+                    'WHERE job_id IN (' + placeholders + ') '
+                    'AND datetime < %s',
+                    chunk + [cutoff])
+                log_ids = [x[0] for x in c.fetchall() if x[0] not in keep]
 
-    def add_qa_entry(self, job_id, status, message, username):
-        """
-        Add an entry to the QA table for a job of given job_id, and
-        update the qa_state in the jobtable for the given job_id.
+                for log_chunk in _chunks(log_ids):
+                    log_placeholders = ', '.join(('%s',) * len(log_chunk))
 
-        Status must be in JSAQAState.STATE_ALL
-        """
-        if status in JSAQAState.STATE_ALL:
-            with self.db as c:
-                self._add_qa_entry(c, job_id, status, message, username)
-                c.execute('UPDATE job SET qa_state = %s WHERE id = %s',
-                          (status, job_id))
-        else:
-            raise JSAProcError(
-                'QA status can only be changed to allowed values.')
+                    c.execute(
+                        'INSERT INTO log_archive (' + columns + ') '
+                        'SELECT ' + columns + ' FROM log '
+                        'WHERE id IN (' + log_placeholders + ')',
+                        log_chunk)
 
-    def get_logs(self, job_id):
-        """
-        Get the full log of states of a given job from the log table.
+                    c.execute(
+                        'DELETE FROM log '
+                        'WHERE id IN (' + log_placeholders + ')',
+                        log_chunk)
 
-        Parameters:
-        job_id : integer (id from job table)
+            logger.debug('Archived %i log entries for %i jobs',
+                         len(log_ids), len(chunk))
 
-        Returns:
-        list of JSAProcLog nametuples, 1 entry per row in log table for that
-        job_id.
-        """
-        # Get all log entries
-        logs = self._get_all_entries(job_id, 'log')
-        # Create JSAProcLog namedtuple object to hold values.
-        logs = [JSAProcLog(*i) for i in logs]
+            n_moved += len(log_ids)
 
-        return logs
+        return n_moved
 
+    @read_only
     def get_qas(self, job_id):
         """
         Get the full history of qa states of a given job from the qa table.
@@ -731,6 +1939,26 @@ class JSAProcDB:
 
         return qas
 
+    def _select_many(self, query, job_ids):
+        """
+        Private method to run a query for a list of job IDs.
+
+        The query should include "{0}" where the placeholders for the
+        job IDs are to be inserted (as the contents of an "IN (...)"
+        expression).  Long lists of job IDs are split into chunks
+        and all the resulting rows returned as a single list.
+        """
+
+        rows = []
+
+        with self.db as c:
+            for chunk in _chunks(list(job_ids)):
+                c.execute(query.format(', '.join(('%s',) * len(chunk))),
+                          chunk)
+                rows.extend(c.fetchall())
+
+        return rows
+
     def _get_all_entries(self, job_id, tablename):
         """
         Private method to get all entries in a table with a
@@ -762,6 +1990,7 @@ class JSAProcDB:
 
         return entry[0]
 
+    @read_only
     def get_last_qa(self, job_id):
         """
         Return the lastqa entry for a given job.
@@ -777,6 +2006,7 @@ class JSAProcDB:
         qa = JSAProcQa(*qa)
         return qa
 
+    @read_only
     def get_last_log(self, job_id):
         """
         Return the last log entry for a given job.
@@ -792,6 +2022,101 @@ class JSAProcDB:
         log = JSAProcLog(*log)
         return log
 
+    @read_only
+    def get_last_event_id(self):
+        """
+        Get the identifier of the most recent job event (log entry).
+
+        This can be used to initialize the cursor for wait_for_events.
+
+        Returns: integer (0 if there are no events)
+        """
+
+        with self.db as c:
+            c.execute('SELECT MAX(id) FROM log')
+            (last_id,) = c.fetchone()
+
+        if last_id is None:
+            return 0
+
+        return last_id
+
+    @read_only
+    def wait_for_events(self, since_id, states=None, timeout=None,
+                        limit=None, poll_interval=None):
+        """
+        Wait for job state change events.
+
+        The log table serves as an append-only feed of events, with the
+        log entry identifier acting as a cursor.  This method returns the
+        events after since_id, optionally only those where the new state
+        is one of the given "states".  If there are none, it checks again
+        every poll_interval seconds (default: event_poll_interval) until
+        there are, or until "timeout" seconds have passed.  A timeout
+        of zero checks once without waiting and None waits indefinitely.
+
+        Each check first reads the high-water mark (the maximum log
+        identifier) so that, while nothing changes, only the end of the
+        primary key index is read.  Neither MySQL nor SQLite provides
+        notifications, so this polling is used with both databases.
+
+        At most "limit" (default: event_batch_size) events are returned.
+
+        Returns: a tuple of a list of JSAProcEvent namedtuples, in order
+        of identifier, and the value of since_id for the next call.
+
+        Note: in "transaction" locking mode, log entries may become
+        visible out of order, so an entry committed late could be
+        missed.  Pollers should still perform an occasional full scan.
+        """
+
+        if limit is None:
+            limit = event_batch_size
+
+        if poll_interval is None:
+            poll_interval = event_poll_interval
+
+        if states is None:
+            (statewhere, stateparam) = ('', [])
+        else:
+            (statewhere, stateparam) = _dict_query_where_clause(
+                'log', {'state_new': list(states)})
+            statewhere = ' AND ' + statewhere
+
+        deadline = None if timeout is None else time.time() + timeout
+
+        while True:
+            with self.db as c:
+                c.execute('SELECT MAX(id) FROM log')
+                (last_id,) = c.fetchone()
+
+                if last_id is not None and last_id > since_id:
+                    c.execute(
+                        'SELECT id, job_id, state_prev, state_new FROM log '
+                        'WHERE id > %s AND id <= %s' + statewhere +
+                        ' ORDER BY id LIMIT %s',
+                        [since_id, last_id] + stateparam + [limit])
+
+                    events = [JSAProcEvent(*x) for x in c.fetchall()]
+
+                    # If the limit was reached, there may be further
+                    # events to return next time.
+                    if len(events) == limit:
+                        since_id = events[-1].id
+                    else:
+                        since_id = last_id
+
+                    if events:
+                        return (events, since_id)
+
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                return ([], since_id)
+
+            time.sleep(poll_interval if deadline is None
+                       else min(poll_interval, deadline - now))
+
+    @read_write
     def set_location(self, job_id, location, foreign_id=(),
                      state_new='?', message=None):
         """
@@ -814,6 +2139,8 @@ class JSAProcDB:
         """
 
         with self.db as c:
+            count_key = self._get_job_count_key(c, job_id)
+
             if foreign_id == ():
                 query = 'UPDATE job SET location = %s WHERE id = %s'
                 param = (location, job_id)
@@ -829,12 +2156,15 @@ class JSAProcDB:
             elif c.rowcount > 1:
                 raise ExcessRowsError('job', query % param)
 
+            self._move_job_count(c, count_key, location=location)
+
             if state_new is not None:
                 if message is None:
                     message = 'Location changed to {0}'.format(location)
 
                 self._change_state(c, job_id, state_new, message, None, None)
 
+    @read_write
     def set_foreign_id(self, job_id, foreign_id):
         """
         Update the foreign_id of a job of id job_id.
@@ -848,6 +2178,7 @@ class JSAProcDB:
             c.execute('UPDATE job SET foreign_id = %s WHERE id = %s',
                       (foreign_id, job_id))
 
+    @read_write
     def set_mode(self, job_id, mode):
         """
         Update the mode of a job.
@@ -857,6 +2188,7 @@ class JSAProcDB:
             c.execute('UPDATE job SET mode = %s WHERE id = %s',
                       (mode, job_id))
 
+    @read_write
     def set_parameters(self, job_id, parameters):
         """
         Update the parameters of a job.
@@ -866,6 +2198,7 @@ class JSAProcDB:
             c.execute('UPDATE job SET parameters = %s WHERE id = %s',
                       (parameters, job_id))
 
+    @read_only
     def get_date_range(self, task=None):
         """
         Get the minimum and maximum utdate for
@@ -896,6 +2229,7 @@ class JSAProcDB:
 
         return times
 
+    @read_only
     def get_output_files(self, job_id, with_info=False):
         """
         Get the output file list for a job.
@@ -932,6 +2266,28 @@ class JSAProcDB:
             # Turn list of tuples into single list of strings.
             return [row[0] for row in output_files]
 
+    @read_only
+    def get_output_files_many(self, job_ids, with_info=False):
+        """
+        Get the output file lists for a number of jobs.
+
+        Returns a dictionary, by job_id, of lists of output files (or
+        JSAProcFileInfo namedtuples if with_info is enabled).  Every
+        requested job_id is included, with an empty list if it has
+        no output files.
+        """
+
+        result = OrderedDict((job_id, []) for job_id in job_ids)
+
+        for (job_id, filename, md5) in self._select_many(
+                'SELECT job_id, filename, md5 FROM output_file '
+                'WHERE job_id IN ({0})', list(result.keys())):
+            result[job_id].append(
+                JSAProcFileInfo(filename, md5) if with_info else filename)
+
+        return result
+
+    @read_write
     def set_output_files(self, job_id, output_files):
 
         """
@@ -956,12 +2312,14 @@ class JSAProcDB:
             # First of all blank out any current output files for this job_id.
             c.execute('DELETE FROM output_file WHERE job_id = %s', (job_id,))
 
-            for f in output_files:
-                # Now add in the new output files, one at a time.
-                c.execute('INSERT INTO output_file (job_id, filename, md5) '
-                          'VALUES (%s, %s, %s)',
-                          (job_id, f.filename, f.md5))
+            # Now add in the new output files.
+            rows = [(job_id, f.filename, f.md5) for f in output_files]
+            if rows:
+                c.executemany(
+                    'INSERT INTO output_file (job_id, filename, md5) '
+                    'VALUES (%s, %s, %s)', rows)
 
+    @read_only
     def get_log_files(self, job_id):
         """
         Get the  list of log files for a job.
@@ -991,6 +2349,7 @@ class JSAProcDB:
         # Turn list of tuples into single list of strings.
         return [row[0] for row in output_files]
 
+    @read_write
     def set_log_files(self, job_id, log_files):
 
         """
@@ -1011,14 +2370,15 @@ class JSAProcDB:
             # First of all blank out any current output files for this job_id.
             c.execute('DELETE FROM log_file WHERE job_id = %s', (job_id,))
 
-            for f in log_files:
-                # Now add in the new output files, one at a time.
-                c.execute('INSERT INTO log_file (job_id, filename) '
-                          'VALUES (%s, %s)',
-                          (job_id, f))
+            # Now add in the new log files.
+            rows = [(job_id, f) for f in log_files]
+            if rows:
+                c.executemany('INSERT INTO log_file (job_id, filename) '
+                              'VALUES (%s, %s)', rows)
 
+    @read_only
     def find_errors_logs(self, location=None, task=None, state_prev=None,
-                         error_state=JSAProcState.ERROR):
+                         error_state=JSAProcState.ERROR, latest_only=False):
         """
         Retrieve list of all jobs in an error state, together with their logs.
 
@@ -1027,47 +2387,85 @@ class JSAProcDB:
              * task (default None)
              * state_prev
 
+        If latest_only is specified, only the most recent log entry
+        which moved each job into the ERROR state is retrieved, rather than
+        the job's whole log.  (This is the entry which JSAProcErrorFilter
+        examines.)  Jobs which have never entered the ERROR state are
+        then omitted.
+
         Return: an ordered dictionary by job identifier.  This will be in
         reverse chronological order of the last entry for each job
-        (i.e. newest first).
+        (i.e. newest first).  Each value is a list of log entries,
+        also newest first.
         """
 
-        query = 'SELECT job.id, log.datetime, log.message, log.state_new, ' \
-                'log.state_prev, job.location '\
-                'FROM job JOIN log ON job.id=log.job_id'
-        query += ' WHERE job.state=%s'
+        where = ['job.state=%s']
         param = [error_state]
 
         if location is not None:
-            query += ' AND job.location=%s '
+            where.append('job.location=%s')
             param.append(location)
         if task is not None:
-            query += ' AND job.task=%s '
+            where.append('job.task=%s')
             param.append(task)
         if state_prev is not None:
-            query += ' AND job.state_prev=%s '
+            where.append('job.state_prev=%s')
             param.append(state_prev)
 
-        query += ' ORDER BY log.id DESC'
+        # Query for error information, prefixed by the log entry identifier,
+        # from the given log table.
+        query = 'SELECT {0}.id, job.id, {0}.datetime, {0}.message, ' \
+                '{0}.state_new, {0}.state_prev, job.location ' \
+                'FROM job JOIN {0} ON job.id={0}.job_id'
+
+        edict = OrderedDict()
 
-        # Execute query
         with self.db as c:
-            c.execute(query, param)
-            error_jobs = c.fetchall()
+            if not latest_only:
+                # Read the full history, including archived entries.
+                rows = []
+                for table in ('log', 'log_archive'):
+                    c.execute(
+                        query.format(table) +
+                        ' WHERE ' + ' AND '.join(where), param)
+                    rows.extend(c.fetchall())
 
-            edict = OrderedDict()
-            for j in error_jobs:
-                einfo = JSAProcErrorInfo(*j)
-                edict[einfo.id] = edict.get(einfo.id, []) + [einfo]
+                rows.sort(key=lambda x: x[0], reverse=True)
+
+                for j in rows:
+                    einfo = JSAProcErrorInfo(*j[1:])
+                    edict.setdefault(einfo.id, []).append(einfo)
+
+            else:
+                # First find the identifier of each job's latest error
+                # entry, and then retrieve just those rows of the log.
+                c.execute(
+                    'SELECT MAX(log.id) FROM job JOIN log ON job.id=log.job_id'
+                    ' WHERE ' + ' AND '.join(where + ['log.state_new=%s']) +
+                    ' GROUP BY job.id',
+                    param + [JSAProcState.ERROR])
+
+                log_ids = sorted((x[0] for x in c.fetchall()), reverse=True)
+
+                for chunk in _chunks(log_ids):
+                    c.execute(
+                        query.format('log') + ' WHERE log.id IN (' +
+                        ', '.join(['%s'] * len(chunk)) + ')' +
+                        ' ORDER BY log.id DESC',
+                        chunk)
+
+                    for j in c:
+                        einfo = JSAProcErrorInfo(*j[1:])
+                        edict[einfo.id] = [einfo]
 
         return edict
-        # Now sort out error jobs in sensible option
 
+    @read_only
     def find_jobs(self, state=None, location=None, task=None, qa_state=None,
                   tag=None, state_prev=None,
                   prioritize=False, number=None, offset=None,
                   sort=False, sortdir='ASC', outputs=None, count=False,
-                  obsquery=None, tiles=None):
+                  obsquery=None, tiles=None, after_id=None, before_id=None):
         """Retrieve a list of jobs matching the given values.
 
         Searches by the following values:
@@ -1091,12 +2489,27 @@ class JSAProcDB:
               get output_files that match the string. e.g. '%preview_1024.png'
               would include all 1024 size preview images with jobs.
               If this argument is None then no outputs will be fetched.)
+            * after_id (integer, only return jobs which come after the
+              job with this identifier in the sort order)
+            * before_id (integer, only return jobs which come before the
+              job with this identifier in the sort order -- the
+              results are the "number" jobs immediately preceding it)
+
+        The after_id and before_id parameters allow results to be
+        paginated without the cost of an offset, which requires the
+        database to read and discard all of the preceding rows.
+        They imply sorting by id.
 
         In addition the jobs returned can be affected by an optional
         obsquery parameter. If given, this must be a dictionary of
-        columns from the jcmt COMMON table giving their required value.
+        observation columns giving their required value.
         This dictionary is processed by _dict_query_where_clause
         and accepts any type of value permitted by that method.
+        If only columns listed in job_obs_columns are used then
+        the query is answered from the job_obs table, otherwise
+        the columns must be those of the jcmt COMMON table.
+        Columns listed in job_obs_live_columns (such as omp_status)
+        are always read from the OMP database.
 
         Returns a list (which may be empty) of namedtuples, each  of which have
         values:
@@ -1137,42 +2550,64 @@ class JSAProcDB:
             state, location, task, qa_state, tag, obsquery, tiles,
             state_prev=state_prev)
 
-        if where:
-            query += ' WHERE ' + ' AND '.join(where)
-            param.extend(whereparam)
+        param.extend(whereparam)
+
+        if after_id is not None and before_id is not None:
+            raise JSAProcError('Only one of after_id and before_id '
+                               'can be specified')
 
-        # If we performed a join, we need to group by job.id, on the
-        # assumption that it was a one-to-many join.  If we ever
-        # add any one-to-one joins, this step should be made more
-        # conditional.
-        if join:
-            query += ' GROUP BY job.id '
+        reverse = before_id is not None
+
+        if reverse or after_id is not None:
+            sort = True
 
         # Do not generate the ORDER BY clause if we are only selecting
         # the count.
-        if not count:
+        if count:
+            order = None
+        else:
             # Use the _find_jobs_order method to prepare the ORDER clauses.
-            order = self._find_jobs_order(prioritize, sort, sortdir)
+            order = self._find_jobs_order(prioritize, sort, sortdir,
+                                          reverse=reverse)
 
-            if order:
-                query += ' ORDER BY ' + ', '.join(order)
+        result = []
 
-        # Return [number] of results, starting at [offset]
-        if number:
+        with self.db as c:
+            # Prepare the "seek" condition for keyset pagination.  This
+            # is done here because it may require the priority of the
+            # reference job to be retrieved.
+            if after_id is not None or before_id is not None:
+                (keywhere, keyparam) = self._find_jobs_keyset(
+                    c, (before_id if reverse else after_id),
+                    prioritize, sortdir, reverse)
+                where.append(keywhere)
+                param.extend(keyparam)
+
+            if where:
+                query += ' WHERE ' + ' AND '.join(where)
+
+            # If we performed a join, we need to group by job.id, on the
+            # assumption that it was a one-to-many join.  If we ever
+            # add any one-to-one joins, this step should be made more
+            # conditional.
+            if join:
+                query += ' GROUP BY job.id '
 
-            query += ' LIMIT %s'
+            if order:
+                query += ' ORDER BY ' + ', '.join(order)
 
-            if offset:
-                query += ', %s'
-                param.append(offset)
+            # Return [number] of results, starting at [offset]
+            if number:
 
-            param.append(int(number))
+                query += ' LIMIT %s'
 
-        result = []
+                if offset:
+                    query += ', %s'
+                    param.append(offset)
 
-        with self.db as c:
+                param.append(int(number))
 
-            if 'jcmt.COMMON' in query:
+            if 'jcmt.COMMON' in query or 'omp.ompobslog' in query:
                 self.db.unlock()
             logger.debug([query, param])
             c.execute(query, param)
@@ -1197,8 +2632,115 @@ class JSAProcDB:
                 # Append the (possibly modified) row to the result list.
                 result.append(row)
 
+        # If we searched backwards, restore the requested order.
+        if reverse:
+            result.reverse()
+
         return result
 
+    def _find_jobs_keyset(self, c, job_id, prioritize, sortdir, reverse):
+        """Prepare a keyset pagination expression for the find_jobs method.
+
+        Selects jobs which come after (or before, if "reverse" is set)
+        the given job in the order given by _find_jobs_order.
+        The priority of the reference job is looked up separately,
+        rather than in a subquery, to avoid referring to the job
+        table twice in one query.
+
+        Return: a tuple containing an SQL expression and
+        a list of placeholder parameters.
+        """
+
+        id_op = '>' if ((sortdir == 'ASC') != reverse) else '<'
+
+        if not prioritize:
+            return ('job.id ' + id_op + ' %s', [job_id])
+
+        query = 'SELECT priority FROM job WHERE id = %s'
+        c.execute(query, (job_id,))
+        row = c.fetchone()
+        if row is None:
+            raise NoRowsError('job', query % (job_id,))
+
+        priority = row[0]
+        priority_op = '>' if reverse else '<'
+
+        return (
+            '(job.priority ' + priority_op + ' %s OR '
+            '(job.priority = %s AND job.id ' + id_op + ' %s))',
+            [priority, priority, job_id])
+
+    @read_only
+    def job_prev_next(self, job_id,
+                      state=None, location=None, task=None, qa_state=None,
+                      tag=None,
+                      prioritize=False, sort=False, sortdir='ASC',
+                      obsquery=None, tiles=None):
+        """Find the jobs either side of a given job in a search.
+
+        Accepts the same search and sorting parameters as find_jobs and
+        uses keyset pagination to find the neighbouring jobs, so that
+        the cost does not depend on the position of the job
+        in the results.
+
+        Return: a tuple of the previous and next job identifiers
+        (either of which may be None).
+        """
+
+        kwargs = dict(
+            state=state, location=location, task=task, qa_state=qa_state,
+            tag=tag, prioritize=prioritize, sort=sort, sortdir=sortdir,
+            obsquery=obsquery, tiles=tiles, number=1)
+
+        prev = self.find_jobs(before_id=job_id, **kwargs)
+        next_ = self.find_jobs(after_id=job_id, **kwargs)
+
+        return (prev[0].id if prev else None,
+                next_[0].id if next_ else None)
+
+    def iter_jobs(self, state=None, location=None, task=None, qa_state=None,
+                  tag=None, state_prev=None, outputs=None,
+                  obsquery=None, tiles=None, batch_size=None,
+                  consistent=False):
+        """Iterate over jobs matching the given values.
+
+        This is a generator which accepts the same search parameters
+        as find_jobs and yields the same namedtuples, in order of job ID.
+        Rather than building a list of all matching jobs, the jobs are
+        fetched in batches of batch_size (default: iter_batch_size),
+        each in a separate database access block.  Therefore the
+        database is not locked while the caller processes each job,
+        and the memory required does not depend on the number of jobs.
+
+        Since each batch starts after the last job ID of the previous
+        batch, jobs are not repeated or skipped if the caller changes
+        the states of the jobs as it goes along.  However jobs changed
+        by other processes may or may not be included.
+
+        The "consistent" argument is passed to find_jobs for each batch.
+        """
+
+        if batch_size is None:
+            batch_size = iter_batch_size
+
+        after_id = None
+
+        while True:
+            jobs = self.find_jobs(
+                state=state, location=location, task=task, qa_state=qa_state,
+                tag=tag, state_prev=state_prev, outputs=outputs,
+                obsquery=obsquery, tiles=tiles,
+                sort=True, number=batch_size, after_id=after_id,
+                consistent=consistent)
+
+            for job in jobs:
+                yield job
+
+            if len(jobs) < batch_size:
+                break
+
+            after_id = jobs[-1].id
+
     def _find_jobs_where(self, state, location, task, qa_state, tag,
                          obsquery, tiles, state_prev=None):
         """Prepare WHERE expression for the find_jobs method.
@@ -1237,9 +2779,8 @@ class JSAProcDB:
         param.extend(jobparam)
 
         if obsquery:
-            (obswhere, obsparam) = _dict_query_where_clause('jcmt.COMMON', obsquery)
-            where.append('job.id IN (SELECT job_id FROM obsidss JOIN jcmt.COMMON ON obsidss.obsid=jcmt.COMMON.obsid  WHERE ' +
-                         obswhere + ')')
+            (obswhere, obsparam) = _obs_query_where_clause(obsquery)
+            where.append(obswhere)
             param.extend(obsparam)
 
         if tiles:
@@ -1251,9 +2792,11 @@ class JSAProcDB:
 
         return (where, param)
 
-    def _find_jobs_order(self, prioritize, sort, sortdir):
+    def _find_jobs_order(self, prioritize, sort, sortdir, reverse=False):
         """Prepare ORDER expressions for the find_jobs method.
 
+        If "reverse" is specified, the order is inverted.
+
         Return: a list of ORDER expressions.
         """
 
@@ -1261,17 +2804,21 @@ class JSAProcDB:
             raise JSAProcError('Can only sort jobs in ASC or DESC direction. '
                                'You picked %s' % (sortdir))
 
+        if reverse:
+            sortdir = 'DESC' if sortdir == 'ASC' else 'ASC'
+
         order = []
 
         if prioritize:
-            order.append('job.priority DESC')
+            order.append('job.priority ' + ('ASC' if reverse else 'DESC'))
 
         if sort:
             order.append('job.id ' + sortdir)
 
         return order
 
-    def get_processing_time_obs_type(self, obsdict=None, jobdict=None, ):
+    @read_only
+    def get_processing_time_obs_type(self, obsdict=None, jobdict=None):
         """Get the processing times.
 
         By default looks for all types of observations in location JAC
@@ -1280,131 +2827,117 @@ class JSAProcDB:
         It can be limited by the usual job and obs column querys.
 
         This function will get the difference in time between the
-        movement into the PROCESSING state and the movement into the PROCESSED
-        state. (It will look for the last occurence of each in the log)
-
-        Returns job_ids, duration_seconds, obs_info
-
-        job_ids is a list of the job_ids that the processing
-        times were calculated for.
-        duration_seconds is a list of the processing time in
-        seconds for each job.
-        obs_info is a list of the obs.obstype, obs.scanmode,
-        obs.project, obs.survey and obs.instrument for each job.
+        movement into the RUNNING state and the movement from RUNNING into
+        the PROCESSED state, using the last occurence of each in the log.
+        Both transitions are found in a single query, pairing them by
+        job, and jobs which have re-entered the RUNNING state since
+        last being processed are omitted.  (These log entries are
+        retained in the log table by archive_logs.)
+
+        Returns a columnar OrderedDict with the following entries,
+        each of which is a list containing one value per job
+        (ordered by job ID):
+
+            job_id
+            duration (processing time in seconds)
+            obstype
+            scanmode
+            project
+            survey
+            instrument
+            omp_status
 
         For tasks where multiple observations are in the same job
-        this could produce odd results. Careful filtering of the
-        output will be required (it will return one result for each
-        observation, so multiple identical times for a single job).
+        the observation information is taken from the first observation
+        (by obsid) only.  If obsdict is given, jobs are included if any
+        of their observations match.
         """
-        from_query = "FROM job " + \
-                     " LEFT JOIN log ON job.id = log.job_id " + \
-                     " LEFT JOIN obsidss ON job.id=obsidss.job_id " + \
-                     " LEFT JOIN jcmt.COMMON ON obsidss.obsid=jcmt.COMMON.obsid " + \
-                     " LEFT OUTER JOIN omp.ompobslog AS o ON o.obslogid = (SELECT MAX(obslogid) FROM omp.ompobslog o2 WHERE o2.obsid=jcmt.COMMON.obsid) "
-
-        select_query = "SELECT job.id, MAX(log.datetime) AS maxdt, " + \
-                       "jcmt.COMMON.obs_type, " + \
-                       "CASE WHEN jcmt.COMMON.sam_mode='SCAN' THEN jcmt.COMMON.scan_pat ELSE jcmt.COMMON.sam_mode END AS scanmode, " + \
-                       "jcmt.COMMON.project, " + \
-                       "jcmt.COMMON.survey, jcmt.COMMON.instrume, CASE WHEN o.commentstatus is NULL THEN 0 ELSE o.commentstatus END AS omp_status "
-
-        where = ['log.state_new=%s']
-
-        param = []
-        group_query = " GROUP BY job.id "
 
-        if obsdict:
-            obsquery, obsparam = _dict_query_where_clause('jcmt.COMMON', obsdict)
-            where.append(obsquery)
-            param += obsparam
-
-        if not jobdict:
+        if jobdict is None:
             jobdict = {}
+        else:
+            jobdict = jobdict.copy()
         if 'location' not in jobdict:
-            jobdict['location'] = "JAC"
+            jobdict['location'] = 'JAC'
         if 'state' not in jobdict:
             jobdict['state'] = JSAProcState.STATE_POST_RUN
 
-        jobquery, jobparam = _dict_query_where_clause('job', jobdict)
-        where.append(jobquery)
-        param += jobparam
-
-        query = select_query + from_query + \
-            ' WHERE ' + ' AND '.join(where) + \
-            group_query
+        (where, param) = _dict_query_where_clause('job', jobdict)
+        where = [where, 'log_end.id > log_start.id']
 
-        where = ['log.state_prev=%s'] + where
+        if obsdict:
+            (obswhere, obsparam) = _obs_query_where_clause(obsdict)
+            where.append(obswhere)
+            param.extend(obsparam)
 
-        query_processed = select_query + from_query + \
-            ' WHERE ' + ' AND '.join(where) + \
-            group_query
+        query = \
+            'SELECT job.id, log_start.datetime, log_end.datetime, ' \
+            'jcmt.COMMON.obs_type, ' \
+            'CASE WHEN jcmt.COMMON.sam_mode=\'SCAN\' ' \
+            'THEN jcmt.COMMON.scan_pat ELSE jcmt.COMMON.sam_mode END, ' \
+            'jcmt.COMMON.project, jcmt.COMMON.survey, jcmt.COMMON.instrume, ' \
+            'CASE WHEN o.commentstatus IS NULL THEN 0 ' \
+            'ELSE o.commentstatus END ' \
+            'FROM job ' \
+            'JOIN log AS log_start ON log_start.id = ' \
+            '(SELECT MAX(ls.id) FROM log AS ls ' \
+            'WHERE ls.job_id=job.id AND ls.state_new=%s) ' \
+            'JOIN log AS log_end ON log_end.id = ' \
+            '(SELECT MAX(le.id) FROM log AS le ' \
+            'WHERE le.job_id=job.id AND le.state_prev=%s ' \
+            'AND le.state_new=%s) ' \
+            'LEFT JOIN jcmt.COMMON ON jcmt.COMMON.obsid = ' \
+            '(SELECT MIN(obsidss.obsid) FROM obsidss ' \
+            'WHERE obsidss.job_id=job.id) ' \
+            'LEFT OUTER JOIN omp.ompobslog AS o ON o.obslogid = ' \
+            '(SELECT MAX(obslogid) FROM omp.ompobslog o2 ' \
+            'WHERE o2.obsid=jcmt.COMMON.obsid) ' \
+            'WHERE ' + ' AND '.join(where) + ' ORDER BY job.id'
+
+        param = [JSAProcState.RUNNING,
+                 JSAProcState.RUNNING, JSAProcState.PROCESSED] + param
+
+        columns = ('job_id', 'duration', 'obstype', 'scanmode', 'project',
+                   'survey', 'instrument', 'omp_status')
+        result = OrderedDict((x, []) for x in columns)
 
         with self.db as c:
-            if 'jcmt.COMMON' in query:
-                self.db.unlock()
-            c.execute(query, [JSAProcState.RUNNING] + param)
-            startresults = c.fetchall()
-            columns = c.description
+            # Query refers to tables outside of the locked set.
+            self.db.unlock()
+            c.execute(query, param)
 
-        with self.db as c:
-            if 'jcmt.COMMON' in query:
-                self.db.unlock()
-            c.execute(query_processed,
-                      [JSAProcState.RUNNING, JSAProcState.PROCESSED] + param)
-            endresults = c.fetchall()
-
-        job_ids_starts = [i[0] for i in startresults]
-        job_ids_ends = [i[0] for i in endresults]
-
-        for i in range(len(job_ids_starts)):
-            if job_ids_starts[i] not in job_ids_ends:
-                startresults.pop(i)
-        for i in range(len(job_ids_ends)):
-            if job_ids_ends[i] not in job_ids_starts:
-                endresults.pop(i)
-
-        # Get the times, job_id numbers and observation infos.
-        duration_seconds = []
-        job_ids = []
-        job_infos = []
-        for i in range(len(startresults)):
-            seconds = (endresults[i][1] - startresults[i][1]).total_seconds()
-            duration_seconds.append(seconds)
-            job_ids.append(startresults[i][0])
-            job_infos.append(startresults[i][2:])
-
-        return job_ids, duration_seconds, job_infos
+            for row in c:
+                result['job_id'].append(row[0])
+                result['duration'].append((row[2] - row[1]).total_seconds())
+                for (column, value) in zip(columns[2:], row[3:]):
+                    result[column].append(value)
+
+        return result
 
     def get_tasks(self):
         """Retrieve list of task names which have been assigned to jobs.
 
-        Results are returned in alphabetical order.
+        Results are returned in alphabetical order.  (This information
+        is taken from the job_count summary table, via the metadata
+        cache.)
         """
 
-        query = 'SELECT DISTINCT task FROM job ORDER BY task ASC'
-
-        result = []
-
-        with self.db as c:
-            c.execute(query)
-
-            while True:
-                row = c.fetchone()
-                if row is None:
-                    break
-
-                result.append(row[0])
+        result = self._cached(
+            'tasks', lambda: list(self.get_job_counts(['task']).keys()))
 
         if not result:
-            raise NoRowsError('job', query)
+            raise NoRowsError('job_count', 'SELECT DISTINCT task FROM job')
 
-        return result
+        return list(result)
 
     def get_task_info(self, task=None):
         """
         Get the values from task table for a given task or for all tasks.
 
+        The task table is read in full and kept in the metadata cache.
+        If the requested task is not found, the table is re-read
+        in case the task has been added by another process.
+
         Returns:
         JSAProcJobNote namedtuple: contains the id, taskname,
         etransfer and starlink values from the table.  If task is None
@@ -1412,41 +2945,53 @@ class JSAProcDB:
         organized by task name.
         """
 
-        query = 'SELECT id, taskname, etransfer, starlink, version, ' \
-            'command_run, command_xfer, raw_output, command_ingest, log_ingest ' \
-            'FROM task'
-        params = []
+        result = self._cached('task_info', self._get_task_info_all)
 
-        if task is not None:
-            query += ' WHERE taskname=%s'
-            params.append(task)
+        if task is None:
+            return result.copy()
+
+        if task not in result:
+            self.clear_cache('task_info')
+            result = self._cached('task_info', self._get_task_info_all)
+
+            if task not in result:
+                raise NoRowsError(
+                    'task', 'SELECT * FROM task WHERE taskname={0}'.format(
+                        task))
+
+        return result[task]
+
+    def _expire_tasks_cache(self, tasks):
+        """Remove the cached list of tasks if it does not include
+        all of the given tasks."""
+
+        entry = self._cache.get('tasks')
+
+        if entry is not None and not set(tasks).issubset(entry[1]):
+            self.clear_cache('tasks')
+
+    def _get_task_info_all(self):
+        """Read the whole task table.
+
+        Returns a dictionary of JSAProcTaskInfo tuples organized by
+        task name.
+        """
 
         result = {}
 
         with self.db as c:
-            c.execute(query, params)
-
-            while True:
-                row = c.fetchone()
-                if row is None:
-                    break
+            c.execute(
+                'SELECT id, taskname, etransfer, starlink, version, '
+                'command_run, command_xfer, raw_output, command_ingest, '
+                'log_ingest FROM task')
 
+            for row in c:
                 row = JSAProcTaskInfo(*row)
-
                 result[row.taskname] = row
 
-        if task is not None:
-            if len(result) == 0:
-                raise NoRowsError('task', query % tuple(params))
-            elif len(result) > 1:
-                raise ExcessRowsError('task', query % tuple(params))
-            try:
-                return result[task]
-            except KeyError:
-                raise JSAProcDBError('task', query % tuple(params))
-
         return result
 
+    @read_write
     def add_task(self, taskname, etransfer, starlink=None, version=None,
                  command_run=None, command_xfer=None, raw_output=None,
                  command_ingest=None):
@@ -1473,6 +3018,9 @@ class JSAProcDB:
                 (taskname, etransfer, starlink, version,
                  command_run, command_xfer, raw_output, command_ingest))
 
+        self.clear_cache('task_info')
+
+    @read_only
     def get_parents(self, job_id, with_state=False):
         """
         Look in the parent table and get all parent jobs
@@ -1498,6 +3046,34 @@ class JSAProcDB:
             raise NoRowsError('parent', query % params)
         return result
 
+    @read_only
+    def get_parents_many(self, job_ids, with_state=False):
+        """
+        Get the parent jobs for a number of jobs.
+
+        Returns a dictionary, by job_id, of lists of tuples of
+        (parent job id, filters), optionally including the parent job
+        state as for get_parents.  Every requested job_id is included,
+        with an empty list if it has no parents.
+        """
+
+        if not with_state:
+            query = 'SELECT job_id, parent, filter FROM parent' \
+                ' WHERE job_id IN ({0})'
+        else:
+            query = 'SELECT parent.job_id, parent.parent, parent.filter,' \
+                ' job.state' \
+                ' FROM parent JOIN job ON parent.parent=job.id' \
+                ' WHERE parent.job_id IN ({0})'
+
+        result = OrderedDict((job_id, []) for job_id in job_ids)
+
+        for row in self._select_many(query, list(result.keys())):
+            result[row[0]].append(tuple(row[1:]))
+
+        return result
+
+    @read_only
     def get_children(self, job_id):
         """
         Get all jobs that list the current job as a parent.
@@ -1520,6 +3096,7 @@ class JSAProcDB:
         result = [i[0] for i in result]
         return result
 
+    @read_write
     def add_to_parents(self, job_id, parents, filters=None):
         """
         Add additional jobs to the parent table for the child 'job_id'.
@@ -1551,11 +3128,18 @@ class JSAProcDB:
 
     def _insert_parents(self, job_id, c, parents, filters):
 
-        for parent, filt in zip(parents, filters):
-            c.execute('INSERT INTO parent (job_id, parent, filter) '
-                      'VALUES (%s, %s, %s)',
-                      (job_id, parent, filt))
+        self._insert_parents_many(
+            c, [(job_id, parent, filt)
+                for (parent, filt) in zip(parents, filters)])
+
+    def _insert_parents_many(self, c, rows):
+        """Insert (job_id, parent, filter) rows into the parent table."""
 
+        if rows:
+            c.executemany('INSERT INTO parent (job_id, parent, filter) '
+                          'VALUES (%s, %s, %s)', rows)
+
+    @read_write
     def delete_some_parents(self, job_id, parents):
         """
         removes specified jobs from the parent table for the child 'job_id'.
@@ -1581,6 +3165,7 @@ class JSAProcDB:
 
         return job_id
 
+    @read_write
     def replace_parents(self, job_id, newparents, filters=None):
         """
         Replace all parent jobs in data base with new parents
@@ -1593,11 +3178,13 @@ class JSAProcDB:
             self._delete_all_parents(job_id, c)
             self._insert_parents(job_id, c, parents, filters)
 
+    @read_write
     def delete_parents(self, job_id):
         _validate_parents_to_remove(job_id, [], self)
         with self.db as c:
             self._delete_all_parents(job_id, c)
 
+    @read_write
     def add_note(self, job_id, message, username=None):
         """
         Add a note about a job.
@@ -1613,6 +3200,7 @@ class JSAProcDB:
                       'VALUES (%s, %s, %s)',
                       (job_id, message, username))
 
+    @read_only
     def get_notes(self, job_id):
         """
         Retrieve a list of notes for a given job.
@@ -1638,6 +3226,7 @@ class JSAProcDB:
 
         return result
 
+    @read_only
     def get_job_summary(self):
         """
         Get an ordered dictionary summarizaing the number of jobs in each
@@ -1646,19 +3235,64 @@ class JSAProcDB:
 
         result = defaultdict(dict)
 
-        with self.db as c:
-            c.execute('SELECT task, state, COUNT(*) AS number '
-                      'FROM job '
-                      'GROUP BY task, state '
-                      'ORDER BY task, state')
+        for ((task, state), number) in self.get_job_counts(
+                ('task', 'state')).items():
+            result[task][state] = number
 
-            while True:
-                row = c.fetchone()
-                if row is None:
-                    break
+        return result
+
+    @read_only
+    def get_job_counts(self, group_by, task=None, location=None, state=None,
+                       qa_state=None):
+        """
+        Get the number of jobs, grouped by the given columns, from the
+        job_count summary table.
+
+        group_by: list of columns from task, location, state and qa_state.
+
+        The counts can be restricted by task, location, state and qa_state
+        in the same manner as find_jobs.  Unlike find_jobs, deleted jobs
+        are included unless excluded via the state parameter.
+
+        Returns an ordered dictionary of numbers of jobs.  The keys
+        are tuples of the values of the group_by columns, or just the
+        value if there is only one such column.  Combinations for which
+        there are no jobs are omitted.
+        """
+
+        columns = ('task', 'location', 'state', 'qa_state')
+
+        for column in group_by:
+            if column not in columns:
+                raise JSAProcError(
+                    'Can not count jobs by column {0}'.format(column))
+
+        query = {}
+        for (column, value) in zip(
+                columns, (task, location, state, qa_state)):
+            if value is not None:
+                query[column] = value
+
+        sql = 'SELECT ' + ', '.join(group_by) + \
+            ', SUM(number) FROM job_count'
+        param = []
 
-                (task, state, number) = row
-                result[task][state] = number
+        if query:
+            (where, param) = _dict_query_where_clause('job_count', query)
+            sql += ' WHERE ' + where
+
+        sql += ' GROUP BY ' + ', '.join(group_by) + \
+            ' HAVING SUM(number) > 0' + \
+            ' ORDER BY ' + ', '.join(group_by)
+
+        result = OrderedDict()
+
+        with self.db as c:
+            c.execute(sql, param)
+
+            for row in c.fetchall():
+                key = row[0] if len(group_by) == 1 else tuple(row[:-1])
+                result[key] = int(row[-1])
 
         return result
 
@@ -1703,7 +3337,8 @@ def _dict_query_where_clause(table, wheredict, logic_or=False):
     parameters for the query.
     """
 
-    if not valid_column.match(table) and not table in ['jcmt.COMMON']:
+    if not valid_column.match(table) and \
+            not table in ['jcmt.COMMON', 'omp.ompobslog']:
         raise JSAProcError('Invalid table name "{0}"'.format(table))
 
     where = []
@@ -1723,6 +3358,10 @@ def _dict_query_where_clause(table, wheredict, logic_or=False):
                 table_key = 'jcmt.COMMON.instrume'
             if key == 'tau':
                 table_key = '(jcmt.COMMON.wvmtaust+jcmt.COMMON.wvmtauen)/2.0'
+        elif table == 'omp.ompobslog':
+            if key == 'omp_status':
+                table_key = ('CASE WHEN omp.ompobslog.commentstatus IS NULL '
+                             'THEN 0 ELSE omp.ompobslog.commentstatus END')
 
 
 
@@ -1798,6 +3437,81 @@ def _dict_query_where_clause(table, wheredict, logic_or=False):
     return ('({0})'.format(where), params)
 
 
+def _obs_query_where_clause(obsquery):
+    """Prepare an expression selecting jobs with observations matching
+    the given query dictionary.
+
+    If all of the columns are present in the job_obs table then it is
+    used; otherwise the query refers to jcmt.COMMON.  Columns listed in
+    job_obs_live_columns are always taken from the OMP database.
+
+    returns: (where_query, params)
+    """
+
+    obsquery = obsquery.copy()
+    livequery = {}
+    for key in job_obs_live_columns:
+        if key in obsquery:
+            livequery[key] = obsquery.pop(key)
+
+    if not obsquery:
+        table = 'obsidss'
+        from_ = 'obsidss'
+
+    elif all(key in job_obs_columns for key in obsquery):
+        table = 'job_obs'
+        from_ = 'job_obs'
+
+    else:
+        table = 'jcmt.COMMON'
+        from_ = 'obsidss JOIN jcmt.COMMON ON obsidss.obsid=jcmt.COMMON.obsid'
+
+    where = []
+    params = []
+
+    if obsquery:
+        (obswhere, obsparams) = _dict_query_where_clause(table, obsquery)
+        where.append(obswhere)
+        params.extend(obsparams)
+
+    if livequery:
+        from_ += (
+            ' LEFT OUTER JOIN omp.ompobslog ON omp.ompobslog.obslogid = '
+            '(SELECT MAX(o2.obslogid) FROM omp.ompobslog AS o2 '
+            'WHERE o2.obsid={0}.obsid)'.format(table))
+        (livewhere, liveparams) = _dict_query_where_clause(
+            'omp.ompobslog', livequery)
+        where.append(livewhere)
+        params.extend(liveparams)
+
+    return ('job.id IN (SELECT job_id FROM ' + from_ + ' WHERE ' +
+            ' AND '.join(where) + ')',
+            params)
+
+
+def _chunks(values, size=None):
+    """Split a list of values into chunks for use in "IN (...)"
+    expressions.
+
+    Yields lists of at most "size" values (default: chunk_size).
+    """
+
+    if size is None:
+        size = chunk_size
+
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def _lease_holder():
+    """Identify this process for the purposes of job leases.
+
+    Returns a tuple of the (short) host name and process ID.
+    """
+
+    return (gethostname().partition('.')[0], os.getpid())
+
+
 def _validate_parents(job_id, parents, filters=None):
     """
     Validate that parents and filters are
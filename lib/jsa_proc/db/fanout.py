@@ -0,0 +1,110 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Concurrent execution of independent database queries.
+
+Pages such as the web summaries need the results of a large number
+of independent queries (e.g. job counts for each combination of state
+and location).  The fan_out function runs such queries using a number
+of worker threads, limited by the number of blocks which the database
+access object can execute concurrently (its "concurrency" attribute).
+When this is 1 the queries are simply run in turn in the calling thread.
+
+The underlying run_calls function can also be used directly for
+calls which do not access the database, such as filesystem checks.
+"""
+
+from __future__ import absolute_import
+
+from collections import OrderedDict
+import logging
+from threading import Thread
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+logger = logging.getLogger(__name__)
+
+
+def fan_out(db, calls, max_workers=None):
+    """Perform a number of independent database calls.
+
+    "calls" should be a dictionary of functions, taking no arguments
+    (e.g. created using functools.partial), by key.  The number of
+    worker threads is limited by the concurrency of the given database
+    access object and by max_workers, if specified.
+
+    Returns an OrderedDict of results by key, in the same order as
+    the "calls" dictionary.  If any of the calls raised an exception
+    then the first such exception (in the order of the "calls"
+    dictionary) is re-raised once all of the calls have finished.
+    """
+
+    n_workers = db.concurrency
+    if max_workers is not None:
+        n_workers = min(n_workers, max_workers)
+
+    return run_calls(calls, n_workers)
+
+
+def run_calls(calls, n_workers):
+    """Perform a number of independent calls using up to n_workers
+    threads.
+
+    The "calls" dictionary, result and exception handling are as for
+    fan_out.
+    """
+
+    n_workers = min(n_workers, len(calls))
+
+    if n_workers <= 1:
+        return OrderedDict((key, call()) for (key, call) in calls.items())
+
+    queue = Queue()
+    for (i, (key, call)) in enumerate(calls.items()):
+        queue.put((i, key, call))
+
+    results = {}
+    errors = {}
+
+    def worker():
+        while True:
+            try:
+                (i, key, call) = queue.get_nowait()
+            except Empty:
+                break
+
+            try:
+                results[key] = call()
+            except Exception as e:
+                errors[i] = e
+
+    logger.debug('Running %i calls using %i threads', len(calls), n_workers)
+
+    threads = [Thread(target=worker) for i in range(n_workers)]
+
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[min(errors.keys())]
+
+    return OrderedDict((key, results[key]) for key in calls.keys())
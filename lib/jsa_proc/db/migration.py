@@ -0,0 +1,247 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Versioned schema migrations for the JSA processing database.
+
+The version of the schema is recorded in the schema_version table.
+A database created from doc/schema.sql already contains the latest
+version of the schema, and records this in the schema_version table.
+Existing databases can be brought up to date by applying the
+migrations listed here, in order, using the migrate function
+(or "jsa_proc admin migrate").
+
+Migration statements are written in the SQLite dialect used by
+doc/schema.sql and translated for MySQL in the same way as by
+doc/Makefile.
+
+Note: when the database uses "table" locking mode, processes which were
+connected before a migration which adds tables will not lock the new
+tables and should be restarted.
+"""
+
+from __future__ import absolute_import
+
+from collections import namedtuple
+import logging
+import re
+
+from jsa_proc.error import JSAProcError
+
+logger = logging.getLogger(__name__)
+
+JSAProcMigration = namedtuple(
+    'JSAProcMigration', 'version description statements')
+
+migrations = [
+    JSAProcMigration(
+        1, 'Add job_count summary table', [
+            '''CREATE TABLE job_count (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task VARCHAR(80) NOT NULL,
+                location VARCHAR(80) NOT NULL,
+                state CHAR(1) NOT NULL,
+                qa_state CHAR(1) NOT NULL,
+                number INTEGER NOT NULL DEFAULT 0
+            )''',
+            'CREATE UNIQUE INDEX job_count_key ON job_count '
+            '(task, location, state, qa_state)',
+            'INSERT INTO job_count (task, location, state, qa_state, number) '
+            'SELECT task, location, state, qa_state, COUNT(*) '
+            'FROM job GROUP BY task, location, state, qa_state',
+        ]),
+    JSAProcMigration(
+        2, 'Add composite indexes for job queue and log queries', [
+            'CREATE INDEX job_queue ON job '
+            '(location, state, priority DESC, id)',
+            'CREATE INDEX job_queue_task ON job '
+            '(location, state, task, priority DESC, id)',
+            'CREATE INDEX log_job_state ON log (job_id, state_new, id)',
+        ]),
+    # Note: the job_obs table is populated from the JCMT and OMP
+    # databases, which must therefore be available (attached, in the
+    # case of SQLite) when this migration is applied.
+    JSAProcMigration(
+        3, 'Add job_obs observation information table', [
+            '''CREATE TABLE job_obs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id INTEGER NOT NULL,
+                obsid VARCHAR(48) NOT NULL,
+                utdate INTEGER DEFAULT NULL,
+                obsnum INTEGER DEFAULT NULL,
+                instrument VARCHAR(8) DEFAULT NULL,
+                obstype VARCHAR(10) DEFAULT NULL,
+                project VARCHAR(32) DEFAULT NULL,
+                survey VARCHAR(10) DEFAULT NULL,
+                scanmode VARCHAR(28) DEFAULT NULL,
+                sourcename VARCHAR(70) DEFAULT NULL,
+                tau DOUBLE DEFAULT NULL,
+                omp_status INTEGER DEFAULT NULL,
+                FOREIGN KEY (job_id) REFERENCES job(id)
+                    ON DELETE RESTRICT ON UPDATE RESTRICT
+            )''',
+            'CREATE UNIQUE INDEX job_obs_job_obsid ON job_obs '
+            '(job_id, obsid)',
+            'CREATE INDEX job_obs_obsid ON job_obs (obsid)',
+            'CREATE INDEX job_obs_utdate ON job_obs (utdate)',
+            'CREATE INDEX job_obs_project ON job_obs (project)',
+            'CREATE INDEX job_obs_survey ON job_obs (survey)',
+            'CREATE INDEX job_obs_instrument ON job_obs '
+            '(instrument, obstype)',
+            'INSERT INTO job_obs (job_id, obsid, utdate, obsnum, '
+            'instrument, obstype, project, survey, scanmode, '
+            'sourcename, tau, omp_status) '
+            'SELECT DISTINCT obsidss.job_id, obsidss.obsid, '
+            'jcmt.COMMON.utdate, jcmt.COMMON.obsnum, '
+            'jcmt.COMMON.instrume, jcmt.COMMON.obs_type, '
+            'jcmt.COMMON.project, jcmt.COMMON.survey, '
+            'CASE WHEN jcmt.COMMON.sam_mode=\'SCAN\' '
+            'THEN jcmt.COMMON.scan_pat ELSE jcmt.COMMON.sam_mode END, '
+            'jcmt.COMMON.object, '
+            '(jcmt.COMMON.wvmtaust + jcmt.COMMON.wvmtauen)/2.0, '
+            'CASE WHEN o.commentstatus IS NULL THEN 0 '
+            'ELSE o.commentstatus END '
+            'FROM obsidss '
+            'JOIN jcmt.COMMON ON obsidss.obsid=jcmt.COMMON.obsid '
+            'LEFT OUTER JOIN omp.ompobslog AS o ON o.obslogid = '
+            '(SELECT MAX(obslogid) FROM omp.ompobslog AS o2 '
+            'WHERE o2.obsid=jcmt.COMMON.obsid)',
+        ]),
+    # Note: the log_archive table has no foreign key so that, on MySQL,
+    # it can be partitioned manually if desired, e.g. by
+    # "ALTER TABLE log_archive PARTITION BY RANGE (id) (...)".
+    JSAProcMigration(
+        4, 'Add log_archive table for old log entries', [
+            '''CREATE TABLE log_archive (
+                id INTEGER NOT NULL PRIMARY KEY,
+                job_id INTEGER NOT NULL,
+                datetime TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                state_prev CHAR(1) NOT NULL DEFAULT "?",
+                state_new CHAR(1) NOT NULL DEFAULT "?",
+                message TEXT NOT NULL DEFAULT "",
+                host VARCHAR(80) NOT NULL DEFAULT "unknown",
+                username VARCHAR(80) NOT NULL DEFAULT "unknown"
+            )''',
+            'CREATE INDEX log_archive_job_id ON log_archive (job_id)',
+            'CREATE INDEX log_archive_job_state ON log_archive '
+            '(job_id, state_new, id)',
+        ]),
+    JSAProcMigration(
+        5, 'Add job_lease table for active job heartbeats', [
+            '''CREATE TABLE job_lease (
+                job_id INTEGER NOT NULL PRIMARY KEY,
+                state CHAR(1) NOT NULL,
+                state_return CHAR(1) NOT NULL,
+                host VARCHAR(80) NOT NULL DEFAULT "unknown",
+                pid INTEGER NOT NULL DEFAULT 0,
+                heartbeat TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (job_id) REFERENCES job(id)
+                    ON DELETE RESTRICT ON UPDATE RESTRICT
+            )''',
+            'CREATE INDEX job_lease_heartbeat ON job_lease (heartbeat)',
+        ]),
+]
+
+
+def get_schema_version(db):
+    """Determine the version of the database schema.
+
+    Returns None if there is no schema_version table, or 0 if the table
+    exists but no migrations have been recorded.
+    """
+
+    try:
+        with db.db as c:
+            c.execute('SELECT MAX(version) FROM schema_version')
+            (version,) = c.fetchone()
+
+    except JSAProcError:
+        return None
+
+    if version is None:
+        return 0
+
+    return version
+
+
+def migrate(db, dry_run=False):
+    """Apply all migrations which are newer than the current version
+    of the database schema.
+
+    Each migration is applied, and recorded in the schema_version
+    table, in a separate block.  (Note that MySQL implicitly commits
+    the transaction after each schema change, so a migration which fails
+    part way through may need to be cleaned up manually.)  These blocks
+    do not lock tables since, with MySQL table locking, tables created
+    by this process are not in its set of tables to lock.
+
+    Returns a list of the versions applied (or which would have been
+    applied, in dry run mode).
+    """
+
+    version = get_schema_version(db)
+
+    if version is None:
+        logger.info('Creating schema_version table')
+        version = 0
+
+        if not dry_run:
+            with db.db as c:
+                db.db.unlock()
+                c.execute(_translate(db, '''CREATE TABLE schema_version (
+                    version INTEGER NOT NULL PRIMARY KEY,
+                    description VARCHAR(255) NOT NULL DEFAULT "",
+                    applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                )'''))
+
+    applied = []
+
+    for migration in migrations:
+        if migration.version <= version:
+            continue
+
+        logger.info('Applying migration %i: %s',
+                    migration.version, migration.description)
+
+        if not dry_run:
+            with db.db as c:
+                db.db.unlock()
+
+                for statement in migration.statements:
+                    logger.debug('Executing: %s', statement)
+                    c.execute(_translate(db, statement))
+
+                c.execute(
+                    'INSERT INTO schema_version (version, description) '
+                    'VALUES (%s, %s)',
+                    (migration.version, migration.description))
+
+        applied.append(migration.version)
+
+    if not applied:
+        logger.info('Database schema is up to date (version %i)', version)
+
+    return applied
+
+
+def _translate(db, statement):
+    """Translate a statement for the dialect of the given database."""
+
+    if db.dialect == 'mysql':
+        statement = statement.replace('AUTOINCREMENT', 'AUTO_INCREMENT')
+
+        if statement.startswith('CREATE TABLE'):
+            statement = re.sub('\\)\\s*$', ') ENGINE=InnoDB', statement)
+
+    return statement
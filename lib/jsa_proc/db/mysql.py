@@ -16,161 +16,352 @@
 from __future__ import absolute_import
 
 import mysql.connector
-from threading import Lock
+import sys
+from threading import BoundedSemaphore, Lock, local
+import time
 
 from jsa_proc.db.db import JSAProcDB
+from jsa_proc.db.stats import get_db_stats
 from jsa_proc.error import JSAProcError
 
 
 class JSAProcMySQLLock():
-    """MySQL locking and cursor management class."""
-
-    def __init__(self, conn):
+    """MySQL locking and cursor management class.
+
+    Two locking modes are supported:
+
+    * "table": every block locks all of the tables with LOCK TABLES.
+      The set of tables is read when the object is constructed, so
+      processes must be restarted after a migration which adds tables
+      (see jsa_proc.db.migration).
+    * "transaction": no table locks are taken.  Each block runs as an InnoDB
+      transaction and methods which need to read rows before modifying them
+      lock those rows using "SELECT ... FOR UPDATE" (see for_update).
+
+    Each block uses a connection taken from a pool of up to pool_size
+    connections, created as needed by calling the "connect" function.
+    Blocks in different threads can therefore run concurrently, up to
+    the size of the pool.  (In "table" locking mode they are still
+    serialized by MySQL's table locks.)  The cursor for the current
+    block is stored per thread.
+
+    Rather than checking the connection at the start of every block,
+    idle connections are checked (and reconnected if necessary) when
+    they have not been used for check_interval seconds, and are closed
+    once they have been idle for more than max_idle seconds.
+    A connection on which an error occurred is discarded.
+
+    If a JSAProcDBStats object is given, the cursor is instrumented
+    and statistics are recorded for each block.
+    """
+
+    locking_modes = ('table', 'transaction')
+
+    def __init__(self, connect, locking='table', stats=None,
+                 pool_size=1, max_idle=3600.0, check_interval=30.0):
         """Construct new locking object."""
 
-        self._lock = Lock()
-        self._conn = conn
+        if locking not in self.locking_modes:
+            raise JSAProcError(
+                'Unknown database locking mode "{0}"'.format(locking))
+
+        if pool_size < 1:
+            raise JSAProcError(
+                'Invalid database pool size {0}'.format(pool_size))
+
+        self._connect = connect
+        self._semaphore = BoundedSemaphore(pool_size)
+        self._pool_lock = Lock()
+        self._idle = []
+        self._local = local()
         self._tables = None
+        self.locking = locking
+        self.stats = stats
+        self.pool_size = pool_size
+        self.max_idle = max_idle
+        self.check_interval = check_interval
 
-        with self as c:
-            result = []
-            c.execute('SHOW TABLES')
+        # Connect immediately so that any problem is reported when the
+        # database access object is constructed.
+        self._return_connection(connect())
 
-            while True:
-                row = c.fetchone()
-                if row is None:
-                    break
+        if locking == 'table':
+            with self as c:
+                result = []
+                c.execute('SHOW TABLES')
 
-                (table,) = row
+                while True:
+                    row = c.fetchone()
+                    if row is None:
+                        break
 
-                result.append(table)
+                    (table,) = row
 
-        self._tables = result
+                    result.append(table)
 
+            self._tables = result
 
     def __enter__(self):
         """Context manager block entry method."""
 
-        self._lock.acquire(True)
+        if self.stats is not None:
+            start = time.time()
 
-        # Make sure we still have an active connection to MySQL.
-        self._conn.ping(reconnect=True, attempts=3, delay=5)
+        self._semaphore.acquire(True)
 
-        self._cursor = self._conn.cursor()
+        try:
+            conn = self._get_connection()
+            cursor = conn.cursor()
 
-        if self._tables is not None:
-            self._cursor.execute(
-                'LOCK TABLES ' +
-                ', '.join([x + ' WRITE' for x in self._tables] #+ 
-                          #[x + ' READ' for x in self._readonlytables]
-                      ))
+            if self._tables is not None:
+                cursor.execute(
+                    'LOCK TABLES ' +
+                    ', '.join([x + ' WRITE' for x in self._tables] #+ 
+                              #[x + ' READ' for x in self._readonlytables]
+                          ))
+
+        except:
+            self._semaphore.release()
+            raise
 
+        if self.stats is not None:
+            cursor = self.stats.wrap_cursor(
+                cursor, sys._getframe(1).f_code.co_name, start)
 
+        self._local.conn = conn
+        self._local.cursor = cursor
 
-        return self._cursor
+        return cursor
 
     def __exit__(self, type_, value, tb):
         """Context manager block exit method."""
 
-        if type_ is None:
-            self._conn.commit()
-        else:
-            self._conn.rollback()
+        conn = self._local.conn
+        cursor = self._local.cursor
+        del self._local.conn
+        del self._local.cursor
 
-        if self._tables is not None:
-            self._cursor.execute('UNLOCK TABLES')
+        try:
+            if type_ is None:
+                conn.commit()
+            else:
+                conn.rollback()
 
-        self._cursor.close()
-        del self._cursor
+            if self._tables is not None:
+                cursor.execute('UNLOCK TABLES')
 
-        self._lock.release()
+            if self.stats is not None:
+                self.stats.record_block(cursor)
+
+            cursor.close()
+
+        except:
+            self._discard_connection(conn)
+            raise
+
+        else:
+            # Return the connection to the pool unless it may have
+            # been broken by an error.
+            if type_ is not None and issubclass(type_, mysql.connector.Error):
+                self._discard_connection(conn)
+            else:
+                self._return_connection(conn)
+
+        finally:
+            self._semaphore.release()
 
         # If we got a database-specific error, re-raise it as our
         # generic error.  Let other exceptions through unchanged.
         if type_ is not None and issubclass(type_, mysql.connector.Error):
             raise JSAProcError(str(value))
 
+    def _get_connection(self):
+        """Take a connection from the pool, or make a new connection.
+
+        Idle connections which have expired are closed, and those which
+        have not been checked recently are pinged.
+        """
+
+        now = time.time()
+
+        while True:
+            with self._pool_lock:
+                if not self._idle:
+                    break
+
+                (conn, last_used) = self._idle.pop()
+
+            if self.max_idle is not None and now - last_used > self.max_idle:
+                self._discard_connection(conn)
+                continue
+
+            if (self.check_interval is None or
+                    now - last_used > self.check_interval):
+                # Make sure we still have an active connection to MySQL.
+                conn.ping(reconnect=True, attempts=3, delay=5)
+
+            return conn
+
+        return self._connect()
+
+    def _return_connection(self, conn):
+        """Return a connection to the pool of idle connections."""
+
+        with self._pool_lock:
+            self._idle.append((conn, time.time()))
+
+    def _discard_connection(self, conn):
+        """Close a connection which is not to be returned to the pool."""
+
+        try:
+            conn.close()
+        except mysql.connector.Error:
+            pass
+
     def close(self):
-        """Close the database connection."""
+        """Close the idle database connections."""
 
-        self._conn.close()
+        with self._pool_lock:
+            idle = self._idle
+            self._idle = []
 
+        for (conn, last_used) in idle:
+            conn.close()
 
     def unlock(self):
         """ UNLOCK tables """
-        self._cursor.execute('UNLOCK TABLES')
+        if self._tables is not None:
+            self._local.cursor.execute('UNLOCK TABLES')
+
+    def for_update(self, skip_locked=False):
+        """Get the locking clause for a SELECT preceding an update.
+
+        In transaction mode this is " FOR UPDATE" so that the selected
+        rows remain locked until the end of the block.  If skip_locked
+        is specified, rows already locked by another connection are
+        skipped rather than waited for.  In table locking mode the whole
+        table is already locked, so an empty string is returned.
+        """
+
+        if self.locking == 'transaction':
+            if skip_locked:
+                return ' FOR UPDATE SKIP LOCKED'
+            return ' FOR UPDATE'
+
+        return ''
+
+    def on_duplicate_increment(self, key_columns, column):
+        """Get the clause for an INSERT which should instead add to
+        the given column if a row with the same key already exists."""
+
+        return ' ON DUPLICATE KEY UPDATE {0} = {0} + VALUES({0})'.format(
+            column)
+
+    def utc_timestamp(self, seconds_ago=None):
+        """Get an expression for the database server's current UTC time,
+        or the time the given number of seconds ago.
+
+        Returns: a tuple of the expression and its parameters.
+        """
+
+        if seconds_ago is None:
+            return ('UTC_TIMESTAMP()', [])
+
+        return ('UTC_TIMESTAMP() - INTERVAL %s SECOND', [seconds_ago])
+
+    def begin_write(self, cursor):
+        """Prepare the current block for a read followed by a write.
+
+        Nothing is required for MySQL: the tables are already locked
+        or the rows will be locked by for_update.
+        """
+
+        pass
 
 class JSAProcMySQL(JSAProcDB):
     """JSA processing database MySQL database access class."""
 
-    def __init__(self, config):
+    dialect = 'mysql'
+
+    def __init__(self, config, read_replica=False):
         """Construct MySQL access object.
 
-        Takes as an argument the configuration object.
+        Takes as an argument the configuration object.  The locking
+        mode is read from the optional "locking" entry of the "database"
+        section (default "table").  The lifetime of cached task
+        information can be set by the optional "cache_ttl" entry
+        (in seconds).  Instrumentation is configured as described
+        for the jsa_proc.db.stats.get_db_stats function.
+
+        The connection pool is configured by the optional "pool_size"
+        (default 1), "pool_max_idle" and "pool_check_interval" (seconds)
+        entries.  See the JSAProcMySQLLock class.
+
+        If read_replica is specified, and the "database" section has a
+        "replica_host" entry, a connection pool is also created for
+        that server and used by read-only methods.  The "replica_database",
+        "replica_user" and "replica_password" entries may be used if they
+        differ from those of the primary database.  The replica is always
+        used in "transaction" locking mode.
         """
 
-        conn = mysql.connector.connect(
+        locking = 'table'
+        if config.has_option('database', 'locking'):
+            locking = config.get('database', 'locking')
+
+        cache_ttl = None
+        if config.has_option('database', 'cache_ttl'):
+            cache_ttl = config.getfloat('database', 'cache_ttl')
+
+        pool_kwargs = {}
+        if config.has_option('database', 'pool_size'):
+            pool_kwargs['pool_size'] = config.getint('database', 'pool_size')
+        if config.has_option('database', 'pool_max_idle'):
+            pool_kwargs['max_idle'] = config.getfloat(
+                'database', 'pool_max_idle')
+        if config.has_option('database', 'pool_check_interval'):
+            pool_kwargs['check_interval'] = config.getfloat(
+                'database', 'pool_check_interval')
+
+        connect_kwargs = dict(
             host=config.get('database', 'host'),
             database=config.get('database', 'database'),
             user=config.get('database', 'user'),
             password=config.get('database', 'password'))
 
-        self.db = JSAProcMySQLLock(conn)
+        def connect():
+            return mysql.connector.connect(**connect_kwargs)
 
-        JSAProcDB.__init__(self)
+        stats = get_db_stats(config)
 
-    def __del__(self):
-        """Destroy MySQL access object."""
-
-        self.db.close()
+        self.db = JSAProcMySQLLock(connect, locking=locking, stats=stats,
+                                   **pool_kwargs)
 
-    def job_prev_next(self, job_id,
-                      state=None, location=None, task=None, qa_state=None,
-                      tag=None,
-                      prioritize=False, sort=False, sortdir='ASC',
-                      obsquery=None, tiles=None):
-        """MySQL-specific previous and next job query.
+        self.concurrency = self.db.pool_size
 
-        Return: a tuple of the previous and next job identifiers.
-        """
+        replica = None
+        if read_replica and config.has_option('database', 'replica_host'):
+            replica_kwargs = connect_kwargs.copy()
+            replica_kwargs['host'] = config.get('database', 'replica_host')
+            for key in ('database', 'user', 'password'):
+                if config.has_option('database', 'replica_' + key):
+                    replica_kwargs[key] = config.get(
+                        'database', 'replica_' + key)
 
-        # Prepare the same kind of query which find_jobs would use.
-        (where, param) = self._find_jobs_where(
-            state, location, task, qa_state, tag, obsquery, tiles)
+            def connect_replica():
+                return mysql.connector.connect(**replica_kwargs)
 
-        order = self._find_jobs_order(prioritize, sort, sortdir)
+            replica = JSAProcMySQLLock(connect_replica,
+                                       locking='transaction',
+                                       stats=stats,
+                                       **pool_kwargs)
 
-        if where:
-            where_query = 'WHERE ' + ' AND '.join(where)
-        else:
-            where_query = ''
+        JSAProcDB.__init__(self, cache_ttl=cache_ttl, replica=replica)
 
-        if order:
-            order_query = 'ORDER BY ' + ', '.join(order)
-        else:
-            order_query = 'ORDER BY job.id ASC'
-
-        # Now create the query to get the next and previous entries.  This
-        # is done in using the LAG and LEAD windowing functions and then
-        # an outer query to select the required row.
-        query = 'SELECT id_prev, id_next FROM ' \
-                '(SELECT id, LAG(id) OVER w AS id_prev, LEAD(id) OVER w AS id_next ' \
-                'FROM job ' + where_query + ' WINDOW w AS (' + order_query + ')) ' \
-                'AS prev_next WHERE id = %s'
-
-        param.append((job_id))
-
-        prev = next_ = None
-
-        with self.db as c:
-            if 'jcmt.COMMON' in query:
-                c.execute('UNLOCK TABLES')
-            c.execute(query, param)
-            while True:
-                row = c.fetchone()
-                if row is None:
-                    break
+    def __del__(self):
+        """Destroy MySQL access object."""
 
-                (prev, next_) = row
+        self.db.close()
 
-        return (prev, next_)
+        if self._replica is not None:
+            self._replica.close()
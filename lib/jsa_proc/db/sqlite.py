@@ -14,12 +14,16 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
 import os
 import re
 import sqlite3
+import sys
 from threading import Lock
+import time
 
 from jsa_proc.db.db import JSAProcDB
+from jsa_proc.db.stats import get_db_stats
 from jsa_proc.error import JSAProcError
 
 # By default, sqlite3 only recognizes "TIMESTAMP" columns as containing
@@ -27,6 +31,104 @@ from jsa_proc.error import JSAProcError
 # to also be used for "DATETIME" columns.
 sqlite3.register_converter('DATETIME', sqlite3.converters['TIMESTAMP'])
 
+# Settings applied to databases opened by get_sqlite_database, which can be
+# overridden by "sqlite_<pragma>" entries in the configuration file.
+# Write-ahead logging allows readers to proceed while another process is
+# writing, and in that mode the "NORMAL" synchronous setting is safe.
+# The cache size is given in KiB (as a negative number).
+production_pragmas = OrderedDict([
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', '-65536'),
+    ('mmap_size', '268435456'),
+])
+
+# Default time (seconds) for which to wait for another process to
+# release the database.
+default_busy_timeout = 30.0
+
+# Regular expressions used to check pragma names and values.
+valid_pragma_name = re.compile('^[a-z_]+$')
+valid_pragma_value = re.compile('^-?[A-Za-z0-9]+$')
+
+# Cache of queries translated by translate_query, and the maximum
+# number of entries it may contain before it is cleared.
+_query_cache = {}
+query_cache_size = 1000
+
+
+def get_sqlite_database(config, read_replica=False):
+    """Construct an SQLite database access object based on the
+    "database" section of the given configuration.
+
+    The database file is given by the "filename" entry.  The optional
+    entries are:
+
+    * "busy_timeout": time (seconds) to wait for another process
+      to release the database before giving up (default given by
+      default_busy_timeout).
+    * "sqlite_journal_mode", "sqlite_synchronous", "sqlite_cache_size"
+      and "sqlite_mmap_size": override the production_pragmas values.
+    * "jcmt_filename" and "omp_filename": files to attach as the
+      "jcmt" and "omp" databases, which are needed for observation
+      information.
+    * "replica_filename": read replica (only used if read_replica
+      is specified).
+    * "cache_ttl": as for the MySQL database.
+
+    Instrumentation is configured as described for the
+    jsa_proc.db.stats.get_db_stats function.
+    """
+
+    pragmas = production_pragmas.copy()
+    for name in pragmas:
+        if config.has_option('database', 'sqlite_' + name):
+            pragmas[name] = config.get('database', 'sqlite_' + name)
+
+    busy_timeout = default_busy_timeout
+    if config.has_option('database', 'busy_timeout'):
+        busy_timeout = config.getfloat('database', 'busy_timeout')
+
+    attach = OrderedDict()
+    for schema in ('jcmt', 'omp'):
+        if config.has_option('database', schema + '_filename'):
+            attach[schema] = config.get('database', schema + '_filename')
+
+    replica_filename = None
+    if read_replica and config.has_option('database', 'replica_filename'):
+        replica_filename = config.get('database', 'replica_filename')
+
+    cache_ttl = None
+    if config.has_option('database', 'cache_ttl'):
+        cache_ttl = config.getfloat('database', 'cache_ttl')
+
+    return JSAProcSQLite(
+        config.get('database', 'filename'),
+        stats=get_db_stats(config), replica_filename=replica_filename,
+        busy_timeout=busy_timeout, pragmas=pragmas, attach=attach,
+        cache_ttl=cache_ttl)
+
+
+def translate_query(query):
+    """Translate a query intended for MySQL for use with SQLite.
+
+    Replaces format style parameter placeholders (%s) with question
+    marks (?) and applies add_types.  The results are cached, since
+    the same queries are used repeatedly.
+    """
+
+    translated = _query_cache.get(query)
+
+    if translated is None:
+        translated = add_types(query.replace('%s', '?'))
+
+        if len(_query_cache) >= query_cache_size:
+            _query_cache.clear()
+
+        _query_cache[query] = translated
+
+    return translated
+
 
 def add_types(query):
     """Add type information where needed for SQLite.
@@ -59,12 +161,20 @@ class FormatCursor(sqlite3.Cursor):
 
         Replaces format style parameter placeholders (%s) with question
         marks (?).  This allows queries intended for MySQL to be used
-        with SQLite.
+        with SQLite.  (See translate_query.)
         """
-        query = re.sub('\%s', '?', query)
-        query = add_types(query)
+        query = translate_query(query)
         return sqlite3.Cursor.execute(self, query, *args, **kwargs)
 
+    def executemany(self, query, *args, **kwargs):
+        """
+        Overridden executemany method.
+
+        Performs the same placeholder substitution as the execute method.
+        """
+        query = translate_query(query)
+        return sqlite3.Cursor.executemany(self, query, *args, **kwargs)
+
 
 class AtCursor(sqlite3.Cursor):
     """Custom SQLite cursor class.
@@ -90,14 +200,19 @@ class AtCursor(sqlite3.Cursor):
 
 
 class JSAProcSQLiteLock():
-    """SQLite locking and cursor management class."""
+    """SQLite locking and cursor management class.
 
-    def __init__(self, conn, paramstyle='format'):
+    If a JSAProcDBStats object is given, the cursor is instrumented
+    and statistics are recorded for each block.
+    """
+
+    def __init__(self, conn, paramstyle='format', stats=None):
         """Construct new locking object."""
 
         self._lock = Lock()
         self._conn = conn
         self.paramstyle = paramstyle
+        self.stats = stats
 
     def __enter__(self):
         """Context manager block entry method.
@@ -106,13 +221,22 @@ class JSAProcSQLiteLock():
         database cursor.
         """
 
+        if self.stats is not None:
+            start = time.time()
+
         self._lock.acquire(True)
+        self._write_begun = False
         if self.paramstyle == 'format':
             self._cursor = self._conn.cursor(FormatCursor)
         elif self.paramstyle == 'at':
             self._cursor = self._conn.cursor(AtCursor)
         else:
             raise Exception('Unknown paramstyle {0}'.format(self.paramstyle))
+
+        if self.stats is not None:
+            self._cursor = self.stats.wrap_cursor(
+                self._cursor, sys._getframe(1).f_code.co_name, start)
+
         return self._cursor
 
     def __exit__(self, type_, value, tb):
@@ -127,6 +251,9 @@ class JSAProcSQLiteLock():
         else:
             self._conn.rollback()
 
+        if self.stats is not None:
+            self.stats.record_block(self._cursor)
+
         self._cursor.close()
         del self._cursor
 
@@ -146,11 +273,52 @@ class JSAProcSQLiteLock():
         """ Does nothing in sqlite? """
         pass
 
+    def for_update(self, skip_locked=False):
+        """SQLite has no row locks, so no SELECT locking clause is needed."""
+
+        return ''
+
+    def on_duplicate_increment(self, key_columns, column):
+        """Get the clause for an INSERT which should instead add to
+        the given column if a row with the same key already exists."""
+
+        return ' ON CONFLICT ({0}) DO UPDATE SET {1} = {1} + excluded.{1}' \
+            .format(', '.join(key_columns), column)
+
+    def utc_timestamp(self, seconds_ago=None):
+        """Get an expression for the current UTC time, or the time the
+        given number of seconds ago.
+
+        Returns: a tuple of the expression and its parameters.
+        """
+
+        if seconds_ago is None:
+            return ('CURRENT_TIMESTAMP', [])
+
+        return ('DATETIME(\'now\', %s)', ['-{0} seconds'.format(seconds_ago)])
+
+    def begin_write(self, cursor):
+        """Prepare the current block for a read followed by a write.
+
+        Starts an immediate transaction, if this has not already been
+        done in the current block, so that other processes can not write
+        to the database between our SELECT and the following UPDATE.
+        This must therefore be called before the first write in the block.
+        """
+
+        if not self._write_begun:
+            cursor.execute('BEGIN IMMEDIATE')
+            self._write_begun = True
+
 
 class JSAProcSQLite(JSAProcDB):
     """JSA Processing database SQLite database access class."""
 
-    def __init__(self, filename, file_already_exists=True):
+    dialect = 'sqlite'
+
+    def __init__(self, filename, file_already_exists=True, stats=None,
+                 replica_filename=None, busy_timeout=default_busy_timeout,
+                 pragmas=None, attach=None, cache_ttl=None):
         """Construct SQLite access object.
 
         Opens the specified SQLite database file and prepares
@@ -158,23 +326,70 @@ class JSAProcSQLite(JSAProcDB):
         of the JSAProcSQLiteLock class -- this should be used as
         a context manager to acquire a database cursor whenever
         the database is to be accessed.
+
+        Database access statistics will be recorded if a
+        JSAProcDBStats object is given.
+
+        If replica_filename is given, that file is opened as a
+        read replica of the database.
+
+        Connections wait for up to busy_timeout seconds for another
+        process to release the database.  The given pragmas (a dictionary
+        of values by name, e.g. production_pragmas) are applied to each
+        connection, and the databases given by the "attach" dictionary
+        of filenames by schema name (e.g. "jcmt") are attached.
         """
 
+        self._busy_timeout = busy_timeout
+        self._pragmas = pragmas
+        self._attach = attach
+
+        self.db = JSAProcSQLiteLock(
+            self._connect(filename, file_already_exists), stats=stats)
+
+        replica = None
+        if replica_filename is not None:
+            replica = JSAProcSQLiteLock(
+                self._connect(replica_filename, True), stats=stats)
+
+        JSAProcDB.__init__(self, cache_ttl=cache_ttl, replica=replica)
+
+    def _connect(self, filename, file_already_exists):
+        """Open a connection to an SQLite database file."""
+
         if file_already_exists:
             if filename != ':memory:' and 'mode=memory' not in filename and not os.path.exists(filename):
                 raise Exception('SQLite file ' + filename + ' not found')
 
         conn = sqlite3.connect(
-            filename, check_same_thread=False,
+            filename, check_same_thread=False, timeout=self._busy_timeout,
             detect_types=(sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES))
 
         c = conn.cursor()
         c.execute('PRAGMA foreign_keys = ON')
-        c.close()
 
-        self.db = JSAProcSQLiteLock(conn)
+        if self._pragmas:
+            for (name, value) in self._pragmas.items():
+                value = str(value)
+                if not (valid_pragma_name.match(name) and
+                        valid_pragma_value.match(value)):
+                    raise JSAProcError(
+                        'Invalid SQLite pragma {0} = {1}'.format(name, value))
+
+                c.execute('PRAGMA {0} = {1}'.format(name, value))
 
-        JSAProcDB.__init__(self)
+        if self._attach:
+            for (schema, attach_filename) in self._attach.items():
+                if not valid_pragma_name.match(schema):
+                    raise JSAProcError(
+                        'Invalid SQLite schema name {0}'.format(schema))
+
+                c.execute('ATTACH DATABASE ? AS {0}'.format(schema),
+                          (attach_filename,))
+
+        c.close()
+
+        return conn
 
     def __del__(self):
         """Destroy SQLite access object.
@@ -183,3 +398,6 @@ class JSAProcSQLite(JSAProcDB):
         """
 
         self.db.close()
+
+        if self._replica is not None:
+            self._replica.close()
@@ -0,0 +1,329 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Optional instrumentation of database access.
+
+When enabled, the database locking objects wrap their cursors in an
+InstrumentedCursor and record, for each method of the database access
+class ("call site"), the time spent waiting for and holding the lock,
+and for each query (identified by a fingerprint of its text) the
+execution time and number of rows returned.
+"""
+
+from __future__ import absolute_import, division
+
+import atexit
+import json
+import logging
+import os
+import re
+from socket import gethostname
+from threading import Lock
+import time
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger(__name__ + '.slow')
+
+stats_file_pattern = re.compile('^dbstats_.*\\.json$')
+
+
+def get_db_stats(config):
+    """Construct a JSAProcDBStats object based on the "database"
+    section of the given configuration.
+
+    Instrumentation is enabled by the "instrument" entry.  The
+    "slow_query_time" (seconds) and "stats_dir" entries are optional.
+
+    Returns None if instrumentation is not enabled.
+    """
+
+    if not (config.has_option('database', 'instrument') and
+            config.getboolean('database', 'instrument')):
+        return None
+
+    kwargs = {}
+
+    if config.has_option('database', 'slow_query_time'):
+        kwargs['slow_query_time'] = config.getfloat(
+            'database', 'slow_query_time')
+
+    if config.has_option('database', 'stats_dir'):
+        kwargs['directory'] = config.get('database', 'stats_dir')
+
+    return JSAProcDBStats(**kwargs)
+
+
+def fingerprint(query):
+    """Reduce a query to a fingerprint identifying its form.
+
+    Literal values and placeholders are replaced with "?" and
+    lists of placeholders (e.g. for "IN" expressions) are
+    collapsed to "?+" so that the fingerprint does not depend
+    on the number of values.
+    """
+
+    query = re.sub('\'(?:[^\'\\\\]|\\\\.)*\'', '?', query)
+    query = re.sub('%s|\\b\\d+\\b', '?', query)
+    query = re.sub('\\?(?:\\s*,\\s*\\?)+', '?+', query)
+    return re.sub('\\s+', ' ', query).strip()
+
+
+def read_db_stats(directory):
+    """Read and combine the statistics files in the given directory.
+
+    Returns a JSAProcDBStats object containing the combined statistics.
+    """
+
+    combined = JSAProcDBStats()
+
+    for filename in sorted(os.listdir(directory)):
+        if not stats_file_pattern.search(filename):
+            continue
+
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                stats = json.load(f)
+
+        except ValueError:
+            logger.warning('Could not read database statistics file %s',
+                           filename)
+            continue
+
+        for entry in stats['blocks']:
+            _combine_entry(combined.blocks, entry['site'],
+                           combined.block_fields,
+                           [entry[x] for x in combined.block_fields])
+
+        for entry in stats['queries']:
+            _combine_entry(combined.queries, (entry['site'], entry['query']),
+                           combined.query_fields,
+                           [entry[x] for x in combined.query_fields])
+
+    return combined
+
+
+def _combine_entry(entries, key, fields, values):
+    """Combine a list of statistics values into a dictionary.
+
+    Fields with names ending "_max" are combined by taking the maximum;
+    all other fields are summed.
+    """
+
+    entry = entries.get(key)
+
+    if entry is None:
+        entries[key] = list(values)
+
+    else:
+        for (i, (field, value)) in enumerate(zip(fields, values)):
+            if field.endswith('_max'):
+                entry[i] = max(entry[i], value)
+            else:
+                entry[i] += value
+
+
+class JSAProcDBStats():
+    """Database access statistics class.
+
+    Statistics are accumulated in memory and, if a directory is
+    specified, written periodically (and at exit) to a file in that
+    directory named for the host and process.  Queries taking longer
+    than slow_query_time seconds are written to the slow query log
+    (logger "jsa_proc.db.stats.slow").
+
+    Blocks may run concurrently (e.g. when using a pool of MySQL
+    connections) so the recording methods take a lock while updating
+    the statistics.
+    """
+
+    def __init__(self, slow_query_time=1.0, directory=None,
+                 write_interval=60.0):
+        self.slow_query_time = slow_query_time
+        self.directory = directory
+        self.write_interval = write_interval
+
+        # Dictionaries of statistics by call site, and by call site
+        # and query fingerprint.  Each entry is a list of values
+        # as described by the corresponding *_fields attribute.
+        self.blocks = {}
+        self.queries = {}
+
+        self._last_write = time.time()
+        self._lock = Lock()
+
+        if directory is not None:
+            self.filename = os.path.join(
+                directory, 'dbstats_{0}_{1}.json'.format(
+                    gethostname().partition('.')[0], os.getpid()))
+
+            atexit.register(self.write)
+
+        else:
+            self.filename = None
+
+    block_fields = ('count', 'wait', 'wait_max', 'hold', 'hold_max')
+    query_fields = ('count', 'time', 'time_max', 'rows')
+
+    def wrap_cursor(self, cursor, site, start):
+        """Wrap a cursor for a block which started (i.e. began waiting
+        for the lock) at the given time."""
+
+        return InstrumentedCursor(cursor, self, site, start)
+
+    def record_block(self, cursor):
+        """Record statistics at the end of a block.
+
+        Takes the InstrumentedCursor which was used in the block.
+        """
+
+        cursor._finish_query()
+
+        now = time.time()
+        wait = cursor._locked - cursor._start
+        hold = now - cursor._locked
+
+        with self._lock:
+            _combine_entry(self.blocks, cursor._site, self.block_fields,
+                           (1, wait, wait, hold, hold))
+
+            write = (self.filename is not None and
+                     now - self._last_write > self.write_interval)
+            if write:
+                self._last_write = now
+
+        if write:
+            self.write()
+
+    def record_query(self, site, query, elapsed, rows):
+        """Record statistics for a query."""
+
+        key = (site, fingerprint(query))
+
+        with self._lock:
+            _combine_entry(self.queries, key, self.query_fields,
+                           (1, elapsed, elapsed, rows))
+
+        if (self.slow_query_time is not None and
+                elapsed > self.slow_query_time):
+            slow_query_logger.warning(
+                'Slow query (%.3f s, %i rows) in %s: %s',
+                elapsed, rows, site, key[1])
+
+    def as_dict(self):
+        """Get the statistics as a dictionary suitable for writing
+        as JSON."""
+
+        with self._lock:
+            return {
+                'blocks': [
+                    dict(zip(self.block_fields, values), site=site)
+                    for (site, values) in self.blocks.items()],
+                'queries': [
+                    dict(zip(self.query_fields, values),
+                         site=site, query=query)
+                    for ((site, query), values) in self.queries.items()],
+            }
+
+    def write(self):
+        """Write the statistics to this process's file (if any)."""
+
+        self._last_write = time.time()
+
+        if self.filename is None:
+            return
+
+        try:
+            tmpname = self.filename + '.tmp'
+            with open(tmpname, 'w') as f:
+                json.dump(self.as_dict(), f)
+            os.rename(tmpname, self.filename)
+
+        except (IOError, OSError) as e:
+            logger.warning('Could not write database statistics: %s', e)
+
+
+class InstrumentedCursor():
+    """Wrapper for a database cursor which records query statistics.
+
+    Attributes which are not overridden are passed through to the
+    underlying cursor.
+    """
+
+    def __init__(self, cursor, stats, site, start):
+        self._cursor = cursor
+        self._stats = stats
+        self._site = site
+        self._start = start
+        self._locked = time.time()
+        self._query = None
+        self._rows = 0
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._rows += 1
+            yield row
+
+    def execute(self, query, *args, **kwargs):
+        return self._execute('execute', query, args, kwargs)
+
+    def executemany(self, query, *args, **kwargs):
+        return self._execute('executemany', query, args, kwargs)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._rows += len(rows)
+        return rows
+
+    def _execute(self, method, query, args, kwargs):
+        self._finish_query()
+
+        start = time.time()
+        result = getattr(self._cursor, method)(query, *args, **kwargs)
+
+        self._query = query
+        self._elapsed = time.time() - start
+
+        # For statements which do not return rows, record the number
+        # of rows affected instead.
+        if self._cursor.description is None:
+            self._rows = max(self._cursor.rowcount, 0)
+        else:
+            self._rows = 0
+
+        # SQLite cursors return themselves: return the wrapper instead
+        # so that rows fetched via the return value are counted.
+        if result is self._cursor:
+            return self
+        return result
+
+    def _finish_query(self):
+        if self._query is not None:
+            self._stats.record_query(
+                self._site, self._query, self._elapsed, self._rows)
+            self._query = None
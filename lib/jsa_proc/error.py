@@ -96,6 +96,13 @@ class ParentNotReadyError(JSAProcError):
     pass
 
 
+class LeaseLostError(JSAProcError):
+    """
+    Error indicating that this process no longer holds the lease on a job.
+    """
+    pass
+
+
 class CommandError(Exception):
     """Class for errors detected running a command."""
     pass
@@ -197,8 +197,10 @@ def get_parents(tile, parenttask, exclude_pointing_jobs=False,
         logger.debug(
             '%i jobs were excluded due to wrong OMP status',
             len(excludedjobs_ompstatus))
+        excluded_obs_info = db.get_obs_info_many(
+            [i.id for i in excludedjobs_ompstatus])
         for i in excludedjobs_ompstatus:
-            omp_status = db.get_obs_info(i.id)[0].omp_status
+            omp_status = excluded_obs_info[i.id][0].omp_status
             logger.debug(
                 'Job %i NOT INCLUDED (omp status of %s)',
                 i.id, OMPState.get_name(omp_status))
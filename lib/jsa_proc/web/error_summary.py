@@ -75,7 +75,7 @@ def prepare_error_summary(db, redirect_url, filtering=None, chosentask=None,
                 location=l, task=chosentask,
                 state_prev=(state_prev if error_state == JSAProcState.ERROR
                             else None),
-                error_state=error_state)
+                error_state=error_state, latest_only=True)
 
             error_filter(error_dict[l])
 
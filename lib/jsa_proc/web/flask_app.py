@@ -56,7 +56,7 @@ def create_web_app():
     """Function to prepare the Flask web application."""
 
     home = get_home()
-    db = get_database()
+    db = get_database(read_replica=True)
     database_name = get_config().get('database', 'database')
 
     app = Flask(
@@ -149,6 +149,8 @@ def create_web_app():
         return prepare_job_list(
             db,
             page=request.args.get('page', None),
+            after_id=request.args.get('after_id', None, type=int),
+            before_id=request.args.get('before_id', None, type=int),
             **kwargs)
 
     @app.route('/image/<task>/piechart')
@@ -37,9 +37,16 @@ def prepare_change_state(db, job_ids, newstate, state_prev, message, username):
     if message == '':
         raise ErrorPage('You must provide a message to change state!')
 
-    for job_id in job_ids:
-        db.change_state(job_id, newstate, message, state_prev=state_prev,
-                        username=username)
+    job_ids = [int(x) for x in job_ids]
+
+    unmatched = db.change_states(job_ids, newstate, message,
+                                 state_prev=state_prev, username=username)
+
+    if unmatched:
+        raise ErrorPage(
+            'Jobs not found in state {0}: {1}'.format(
+                JSAProcState.get_name(state_prev),
+                ', '.join(str(x) for x in unmatched)))
 
 
 def prepare_change_qa(db, job_ids, qa_state, message, username):
@@ -51,5 +58,11 @@ def prepare_change_qa(db, job_ids, qa_state, message, username):
                         ' or '.join((JSAQAState.get_name(x)
                                      for x in JSAQAState.STATE_IFFY)) + '.')
 
-    for job_id in job_ids:
-        db.add_qa_entry(job_id, qa_state, message, username)
+    job_ids = [int(x) for x in job_ids]
+
+    unmatched = db.add_qa_entries(job_ids, qa_state, message, username)
+
+    if unmatched:
+        raise ErrorPage(
+            'Jobs not found: {0}'.format(
+                ', '.join(str(x) for x in unmatched)))
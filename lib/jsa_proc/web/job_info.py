@@ -65,8 +65,8 @@ def prepare_job_info(db, job_id, query):
         parent_obs = OrderedDict()
         pjobs = list(parents.keys())
         pjobs.sort()
-        for i in pjobs:
-            parent_obs[i] = [o._asdict() for o in db.get_obs_info(i)]
+        for (i, obsinfo) in db.get_obs_info_many(pjobs).items():
+            parent_obs[i] = [o._asdict() for o in obsinfo]
     except NoRowsError:
         parents = None
         parent_obs = None
@@ -19,27 +19,68 @@ from jsa_proc.state import JSAProcState
 from jsa_proc.jcmtobsinfo import ObsQueryDict
 from jsa_proc.qa_state import JSAQAState
 from jsa_proc.web.job_search import job_search
-from jsa_proc.web.util import url_for, calculate_pagination
+from jsa_proc.web.util import url_for, number_per_page, Pagination
 
 
-def prepare_job_list(db, page, **kwargs):
+def prepare_job_list(db, page=None, after_id=None, before_id=None,
+                     **kwargs):
+    """Prepare the job list page.
+
+    Pages are selected using keyset pagination: after_id or before_id
+    give the job following the previous page or preceding the next
+    page.  Alternatively page may be "last" to show the final page.
+    """
+
     # Generate query objects based on the parameters.
     (query, job_query) = job_search(**kwargs)
 
     # Identify number of jobs.
     count = db.find_jobs(count=True, **job_query)
-    (number, page, pagination) = calculate_pagination(
-        count, 24, page, 'job_list', query)
+    number = number_per_page(24, query)
+    del job_query['number']
+
+    # Keyset pagination requires the jobs to be sorted by identifier
+    # on every page, including the first and last.
+    job_query['sort'] = True
+
+    if page == 'last':
+        # Fetch the final page by searching backwards from the end.
+        rows = db.find_jobs(outputs='%_64.png', number=number,
+                            sortdir='DESC', **job_query)
+        rows.reverse()
+        has_prev = count > number
+        has_next = False
+
+    elif before_id is not None:
+        # Fetch one extra job to determine whether there is a
+        # previous page.
+        rows = db.find_jobs(outputs='%_64.png', number=(number + 1),
+                            before_id=before_id, **job_query)
+        has_prev = len(rows) > number
+        rows = rows[-number:]
+        has_next = True
+
+    else:
+        # Fetch one extra job to determine whether there is a next page.
+        rows = db.find_jobs(outputs='%_64.png', number=(number + 1),
+                            after_id=after_id, **job_query)
+        has_next = len(rows) > number
+        rows = rows[:number]
+        has_prev = after_id is not None
 
-    # If no number in kwargs, add in default.
-    if 'number' not in job_query:
-        job_query['number'] = number
+    pagination = Pagination(
+        url_for('job_list', **query) if has_prev else None,
+        url_for('job_list', before_id=rows[0].id, **query)
+        if (has_prev and rows) else None,
+        url_for('job_list', after_id=rows[-1].id, **query)
+        if (has_next and rows) else None,
+        url_for('job_list', page='last', **query) if has_next else None,
+        None,
+        count)
 
     jobs = []
 
-    for job in db.find_jobs(outputs='%_64.png',
-                            offset=(number * page),
-                            **job_query):
+    for job in rows:
         if job.outputs:
             preview = url_for('job_preview', job_id=job.id,
                               preview=job.outputs[0])
@@ -58,11 +58,11 @@ def prepare_job_qa_info(db, job_id, query):
         parent_obs = OrderedDict()
         pjobs = list(parents.keys())
         pjobs.sort()
-        for i in pjobs:
-            obsinfo = db.get_obs_info(i)
+        pjob_info = db.get_jobs_many(pjobs)
+        for (i, obsinfo) in db.get_obs_info_many(pjobs).items():
             if obsinfo != []:
-                obsinfo = [o._asdict() for o in db.get_obs_info(i)]
-                qa_state = db.get_job(i).qa_state
+                obsinfo = [o._asdict() for o in obsinfo]
+                qa_state = pjob_info[i].qa_state
                 for o in obsinfo:
                     o['qa_state'] = qa_state
 
@@ -18,6 +18,7 @@ from __future__ import absolute_import, division
 from collections import OrderedDict
 
 import datetime
+import functools
 import numpy as np
 import matplotlib
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
@@ -30,7 +31,8 @@ import time
 
 from flask import send_file
 
-from jsa_proc.db.db import Range
+from jsa_proc.db.db import Not, Range
+from jsa_proc.db.fanout import fan_out
 from jsa_proc.error import NoRowsError
 from jsa_proc.jcmtobsinfo import ObsQueryDict
 from jsa_proc.state import JSAProcState
@@ -64,15 +66,25 @@ def prepare_summary_piechart(db, task=None, obsquerydict=None, date_min=None,
     if date_min is not None or date_max is not None:
         obsquery['utdate'] = Range(date_min, date_max)
 
-    # Perform the find_jobs task for the given constraints in each
-    # JSAProcState.
+    # Without observation constraints, the job counts can be taken
+    # from the summary table.
+    if not obsquery:
+        state_counts = db.get_job_counts(['state'], task=task)
+
+    # Otherwise perform the find_jobs task for the given constraints
+    # in each JSAProcState.
+    else:
+        state_counts = fan_out(db, OrderedDict(
+            (s, functools.partial(db.find_jobs, state=s, task=task,
+                                  obsquery=obsquery, count=True))
+            for s in JSAProcState.STATE_ALL
+            if s != JSAProcState.DELETED))
+
     for s in JSAProcState.STATE_ALL:
 
         # Don't include deleted jobs in pie chart
         if JSAProcState.get_name(s) != 'Deleted':
-            job_summary_dict[s] = db.find_jobs(state=s, task=task,
-                                               obsquery=obsquery,
-                                               count=True)
+            job_summary_dict[s] = state_counts.get(s, 0)
 
     # Get numbers, names and colors for the pie chart.
     values = job_summary_dict.values()
@@ -183,56 +195,90 @@ def prepare_task_qa_summary(db, task=None, date_min=None, date_max=None,
                                 [qa_reduced_state, qa_error_state,
                                  qa_deleted_state, qa_raw_state]))
     if byDate is True:
+        # Prepare the (independent) count queries for each task and day.
+        queries = OrderedDict()
 
-        # Go through each task
         for t in tasks:
-            results[t] = OrderedDict()
-
-            # Within each task go through each day
             for d in daylist:
+                dayquery = {'utdate': Range(d, d)}
 
-                # Create the Range object
-                obsquery['utdate'] = Range(d, d)
-
-                # Find the total number of jobs for that date, and put it in
-                # the dayresults dictionary.
-                dayresults = OrderedDict(
-                    total=db.find_jobs(task=t, count=True, obsquery=obsquery))
+                # Total number of jobs for that date.
+                queries[(t, d, 'total')] = functools.partial(
+                    db.find_jobs, task=t, count=True, obsquery=dayquery)
 
-                # Go through each Reduced and Error states.
+                # Go through each Reduced and Error states, and each
+                # qa state.
                 for name, state_options in zip(['Reduced', 'Error'],
                                                [qa_reduced_state,
                                                 qa_error_state]):
+                    for q in JSAQAState.STATE_ALL:
+                        queries[(t, d, name, q)] = functools.partial(
+                            db.find_jobs, task=t, qa_state=q,
+                            state=state_options, count=True,
+                            obsquery=dayquery)
+
+                # Totals for Raw and Deleted jobs.
+                queries[(t, d, 'Deleted')] = functools.partial(
+                    db.find_jobs, task=t, state=JSAProcState.DELETED,
+                    count=True, obsquery=dayquery)
+                queries[(t, d, 'Raw')] = functools.partial(
+                    db.find_jobs, task=t, state=qa_raw_state,
+                    count=True, obsquery=dayquery)
+
+        counts = fan_out(db, queries)
+
+        # Go through each task
+        for t in tasks:
+            results[t] = OrderedDict()
+
+            # Within each task go through each day
+            for d in daylist:
+                dayresults = OrderedDict(total=counts[(t, d, 'total')])
+
+                for name in ['Reduced', 'Error']:
                     dayresults[name] = OrderedDict()
-                    # Go through each  qa state
                     for q in JSAQAState.STATE_ALL:
-                        dayresults[name][q] = db.find_jobs(task=t, qa_state=q,
-                                                           state=state_options,
-                                                           count=True,
-                                                           obsquery=obsquery)
+                        dayresults[name][q] = counts[(t, d, name, q)]
 
                     dayresults[name]['total'] = sum(dayresults[name].values())
 
-                # Add on the totals for Raw and Deleted jobs to the dayresults
-                dayresults['Deleted'] = {
-                    'total': db.find_jobs(task=t, state=JSAProcState.DELETED,
-                                          count=True, obsquery=obsquery)}
-                dayresults['Raw'] = {
-                    'total': db.find_jobs(task=t, state=qa_raw_state,
-                                          count=True, obsquery=obsquery)}
+                dayresults['Deleted'] = {'total': counts[(t, d, 'Deleted')]}
+                dayresults['Raw'] = {'total': counts[(t, d, 'Raw')]}
 
                 # Update the results object
                 results[t][d] = dayresults
 
+    # If not separating by date, and without a date range, the job counts
+    # can be taken from the summary table.
+    elif not obsquery:
+        qa_counts = db.get_job_counts(
+            ['task', 'qa_state'], task=tasks,
+            state=Not([JSAProcState.DELETED]))
+
+        for t in tasks:
+            results[t] = {'total': 0}
+            for q in JSAQAState.STATE_ALL:
+                results[t][q] = qa_counts.get((t, q), 0)
+                results[t]['total'] += results[t][q]
+
     # If not separating by date
     else:
+        queries = OrderedDict()
+        for t in tasks:
+            queries[(t, 'total')] = functools.partial(
+                db.find_jobs, task=t, count=True, obsquery=obsquery)
+            for q in JSAQAState.STATE_ALL:
+                queries[(t, q)] = functools.partial(
+                    db.find_jobs, task=t, qa_state=q, count=True,
+                    obsquery=obsquery)
+
+        counts = fan_out(db, queries)
+
         for t in tasks:
             # Results dict for each task
-            results[t] = {
-                'total': db.find_jobs(task=t, count=True, obsquery=obsquery)}
+            results[t] = {'total': counts[(t, 'total')]}
             for q in JSAQAState.STATE_ALL:
-                results[t][q] = db.find_jobs(task=t, qa_state=q, count=True,
-                                             obsquery=obsquery)
+                results[t][q] = counts[(t, q)]
 
     return {'results': results, 'qa_states': JSAQAState.STATE_ALL,
             'daylist': daylist, 'statedict': statedict,
@@ -259,13 +305,23 @@ def prepare_job_summary(db, task=None, date_min=None, date_max=None):
     if date_min is not None or date_max is not None:
         obsquery['utdate'] = Range(date_min, date_max)
 
+    # Without a date range, the job counts can be taken from the summary
+    # table.
+    if not obsquery:
+        state_counts = db.get_job_counts(['state', 'location'], task=task)
+
+    else:
+        state_counts = fan_out(db, OrderedDict(
+            ((s, l), functools.partial(db.find_jobs, location=l, state=s,
+                                       count=True, task=task,
+                                       obsquery=obsquery))
+            for s in states for l in locations))
+
     job_summary_dict = OrderedDict()
     for s in states:
         job_summary_dict[s] = OrderedDict()
         for l in locations:
-            job_summary_dict[s][l] = db.find_jobs(location=l, state=s,
-                                                  count=True, task=task,
-                                                  obsquery=obsquery)
+            job_summary_dict[s][l] = state_counts.get((s, l), 0)
 
     total_count = sum([int(c) for j in job_summary_dict.values()
                        for c in j.values()])
@@ -279,15 +335,14 @@ def prepare_job_summary(db, task=None, date_min=None, date_max=None):
 
     # Get processing time taken for All jobs, pointings only, cals only,
     # and science only observations for this task.
-    jobs, durations, obsinfos = db.get_processing_time_obs_type(
+    processing_times = db.get_processing_time_obs_type(
         jobdict={'task': task})
 
     # Check if any jobs were found
-    if len(jobs) > 0:
-        durations = np.array(durations)
-        obsinfos = np.array(obsinfos)
-        obstypes = obsinfos[:, 0]
-        obsprojects = obsinfos[:, 2]
+    if len(processing_times['job_id']) > 0:
+        durations = np.array(processing_times['duration'])
+        obstypes = np.array(processing_times['obstype'])
+        obsprojects = np.array(processing_times['project'])
 
         pointings_mask = obstypes == 'pointing'
         cals_mask = (obstypes == 'science') & (
@@ -15,7 +15,6 @@
 
 from __future__ import absolute_import, division
 
-import math
 from collections import namedtuple
 
 import flask
@@ -108,74 +107,17 @@ def _make_response(template, result):
     return resp
 
 
-def calculate_pagination(count, default_number,
-                         page_number, page_name, url_args):
-    """Process pagination options and create pagination links.
+def number_per_page(default_number, url_args):
+    """Determine the number of items to show per page.
 
-    Arguments:
-        count: total number of observations
-        default_number: default number of items per page
-        page_number: requested page number
-                     (sanitized -- can be an HTTP parameter)
-        page_name: name of page to link to (used with url_for)
-        url_args: additional arguments to pass to url_for
-
-    Returns a tuple:
-        number_per_page: sanitized number of items per page
-        page_number: sanitized page number
-        pagination: named tuple with first, prev, next and last elements
+    Check if number is given within the url_args, if not then
+    set it to the default number.
     """
 
-    # Check if number is given within the url_args, if not then
-    # set it to the default number.
     if ('number' not in url_args or
             url_args['number'] is None or
             url_args['number'] == 0):
-        number_per_page = default_number
         url_args['number'] = default_number
-    else:
-        number_per_page = int(url_args['number'])
-
-    # Sanitize input of page_number.
-    if (page_number == '') or (page_number is None):
-        page_number = 0
-    else:
-        page_number = int(page_number)
-
-    # Determine the maximum page number (zero-indexed).
-    if count == 0:
-        page_max = 0
-    else:
-        page_max = int(math.ceil(count / number_per_page)) - 1
-
-    # Ensure the current page number is within range.
-    if page_number < 0:
-        page_number = 0
-    elif page_number > page_max:
-        page_number = page_max
-
-    # Create links for pagination.  Prefer to issue "prev" and "next"
-    # rather than "first" and "last".
-    pagination = Pagination(
-        url_for('job_list', page=0,
-                **url_args)
-        if page_number > 1 else None,
-
-        url_for('job_list', page=(page_number - 1),
-                **url_args)
-        if page_number > 0 else None,
-
-        url_for('job_list', page=(page_number + 1),
-                **url_args)
-        if page_number < page_max else None,
-
-        url_for('job_list', page=page_max,
-                **url_args)
-        if page_number < (page_max - 1) else None,
-
-        None,
-
-        count
-    )
-
-    return (number_per_page, page_number, pagination)
+        return default_number
+
+    return int(url_args['number'])
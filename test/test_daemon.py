@@ -0,0 +1,64 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from threading import Thread
+import time
+
+from jsa_proc.admin.daemon import JSAProcDaemon
+from jsa_proc.error import JSAProcError
+from jsa_proc.state import JSAProcState
+
+from .db import DBTestCase
+
+
+class DaemonTestCase(DBTestCase):
+    def test_daemon_poll(self):
+        job_id = self.db.add_job(
+            'tag1', 'JAC', 'obs', 'RECIPE_NAME', 'test',
+            input_file_names=['s8a20130401_00001_0001'])
+
+        daemon = JSAProcDaemon(
+            self.db, stages=['poll'],
+            min_interval=0.01, max_interval=0.05)
+
+        thread = Thread(target=daemon.run)
+        thread.start()
+
+        try:
+            # The job should be validated by the initial full poll, and
+            # then moved on from QUEUED when the resulting event is seen.
+            for i in range(100):
+                if self.db.get_job(job_id).state not in (
+                        JSAProcState.UNKNOWN, JSAProcState.QUEUED):
+                    break
+                time.sleep(0.01)
+
+        finally:
+            daemon.stop()
+            thread.join(5.0)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(self.db.get_job(job_id).state, JSAProcState.MISSING)
+
+    def test_daemon_config(self):
+        with self.assertRaises(JSAProcError):
+            JSAProcDaemon(self.db, stages=['poll', 'unknown'])
+
+        with self.assertRaises(JSAProcError):
+            JSAProcDaemon(self.db, workers={'transfer': 2})
+
+        daemon = JSAProcDaemon(self.db, stages=['run', 'poll'],
+                               workers={'run': 4})
+        self.assertEqual(daemon.stages, ['poll', 'run'])
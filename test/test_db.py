@@ -15,12 +15,16 @@
 
 from collections import OrderedDict
 from datetime import date, datetime
+import os
 from socket import gethostname
 from unittest import TestCase
 
+from jsa_proc.action.lease import JSAProcLease
+import jsa_proc.db.db
 from jsa_proc.db.db import _dict_query_where_clause, Not, Fuzzy, Range, \
-        JSAProcFileInfo, JSAProcTaskInfo
-from jsa_proc.error import JSAProcError, NoRowsError, ExcessRowsError
+        JSAProcFileInfo, JSAProcTaskInfo, _chunks
+from jsa_proc.error import JSAProcError, NoRowsError, ExcessRowsError, \
+    LeaseLostError
 from jsa_proc.jcmtobsinfo import ObsQueryDict
 from jsa_proc.state import JSAProcState
 from jsa_proc.qa_state import JSAQAState
@@ -43,7 +47,8 @@ class BasicDBTest(DBTestCase):
 
         self.assertEqual(tables, set((
             'job', 'input_file', 'output_file', 'log', 'note',
-            'tile', 'qa', 'task', 'parent', 'obsidss',
+            'tile', 'qa', 'task', 'parent', 'obsidss', 'job_count',
+            'job_obs', 'log_archive', 'job_lease', 'schema_version',
         )))
 
 
@@ -255,6 +260,70 @@ class InterfaceDBTest(DBTestCase):
         with self.assertRaises(JSAProcError):
             self.db.change_state(job_id, '!', 'test bad state')
 
+    def test_change_states(self):
+        job_ids = self.db.add_jobs([
+            {'tag': 'tag{0}'.format(i), 'location': 'JAC', 'mode': 'obs',
+             'parameters': 'REC', 'task': 'test',
+             'input_file_names': ['test1']}
+            for i in range(5)])
+
+        self.db.change_state(job_ids[4], JSAProcState.QUEUED, 'Queue')
+        self.db.add_qa_entry(job_ids[0], JSAQAState.GOOD, 'Good', 'user')
+
+        # Jobs which don't exist or aren't in state_prev should be returned.
+        unmatched = self.db.change_states(
+            job_ids + [job_ids[-1] + 1], JSAProcState.QUEUED, 'Bulk queue',
+            state_prev=JSAProcState.UNKNOWN, username='testuser')
+        self.assertEqual(unmatched, [job_ids[4], job_ids[-1] + 1])
+
+        for job_id in job_ids:
+            job = self.db.get_job(id_=job_id)
+            self.assertEqual(job.state, JSAProcState.QUEUED)
+
+            # The QA state should have been reset.
+            self.assertEqual(job.qa_state, JSAQAState.UNKNOWN)
+
+        for job_id in job_ids[:4]:
+            self.assertEqual(self.db.get_job(id_=job_id).state_prev,
+                             JSAProcState.UNKNOWN)
+            last_log = self.db.get_last_log(job_id)
+            self.assertEqual(
+                [last_log.state_prev, last_log.state_new, last_log.message,
+                 last_log.username],
+                [JSAProcState.UNKNOWN, JSAProcState.QUEUED, 'Bulk queue',
+                 'testuser'])
+
+        self.assertEqual(self.db.get_last_qa(job_ids[0]).status,
+                         JSAQAState.UNKNOWN)
+        self.assertEqual(len(self.db.get_qas(job_ids[1])), 0)
+
+        self.assertEqual(
+            self.db.get_job_counts(['state']),
+            {JSAProcState.QUEUED: 5})
+
+        # Without state_prev, only missing jobs should be unmatched.
+        self.assertEqual(
+            self.db.change_states(job_ids + [job_ids[-1] + 1],
+                                  JSAProcState.ERROR, 'Bulk error'),
+            [job_ids[-1] + 1])
+        self.assertEqual(
+            self.db.get_job_counts(['state']),
+            {JSAProcState.ERROR: 5})
+
+        with self.assertRaises(JSAProcError):
+            self.db.change_states(job_ids, '!', 'test bad state')
+
+        # Check bulk QA changes.
+        self.assertEqual(
+            self.db.add_qa_entries(job_ids[:2] + [job_ids[-1] + 1],
+                                   JSAQAState.BAD, 'Bad', 'user'),
+            [job_ids[-1] + 1])
+        self.assertEqual(self.db.get_last_qa(job_ids[1]).status,
+                         JSAQAState.BAD)
+        self.assertEqual(
+            self.db.get_job_counts(['qa_state']),
+            {JSAQAState.BAD: 2, JSAQAState.UNKNOWN: 3})
+
     def test_set_location_foreign_id(self):
         """
         Test setting a location and foreign id.
@@ -525,6 +594,481 @@ class InterfaceDBTest(DBTestCase):
         # test the count option
         self.assertEqual(self.db.find_jobs(count=True), 8)
 
+    def test_iter_jobs(self):
+        job_ids = self.db.add_jobs([
+            dict(tag='tag{0}'.format(i), location=('JAC' if i % 3 else 'CADC'),
+                 mode='obs', parameters='RECIPE', task='test',
+                 input_file_names=['test1'])
+            for i in range(10)])
+
+        jac_jobs = [x for (i, x) in enumerate(job_ids) if i % 3]
+
+        # Results should be the same as find_jobs, for any batch size.
+        for batch_size in (1, 2, 3, 6, 7, 100):
+            jobs = list(self.db.iter_jobs(location='JAC',
+                                          batch_size=batch_size))
+            self.assertEqual([x.id for x in jobs], jac_jobs)
+            self.assertEqual(jobs, self.db.find_jobs(location='JAC',
+                                                     sort=True))
+
+        # Changing the state of each job should not affect the iteration.
+        for job in self.db.iter_jobs(state=JSAProcState.UNKNOWN,
+                                     batch_size=2):
+            self.db.change_state(job.id, JSAProcState.QUEUED, 'Test')
+
+        self.assertEqual(
+            [x.id for x in self.db.iter_jobs(state=JSAProcState.QUEUED)],
+            job_ids)
+
+        self.assertEqual(
+            list(self.db.iter_jobs(state=JSAProcState.UNKNOWN)), [])
+
+        self.assertEqual(
+            [x.id for x in self.db.find_jobs(after_id=job_ids[7])],
+            job_ids[8:])
+
+    def test_find_jobs_keyset(self):
+        priorities = [3, 1, 3, 2, 1, 3, 2]
+        job_ids = self.db.add_jobs([
+            dict(tag='tag{0}'.format(i), location='JAC', mode='obs',
+                 parameters='RECIPE', task='test', priority=priority,
+                 input_file_names=['test1'])
+            for (i, priority) in enumerate(priorities)])
+
+        for (prioritize, sortdir) in ((False, 'ASC'), (False, 'DESC'),
+                                      (True, 'ASC'), (True, 'DESC')):
+            ordered = [x.id for x in self.db.find_jobs(
+                prioritize=prioritize, sort=True, sortdir=sortdir)]
+
+            # Pages retrieved by seeking should match those found using an
+            # offset, in either direction.
+            for i in range(len(ordered)):
+                self.assertEqual(
+                    [x.id for x in self.db.find_jobs(
+                        prioritize=prioritize, sortdir=sortdir,
+                        after_id=ordered[i], number=2)],
+                    ordered[i + 1:i + 3])
+
+                self.assertEqual(
+                    [x.id for x in self.db.find_jobs(
+                        prioritize=prioritize, sortdir=sortdir,
+                        before_id=ordered[i], number=2)],
+                    ordered[max(0, i - 2):i])
+
+                self.assertEqual(
+                    self.db.job_prev_next(
+                        ordered[i], prioritize=prioritize, sort=True,
+                        sortdir=sortdir),
+                    (ordered[i - 1] if i > 0 else None,
+                     ordered[i + 1] if i < len(ordered) - 1 else None))
+
+        # Search terms should also be respected.
+        self.db.change_state(job_ids[3], JSAProcState.QUEUED, 'Queued')
+        self.assertEqual(
+            self.db.job_prev_next(job_ids[3], state=JSAProcState.UNKNOWN),
+            (job_ids[2], job_ids[4]))
+        self.assertEqual(
+            self.db.find_jobs(after_id=job_ids[1], state=JSAProcState.UNKNOWN,
+                              count=True),
+            4)
+
+        with self.assertRaises(JSAProcError):
+            self.db.find_jobs(after_id=job_ids[1], before_id=job_ids[3])
+
+    def test_claim_jobs(self):
+        job1 = self.db.add_job('tag1', 'JAC', 'obs', 'RECIPE', 'test',
+                               input_file_names=['test1'], priority=1,
+                               state=JSAProcState.WAITING)
+        job2 = self.db.add_job('tag2', 'JAC', 'obs', 'RECIPE', 'test',
+                               input_file_names=['test1'], priority=5,
+                               state=JSAProcState.WAITING)
+        job3 = self.db.add_job('tag3', 'JAC', 'obs', 'RECIPE', 'test2',
+                               input_file_names=['test1'], priority=3,
+                               state=JSAProcState.WAITING)
+        job4 = self.db.add_job('tag4', 'CADC', 'obs', 'RECIPE', 'test',
+                               input_file_names=['test1'], priority=9,
+                               state=JSAProcState.WAITING)
+        job5 = self.db.add_job('tag5', 'JAC', 'obs', 'RECIPE', 'test',
+                               input_file_names=['test1'], priority=1,
+                               state=JSAProcState.WAITING)
+
+        # Jobs should be claimed in priority order, and by location.
+        self.assertEqual(
+            self.db.claim_jobs(JSAProcState.WAITING, JSAProcState.RUNNING,
+                               'Running', location='JAC', limit=2,
+                               worker='w1'),
+            [job2, job3])
+
+        for job_id in (job2, job3):
+            self.assertEqual(self.db.get_job(id_=job_id).state,
+                             JSAProcState.RUNNING)
+            log = self.db.get_last_log(job_id)
+            self.assertEqual(log.state_prev, JSAProcState.WAITING)
+            self.assertEqual(log.state_new, JSAProcState.RUNNING)
+            self.assertEqual(log.message, 'Running (worker w1)')
+
+        # Claimed jobs are not claimed again, and the task is respected.
+        self.assertEqual(
+            self.db.claim_jobs(JSAProcState.WAITING, JSAProcState.RUNNING,
+                               'Running', location='JAC', task='test2'),
+            [])
+
+        self.assertEqual(
+            self.db.claim_jobs(JSAProcState.WAITING, JSAProcState.RUNNING,
+                               'Running', location='JAC', limit=5),
+            [job1, job5])
+
+        self.assertEqual(self.db.get_job(id_=job4).state,
+                         JSAProcState.WAITING)
+
+        with self.assertRaises(JSAProcError):
+            self.db.claim_jobs([JSAProcState.WAITING, JSAProcState.QUEUED],
+                               JSAProcState.RUNNING, 'Running')
+
+    def test_leases(self):
+        job1 = self.db.add_job('tag1', 'JAC', 'obs', 'RECIPE', 'test',
+                               input_file_names=['test1'],
+                               state=JSAProcState.WAITING)
+        job2 = self.db.add_job('tag2', 'JAC', 'obs', 'RECIPE', 'test',
+                               input_file_names=['test2'],
+                               state=JSAProcState.MISSING)
+        job3 = self.db.add_job('tag3', 'JAC', 'obs', 'RECIPE', 'test',
+                               input_file_names=['test3'],
+                               state=JSAProcState.WAITING)
+
+        self.db.claim_jobs(JSAProcState.WAITING, JSAProcState.RUNNING,
+                           'Running', limit=2)
+        self.assertEqual(self.db.get_leases(), [])
+
+        # Claiming a job can also record a lease on it.
+        self.assertEqual(
+            self.db.claim_jobs(JSAProcState.MISSING, JSAProcState.FETCHING,
+                               'Fetching', lease=True),
+            [job2])
+
+        lease = self.db.get_leases()[0]
+        self.assertEqual(lease.job_id, job2)
+        self.assertEqual(lease.state, JSAProcState.FETCHING)
+        self.assertEqual(lease.state_return, JSAProcState.MISSING)
+        self.assertEqual(lease.host, gethostname().partition('.')[0])
+        self.assertEqual(lease.pid, os.getpid())
+
+        with JSAProcLease(self.db, job1, JSAProcState.RUNNING, interval=60):
+            self.db.add_lease(job3, JSAProcState.RUNNING,
+                              JSAProcState.WAITING)
+
+            self.assertEqual(
+                [(x.job_id, x.state, x.state_return)
+                 for x in self.db.get_leases()],
+                [(job1, JSAProcState.RUNNING, JSAProcState.WAITING),
+                 (job2, JSAProcState.FETCHING, JSAProcState.MISSING),
+                 (job3, JSAProcState.RUNNING, JSAProcState.WAITING)])
+
+            # Fresh leases are not reaped.
+            self.assertEqual(self.db.get_leases(expired=60), [])
+            self.assertEqual(self.db.reap_leases(60), [])
+
+            # Stop the heartbeat for jobs 2 and 3.  Job 3 has since
+            # finished, so should not be reset.
+            with self.db.db as c:
+                c.execute('UPDATE job_lease SET heartbeat = %s '
+                          'WHERE job_id <> %s',
+                          ('2020-01-01 00:00:00', job1))
+
+            self.db.change_state(job3, JSAProcState.PROCESSED, 'Done')
+
+            self.assertEqual(
+                [x.job_id for x in self.db.get_leases(expired=60)],
+                [job2, job3])
+            self.assertEqual(self.db.reap_leases(60), [job2])
+
+            self.assertEqual([x.job_id for x in self.db.get_leases()],
+                             [job1])
+            self.assertTrue(self.db.renew_lease(job1))
+            self.assertFalse(self.db.renew_lease(job2))
+
+        self.assertEqual(self.db.get_leases(), [])
+
+        self.assertEqual(self.db.get_job(id_=job1).state,
+                         JSAProcState.RUNNING)
+        self.assertEqual(self.db.get_job(id_=job3).state,
+                         JSAProcState.PROCESSED)
+
+        log = self.db.get_last_log(job2)
+        self.assertEqual(log.state_prev, JSAProcState.FETCHING)
+        self.assertEqual(log.state_new, JSAProcState.MISSING)
+        self.assertTrue(log.message.startswith('Lease expired'))
+
+    def test_lease_release(self):
+        job1 = self.db.add_job('tag1', 'JAC', 'obs', 'RECIPE', 'test',
+                               input_file_names=['test1'],
+                               state=JSAProcState.WAITING)
+        job2 = self.db.add_job('tag2', 'JAC', 'obs', 'RECIPE', 'test',
+                               input_file_names=['test2'],
+                               state=JSAProcState.WAITING)
+
+        self.assertEqual(
+            self.db.claim_jobs(JSAProcState.WAITING, JSAProcState.RUNNING,
+                               'Running', limit=2, lease=True),
+            [job1, job2])
+
+        # Changing state through the lease releases it.
+        with JSAProcLease(self.db, job1, JSAProcState.RUNNING, interval=60,
+                          claimed=True) as lease:
+            lease.change_state(JSAProcState.PROCESSED, 'Done')
+
+        self.assertFalse(lease.lost)
+        self.assertEqual(self.db.get_job(id_=job1).state,
+                         JSAProcState.PROCESSED)
+        self.assertEqual(self.db.get_last_log(job1).state_prev,
+                         JSAProcState.RUNNING)
+        self.assertEqual([x.job_id for x in self.db.get_leases()], [job2])
+
+        # A job reclaimed while its lease had expired is not changed.
+        with JSAProcLease(self.db, job2, JSAProcState.RUNNING, interval=60,
+                          claimed=True) as lease:
+            with self.db.db as c:
+                c.execute('UPDATE job_lease SET heartbeat = %s',
+                          ('2020-01-01 00:00:00',))
+
+            self.assertEqual(self.db.reap_leases(60), [job2])
+            self.assertEqual(
+                self.db.claim_jobs(JSAProcState.WAITING, JSAProcState.RUNNING,
+                                   'Running again'),
+                [job2])
+
+            with self.assertRaises(LeaseLostError):
+                lease.change_state(JSAProcState.PROCESSED, 'Done')
+
+            self.assertTrue(lease.lost)
+
+        self.assertEqual(self.db.get_job(id_=job2).state,
+                         JSAProcState.RUNNING)
+
+        # Errors after the lease has been lost are logged, not raised.
+        with JSAProcLease(self.db, job2, JSAProcState.RUNNING,
+                          interval=60) as lease:
+            with self.db.db as c:
+                c.execute('DELETE FROM job_lease')
+
+            raise JSAProcError('Job failed')
+
+        self.assertTrue(lease.lost)
+
+        # Other errors are raised as normal.
+        with self.assertRaises(JSAProcError):
+            with JSAProcLease(self.db, job2, JSAProcState.RUNNING,
+                              interval=60) as lease:
+                raise JSAProcError('Job failed')
+
+        self.assertFalse(lease.lost)
+        self.assertEqual(self.db.get_leases(), [])
+
+    def test_add_jobs(self):
+        parent = self.db.add_job('tag0', 'JAC', 'obs', 'RECIPE', 'test',
+                                 input_file_names=['test0'])
+
+        job_ids = self.db.add_jobs([
+            dict(tag='tag1', location='JAC', mode='obs',
+                 parameters='RECIPE', task='test',
+                 input_file_names=['test1', 'test2'], priority=3,
+                 tilelist=[1, 2], obsidss=['1-1', '1-2']),
+            dict(tag='tag2', location='CADC', mode='night',
+                 parameters='RECIPE', task='test2',
+                 parent_jobs=[parent], filters='^x',
+                 state=JSAProcState.QUEUED),
+        ])
+
+        self.assertEqual(len(job_ids), 2)
+        self.assertNotIn(parent, job_ids)
+
+        job = self.db.get_job(tag='tag1')
+        self.assertEqual(job.id, job_ids[0])
+        self.assertEqual(job.priority, 3)
+        self.assertEqual(job.state, JSAProcState.UNKNOWN)
+        self.assertEqual(sorted(self.db.get_input_files(job.id)),
+                         ['test1', 'test2'])
+        self.assertEqual(sorted(self.db.get_tilelist(job_id=job.id)), [1, 2])
+        self.assertEqual(sorted(set(x.obsidss for x in
+                                    self.db.get_obs_info(job.id))),
+                         ['1-1', '1-2'])
+
+        job = self.db.get_job(tag='tag2')
+        self.assertEqual(job.id, job_ids[1])
+        self.assertEqual(job.location, 'CADC')
+        self.assertEqual(job.state, JSAProcState.QUEUED)
+        self.assertEqual(self.db.get_parents(job.id), [(parent, '^x')])
+
+        for job_id in job_ids:
+            logs = self.db.get_logs(job_id)
+            self.assertEqual(len(logs), 1)
+            self.assertEqual(logs[0].message, 'Job added to the database')
+
+        # Duplicate tags, either in the database or in the batch,
+        # should prevent any of the jobs being added.
+        with self.assertRaises(JSAProcError):
+            self.db.add_jobs([
+                dict(tag='tag3', location='JAC', mode='obs',
+                     parameters='RECIPE', task='test',
+                     input_file_names=['test1']),
+                dict(tag='tag1', location='JAC', mode='obs',
+                     parameters='RECIPE', task='test',
+                     input_file_names=['test1']),
+            ])
+
+        with self.assertRaises(JSAProcError):
+            self.db.add_jobs([
+                dict(tag='tag3', location='JAC', mode='obs',
+                     parameters='RECIPE', task='test',
+                     input_file_names=['test1']),
+                dict(tag='tag3', location='JAC', mode='obs',
+                     parameters='RECIPE', task='test',
+                     input_file_names=['test1']),
+            ])
+
+        with self.assertRaises(NoRowsError):
+            self.db.get_job(tag='tag3')
+
+        self.assertEqual(self.db.add_jobs([]), [])
+
+    def test_job_counts(self):
+        def count_directly():
+            with self.db.db as c:
+                c.execute('SELECT task, location, state, qa_state, COUNT(*) '
+                          'FROM job GROUP BY task, location, state, qa_state')
+                return dict((tuple(row[:4]), row[4]) for row in c.fetchall())
+
+        def count_summary():
+            return dict(self.db.get_job_counts(
+                ('task', 'location', 'state', 'qa_state')))
+
+        job_ids = self.db.add_jobs([
+            dict(tag='tag{0}'.format(i), location='JAC', mode='obs',
+                 parameters='RECIPE', task=('test' if i % 2 else 'test2'),
+                 input_file_names=['test1'])
+            for i in range(6)])
+        job_ids.append(self.db.add_job(
+            'tag6', 'CADC', 'obs', 'RECIPE', 'test',
+            input_file_names=['test1'], state=JSAProcState.QUEUED))
+
+        self.assertEqual(count_summary(), count_directly())
+
+        # Apply each type of change and check the counts are maintained.
+        self.db.change_state(job_ids[0], JSAProcState.PROCESSED, 'Test')
+        self.db.change_state(job_ids[1], JSAProcState.PROCESSED, 'Test')
+        self.assertEqual(count_summary(), count_directly())
+
+        self.db.add_qa_entry(job_ids[0], JSAQAState.GOOD, 'Good', 'user')
+        self.db.add_qa_entry(job_ids[1], JSAQAState.BAD, 'Bad', 'user')
+        self.assertEqual(count_summary(), count_directly())
+
+        # Moving to a pre-QA state resets the QA state.
+        self.db.change_state(job_ids[1], JSAProcState.QUEUED, 'Reprocess')
+        self.assertEqual(count_summary(), count_directly())
+
+        self.db.set_location(job_ids[2], 'CADC')
+        self.db.change_task(job_ids[3], 'test', 'test3')
+        self.assertEqual(count_summary(), count_directly())
+
+        self.db.claim_jobs(JSAProcState.UNKNOWN, JSAProcState.QUEUED,
+                           'Claimed', limit=2)
+        self.assertEqual(count_summary(), count_directly())
+
+        # Check the grouping and filtering options.
+        self.assertEqual(
+            self.db.get_job_counts(['state'], task='test'),
+            OrderedDict([(JSAProcState.UNKNOWN, 1),
+                         (JSAProcState.QUEUED, 2)]))
+
+        self.assertEqual(
+            dict(self.db.get_job_counts(['location'])),
+            {'JAC': 5, 'CADC': 2})
+
+        self.assertEqual(
+            self.db.get_job_summary(),
+            {'test': {JSAProcState.UNKNOWN: 1, JSAProcState.QUEUED: 2},
+             'test2': {JSAProcState.UNKNOWN: 1, JSAProcState.QUEUED: 1,
+                       JSAProcState.PROCESSED: 1},
+             'test3': {JSAProcState.QUEUED: 1}})
+
+        with self.assertRaises(JSAProcError):
+            self.db.get_job_counts(['tag'])
+
+        # Check that inconsistent counts can be repaired.
+        with self.db.db as c:
+            c.execute('UPDATE job_count SET number = 99')
+        self.assertNotEqual(count_summary(), count_directly())
+        self.db.rebuild_job_counts()
+        self.assertEqual(count_summary(), count_directly())
+
+    def test_get_many(self):
+        job1 = self.db.add_job('tag1', 'JAC', 'obs', 'RECIPE', 'test',
+                               input_file_names=['test1', 'test2'],
+                               obsidss=['1-1'])
+        job2 = self.db.add_job('tag2', 'JAC', 'obs', 'RECIPE', 'test',
+                               input_file_names=['test3'],
+                               obsidss=['2-3'])
+        job3 = self.db.add_job('tag3', 'JAC', 'night', 'RECIPE', 'test',
+                               parent_jobs=[job1, job2],
+                               filters=['a', 'b'])
+        self.db.set_output_files(job1, [
+            JSAProcFileInfo('f1', 'md5a'), JSAProcFileInfo('f2', 'md5b')])
+        self.db.change_state(job1, JSAProcState.QUEUED, 'Queued')
+
+        missing = job3 + 1000
+        job_ids = [job1, job2, job3, missing]
+
+        # Every requested job should be present in each result.
+        files = self.db.get_input_files_many(job_ids)
+        self.assertEqual(list(files.keys()), job_ids)
+        self.assertEqual(sorted(files[job1]), ['test1', 'test2'])
+        self.assertEqual(files[job2], ['test3'])
+        self.assertEqual(files[job3], [])
+        self.assertEqual(files[missing], [])
+
+        parents = self.db.get_parents_many(job_ids)
+        self.assertEqual(sorted(parents[job3]), [(job1, 'a'), (job2, 'b')])
+        self.assertEqual(parents[job1], [])
+
+        parents = self.db.get_parents_many([job3], with_state=True)
+        self.assertEqual(sorted(parents[job3]), [
+            (job1, 'a', JSAProcState.QUEUED),
+            (job2, 'b', JSAProcState.UNKNOWN)])
+
+        outputs = self.db.get_output_files_many(job_ids)
+        self.assertEqual(sorted(outputs[job1]), ['f1', 'f2'])
+        self.assertEqual(outputs[job2], [])
+
+        outputs = self.db.get_output_files_many([job1], with_info=True)
+        self.assertEqual(sorted(outputs[job1]), [
+            JSAProcFileInfo('f1', 'md5a'), JSAProcFileInfo('f2', 'md5b')])
+
+        logs = self.db.get_logs_many(job_ids)
+        self.assertEqual(logs[job1], self.db.get_logs(job1))
+        self.assertEqual([x.state_new for x in logs[job1]],
+                         [JSAProcState.UNKNOWN, JSAProcState.QUEUED])
+        self.assertEqual(logs[missing], [])
+
+        obs = self.db.get_obs_info_many(job_ids)
+        self.assertEqual(obs[job2], self.db.get_obs_info(job2))
+        self.assertEqual(set(x.obsidss for x in obs[job1]), set(['1-1']))
+        self.assertEqual(obs[job3], [])
+
+        jobs = self.db.get_jobs_many(job_ids)
+        self.assertEqual(sorted(jobs.keys()), [job1, job2, job3])
+        self.assertEqual(jobs[job1], self.db.get_job(id_=job1))
+
+        # Long lists should be split into multiple queries.
+        self.assertEqual(list(_chunks([1, 2, 3, 4, 5], 2)),
+                         [[1, 2], [3, 4], [5]])
+
+        chunk_size = jsa_proc.db.db.chunk_size
+        try:
+            jsa_proc.db.db.chunk_size = 2
+            self.assertEqual(self.db.get_input_files_many(job_ids), files)
+        finally:
+            jsa_proc.db.db.chunk_size = chunk_size
+
     def test_parent_jobs(self):
 
         # Test it raises an error if no results.
@@ -688,6 +1232,230 @@ class InterfaceDBTest(DBTestCase):
                 len(expect))
 
 
+    def test_job_obs(self):
+        job_1 = self.db.add_job('tag1', 'JAC', 'obs', 'RECIPE', 'test',
+                                input_file_names=['test1'],
+                                obsidss=['1-1', '1-2'])
+        job_2 = self.db.add_job('tag2', 'JAC', 'obs', 'RECIPE', 'test',
+                                input_file_names=['test3'],
+                                obsidss=['2-3'])
+
+        def get_job_obs():
+            with self.db.db as c:
+                c.execute('SELECT job_id, obsid, utdate, instrument, '
+                          'project, survey, omp_status '
+                          'FROM job_obs ORDER BY job_id, obsid')
+                return c.fetchall()
+
+        self.assertEqual(get_job_obs(), [
+            (job_1, '1', 20140101, 'F', 'G01', 'GBS', 0),
+            (job_2, '2', 20140101, 'F', 'D01', 'DDS', 0),
+        ])
+
+        # Queries on job_obs columns should be answered from that table.
+        (where, param) = self.db._find_jobs_where(
+            None, None, None, None, None,
+            {'project': 'D01', 'utdate': Range(20140101, 20140101)}, None)
+        self.assertIn('job_obs', where[-1])
+        self.assertNotIn('COMMON', where[-1])
+
+        self.assertEqual(
+            [x.id for x in self.db.find_jobs(obsquery={'project': 'D01'})],
+            [job_2])
+        self.assertEqual(
+            [x.id for x in self.db.find_jobs(obsquery={'omp_status': 0})],
+            [job_1, job_2])
+
+        # Changing the observations should update the table.
+        self.db.set_obsidss(job_2, ['1-1'])
+        self.assertEqual(
+            [x.id for x in self.db.find_jobs(obsquery={'project': 'D01'})],
+            [])
+
+        # Adding observations should not duplicate existing entries.
+        self.db.set_obsidss(job_1, ['2-3'], replace_all=False)
+        self.assertEqual(get_job_obs(), [
+            (job_1, '1', 20140101, 'F', 'G01', 'GBS', 0),
+            (job_1, '2', 20140101, 'F', 'D01', 'DDS', 0),
+            (job_2, '1', 20140101, 'F', 'G01', 'GBS', 0),
+        ])
+        self.db.set_obsidss(job_1, ['1-1', '1-2'])
+
+        # Update the information for an observation.
+        self.db.update_obs_info('1-2', {'omp_status': 4})
+        self.assertEqual(get_job_obs(), [
+            (job_1, '1', 20140101, 'F', 'G01', 'GBS', 4),
+            (job_2, '1', 20140101, 'F', 'G01', 'GBS', 4),
+        ])
+
+        # The OMP status should always be read from the OMP database.
+        (where, param) = self.db._find_jobs_where(
+            None, None, None, None, None,
+            {'project': 'G01', 'omp_status': 4}, None)
+        self.assertIn('job_obs', where[-1])
+        self.assertIn('omp.ompobslog', where[-1])
+
+        self.assertEqual(
+            [x.id for x in self.db.find_jobs(obsquery={'omp_status': 4})],
+            [])
+
+        with self.db.db as c:
+            c.execute(
+                'INSERT INTO omp.ompobslog '
+                '(runnr, instrument, date, obsactive, commentdate, '
+                'commentauthor, commentstatus, obsid) '
+                'VALUES (1, "SCUBA-2", "2014-01-01 00:00:00", 1, '
+                '"2014-01-02 00:00:00", "TEST", 4, "1")')
+
+        self.assertEqual(
+            [x.id for x in self.db.find_jobs(obsquery={'omp_status': 4})],
+            [job_1, job_2])
+        self.assertEqual(
+            [x.id for x in self.db.find_jobs(
+                obsquery={'project': 'G01', 'omp_status': Not(4)})],
+            [])
+        self.assertEqual(
+            [x.id for x in self.db.find_jobs(
+                obsquery={'project': 'G01', 'omp_status': 4})],
+            [job_1, job_2])
+
+        with self.assertRaises(JSAProcError):
+            self.db.update_obs_info('1-2', {'job_id': 4})
+
+        # A refresh should restore the information from COMMON and OMP.
+        with self.db.db as c:
+            c.execute('DELETE FROM job_obs WHERE job_id = %s', (job_1,))
+
+        self.assertEqual(self.db.refresh_job_obs(task='test'), 2)
+        self.assertEqual(get_job_obs(), [
+            (job_1, '1', 20140101, 'F', 'G01', 'GBS', 4),
+            (job_2, '1', 20140101, 'F', 'G01', 'GBS', 4),
+        ])
+
+        self.assertEqual(self.db.refresh_job_obs(task='other'), 0)
+
+    def test_wait_for_events(self):
+        self.assertEqual(self.db.get_last_event_id(), 0)
+
+        job_1 = self.db.add_job('tag1', 'JAC', 'obs', 'RECIPE', 'test',
+                                input_file_names=['test1'])
+        job_2 = self.db.add_job('tag2', 'JAC', 'obs', 'RECIPE', 'test',
+                                input_file_names=['test2'])
+        self.db.change_state(job_1, JSAProcState.QUEUED, 'queue')
+
+        since_id = self.db.get_last_event_id()
+        self.assertEqual(since_id, 3)
+
+        # All events.
+        (events, next_id) = self.db.wait_for_events(0, timeout=0)
+        self.assertEqual(next_id, since_id)
+        self.assertEqual(
+            [(x.job_id, x.state_prev, x.state_new) for x in events],
+            [(job_1, JSAProcState.UNKNOWN, JSAProcState.UNKNOWN),
+             (job_2, JSAProcState.UNKNOWN, JSAProcState.UNKNOWN),
+             (job_1, JSAProcState.UNKNOWN, JSAProcState.QUEUED)])
+
+        # Limited number of events.
+        (events, next_id) = self.db.wait_for_events(0, timeout=0, limit=2)
+        self.assertEqual([x.id for x in events], [1, 2])
+        self.assertEqual(next_id, 2)
+
+        # Filter by state.
+        (events, next_id) = self.db.wait_for_events(
+            0, states=[JSAProcState.QUEUED], timeout=0)
+        self.assertEqual([x.job_id for x in events], [job_1])
+        self.assertEqual(next_id, since_id)
+
+        # Events which do not match the filter advance the cursor.
+        self.db.change_state(job_2, JSAProcState.ERROR, 'error')
+        (events, next_id) = self.db.wait_for_events(
+            since_id, states=[JSAProcState.QUEUED], timeout=0.2,
+            poll_interval=0.1)
+        self.assertEqual(events, [])
+        self.assertEqual(next_id, since_id + 1)
+
+    def test_archive_logs(self):
+        job_1 = self.db.add_job('tag1', 'JAC', 'obs', 'RECIPE', 'test',
+                                input_file_names=['test1'])
+        job_2 = self.db.add_job('tag2', 'JAC', 'obs', 'RECIPE', 'test',
+                                input_file_names=['test2'])
+        job_3 = self.db.add_job('tag3', 'JAC', 'obs', 'RECIPE', 'test',
+                                input_file_names=['test3'])
+
+        for state in (JSAProcState.QUEUED, JSAProcState.RUNNING,
+                      JSAProcState.PROCESSED, JSAProcState.COMPLETE):
+            self.db.change_state(job_1, state, 'job 1')
+
+        self.db.change_state(job_2, JSAProcState.QUEUED, 'job 2')
+
+        for (state, message) in ((JSAProcState.ERROR, 'error 1'),
+                                 (JSAProcState.QUEUED, 'retry'),
+                                 (JSAProcState.ERROR, 'error 2')):
+            self.db.change_state(job_3, state, message)
+
+        # Nothing is old enough to be archived yet.
+        self.assertEqual(self.db.archive_logs(30), 0)
+
+        with self.db.db as c:
+            c.execute('UPDATE log SET datetime = "2020-01-01 00:00:00"')
+
+        logs_1 = self.db.get_logs(job_1)
+        logs_3 = self.db.get_logs(job_3)
+        self.assertEqual(len(logs_1), 5)
+
+        self.assertEqual(self.db.archive_logs(30, task='other'), 0)
+
+        # The latest, running and processed entries for job 1 are kept,
+        # as is the latest entry for job 3.  Job 2 is not in a final state.
+        self.assertEqual(self.db.archive_logs(30), 5)
+        self.assertEqual(self.db.archive_logs(30), 0)
+
+        with self.db.db as c:
+            c.execute('SELECT job_id, state_new FROM log ORDER BY id')
+            self.assertEqual(c.fetchall(), [
+                (job_2, JSAProcState.UNKNOWN),
+                (job_1, JSAProcState.RUNNING),
+                (job_1, JSAProcState.PROCESSED),
+                (job_1, JSAProcState.COMPLETE),
+                (job_2, JSAProcState.QUEUED),
+                (job_3, JSAProcState.ERROR),
+            ])
+
+        # Reads of the full history should include archived entries.
+        self.assertEqual(self.db.get_logs(job_1), logs_1)
+        self.assertEqual(self.db.get_logs_many([job_3, job_1]),
+                         {job_1: logs_1, job_3: logs_3})
+        self.assertEqual(self.db.get_last_log(job_1), logs_1[-1])
+
+        # An entry seen in both tables (as if it were read while being
+        # archived) should only be returned once.
+        with self.db.db as c:
+            c.execute('INSERT INTO log_archive '
+                      'SELECT * FROM log WHERE id = %s', (logs_1[-1].id,))
+        self.assertEqual(self.db.get_logs(job_1), logs_1)
+        with self.db.db as c:
+            c.execute('DELETE FROM log_archive WHERE id = %s',
+                      (logs_1[-1].id,))
+
+        self.assertEqual(
+            self.db.count_state_entries(job_1, JSAProcState.QUEUED), 1)
+        self.assertEqual(
+            self.db.count_state_entries(job_3, JSAProcState.ERROR), 2)
+        self.assertEqual(
+            self.db.count_state_entries(job_2, JSAProcState.ERROR), 0)
+
+        errors = self.db.find_errors_logs()
+        self.assertEqual(list(errors.keys()), [job_3])
+        self.assertEqual([x.message for x in errors[job_3]],
+                         ['error 2', 'retry', 'error 1', logs_3[0].message])
+        self.assertEqual(
+            [x.message for x in self.db.find_errors_logs(
+                latest_only=True)[job_3]],
+            ['error 2'])
+
+        self.assertEqual(
+            self.db.get_processing_time_obs_type()['job_id'], [job_1])
+
     def test_processing_time(self):
         job_id = self.db.add_job('tag1', 'JAC', 'obs', 'RECIPE', 'test', input_file_names=['test1'])
 
@@ -695,21 +1463,27 @@ class InterfaceDBTest(DBTestCase):
         self.db.change_state(job_id, JSAProcState.PROCESSED, 'end')
 
         # Check that we find this job:
-        (ids, duration, obsinfo) = self.db.get_processing_time_obs_type()
+        result = self.db.get_processing_time_obs_type()
 
-        self.assertEqual(len(ids), 1)
-        self.assertEqual(len(duration), 1)
-        self.assertEqual(len(obsinfo), 1)
+        self.assertEqual(list(result.keys()), [
+            'job_id', 'duration', 'obstype', 'scanmode', 'project',
+            'survey', 'instrument', 'omp_status'])
+        self.assertEqual(result['job_id'], [job_id])
+        self.assertEqual(len(result['duration']), 1)
+        self.assertGreaterEqual(result['duration'][0], 0.0)
 
         # Check that it has no obsinfo but is the correct length
-        self.assertEqual([i for i in obsinfo[0]], [None]*5 + [0])
+        self.assertEqual([v[0] for v in list(result.values())[2:]],
+                         [None]*5 + [0])
 
         # Check we don't find the job if it's running or in the error state:
         self.db.change_state(job_id, JSAProcState.RUNNING, 'start again')
-        self.assertEqual(self.db.get_processing_time_obs_type()[0], [])
+        self.assertEqual(
+            self.db.get_processing_time_obs_type()['job_id'], [])
 
         self.db.change_state(job_id, JSAProcState.ERROR, 'failure')
-        self.assertEqual(self.db.get_processing_time_obs_type()[0], [])
+        self.assertEqual(
+            self.db.get_processing_time_obs_type()['job_id'], [])
 
         # Add some more jobs.
         job_2 = self.db.add_job('tag2', 'JAC', 'obs', 'RECIPE', 'test', input_file_names=['test1'])
@@ -722,13 +1496,24 @@ class InterfaceDBTest(DBTestCase):
         self.db.change_state(job_3, JSAProcState.PROCESSED, 'end')
         self.db.change_state(job_4, JSAProcState.PROCESSED, 'end')
 
-        self.assertEqual(len(self.db.get_processing_time_obs_type(
-            jobdict={'tag': 'tag3'})[0]),
-            1)
+        self.assertEqual(self.db.get_processing_time_obs_type(
+            jobdict={'tag': 'tag3'})['job_id'],
+            [job_3])
+
+        self.assertEqual(self.db.get_processing_time_obs_type(
+            jobdict={'tag': ['tag3', 'tag4']})['job_id'],
+            [job_3, job_4])
+
+        # Jobs with observations report the first observation's details
+        # and can be selected by observation.
+        self.db.set_obsidss(job_4, ['2-3'])
 
-        self.assertEqual(len(self.db.get_processing_time_obs_type(
-            jobdict={'tag': ['tag3', 'tag4']})[0]),
-            2)
+        result = self.db.get_processing_time_obs_type(
+            obsdict={'project': 'D01'})
+        self.assertEqual(result['job_id'], [job_4])
+        self.assertEqual(result['project'], ['D01'])
+        self.assertEqual(result['survey'], ['DDS'])
+        self.assertEqual(result['instrument'], ['F'])
 
     def test_taskinfo(self):
         self.db.add_task('testtask', True, 'mystarpath')
@@ -782,6 +1567,46 @@ class InterfaceDBTest(DBTestCase):
             self.assertIsInstance(task_info.id, int)
             self.assertEqual(task_info.taskname, task)
 
+    def test_task_cache(self):
+        self.db.add_task('testtask', True)
+
+        hits = self.db.cache_hits
+        misses = self.db.cache_misses
+
+        self.assertTrue(self.db.get_task_info('testtask').etransfer)
+        self.assertTrue(self.db.get_task_info('testtask').etransfer)
+        self.assertEqual(self.db.cache_misses, misses + 1)
+        self.assertEqual(self.db.cache_hits, hits + 1)
+
+        # Adding a task should invalidate the cache.
+        self.db.add_task('testtask2', False)
+        self.assertFalse(self.db.get_task_info('testtask2').etransfer)
+        self.assertEqual(self.db.cache_misses, misses + 2)
+
+        # A task added by another process should be found by re-reading
+        # the table.
+        with self.db.db as c:
+            c.execute('INSERT INTO task (taskname, etransfer) '
+                      'VALUES (%s, %s)', ('testtask3', True))
+        self.assertTrue(self.db.get_task_info('testtask3').etransfer)
+
+        # The task list should be refreshed when jobs are added for
+        # a new task.
+        self.db.add_job('tag1', 'JAC', 'obs', 'REC', 'test1',
+                        input_file_names=['test1'])
+        self.assertEqual(self.db.get_tasks(), ['test1'])
+        self.db.add_job('tag2', 'JAC', 'obs', 'REC', 'test2',
+                        input_file_names=['test1'])
+        self.assertEqual(self.db.get_tasks(), ['test1', 'test2'])
+
+        # Check that entries expire.
+        self.db.cache_ttl = 0.0
+        self.db.clear_cache()
+        misses = self.db.cache_misses
+        self.db.get_tasks()
+        self.db.get_tasks()
+        self.assertEqual(self.db.cache_misses, misses + 2)
+
     def test_tilelist(self):
         job_id = self.db.add_job('tag1', 'JAC', 'obs', 'RECIPE', 'test', input_file_names=['test1'])
 
@@ -950,6 +1775,27 @@ class InterfaceDBTest(DBTestCase):
         with self.assertRaises(KeyError):
             ej1 = elog_test1[job_1]
 
+        # Put job 1 back into the error state with a longer history, and
+        # check that only the latest error entry is returned for each job.
+        message5 = 'Second error for job %s' % (job_1)
+        self.db.change_state(job_1, JSAProcState.QUEUED, 'Retry')
+        self.db.change_state(job_1, JSAProcState.ERROR, message5)
+
+        elog_latest = self.db.find_errors_logs(latest_only=True)
+        self.assertEqual(list(elog_latest.keys()), [job_1, job_2])
+        ej1 = elog_latest[job_1]
+        self.assertEqual(len(ej1), 1)
+        self.assertEqual((ej1[0].message, ej1[0].state, ej1[0].location),
+                         (message5, newstate2, 'JAC'))
+        ej2 = elog_latest[job_2]
+        self.assertEqual(len(ej2), 1)
+        self.assertEqual((ej2[0].message, ej2[0].state, ej2[0].location),
+                         (message4, newstate4, 'CANFAR'))
+
+        elog_latest = self.db.find_errors_logs(location='CANFAR',
+                                               latest_only=True)
+        self.assertEqual(list(elog_latest.keys()), [job_2])
+
     def test_note(self):
         job_id = self.db.add_job('noteTest', 'JAC', 'obs', '', 'test',
                                  input_file_names=['file1'])
@@ -0,0 +1,58 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+import functools
+
+from jsa_proc.db.fanout import fan_out
+from jsa_proc.error import NoRowsError
+from jsa_proc.state import JSAProcState
+
+from .db import DBTestCase
+
+
+class FanOutTestCase(DBTestCase):
+    def test_fan_out(self):
+        for (i, state) in enumerate([
+                JSAProcState.QUEUED, JSAProcState.QUEUED,
+                JSAProcState.ERROR]):
+            self.db.add_job('tag{0}'.format(i), 'JAC', 'obs', 'RECIPE',
+                            'test', state=state,
+                            input_file_names=['test1'])
+
+        states = [JSAProcState.QUEUED, JSAProcState.ERROR,
+                  JSAProcState.RUNNING]
+        calls = OrderedDict(
+            (s, functools.partial(self.db.find_jobs, state=s, count=True))
+            for s in states)
+
+        expect = [(JSAProcState.QUEUED, 2), (JSAProcState.ERROR, 1),
+                  (JSAProcState.RUNNING, 0)]
+
+        # With the default concurrency the calls are made in turn,
+        # but the result should be the same when using threads.
+        for concurrency in (1, 4):
+            self.db.concurrency = concurrency
+
+            result = fan_out(self.db, calls)
+            self.assertIsInstance(result, OrderedDict)
+            self.assertEqual(list(result.items()), expect)
+
+            # Exceptions should be passed on to the caller.
+            with self.assertRaises(NoRowsError):
+                fan_out(self.db, OrderedDict([
+                    ('count', calls[JSAProcState.QUEUED]),
+                    ('job', functools.partial(self.db.get_job, id_=1000)),
+                ]))
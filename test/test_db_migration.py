@@ -0,0 +1,118 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+
+from jsa_proc.db.migration import get_schema_version, migrate, migrations
+from jsa_proc.state import JSAProcState
+
+from .db import DBTestCase
+
+
+class MigrationTestCase(DBTestCase):
+    def test_migrate(self):
+        # A new database should already be up to date.
+        latest = migrations[-1].version
+        self.assertEqual(get_schema_version(self.db), latest)
+        self.assertEqual(migrate(self.db), [])
+
+        # Make the database look like one which pre-dates the migrations.
+        with self.db.db as c:
+            for statement in [
+                    'DROP TABLE schema_version',
+                    'DROP TABLE job_count',
+                    'DROP TABLE job_obs',
+                    'DROP TABLE log_archive',
+                    'DROP TABLE job_lease',
+                    'DROP INDEX job_queue',
+                    'DROP INDEX job_queue_task',
+                    'DROP INDEX log_job_state']:
+                c.execute(statement)
+
+            c.executemany(
+                'INSERT INTO job (tag, state, location, mode, task) '
+                'VALUES (%s, %s, "JAC", "obs", "test")',
+                [('tag1', JSAProcState.QUEUED),
+                 ('tag2', JSAProcState.QUEUED)])
+
+            c.execute(
+                'INSERT INTO obsidss (job_id, obsid_subsysnr, obsid, subsys) '
+                'SELECT id, "2-3", "2", 3 FROM job WHERE tag = "tag2"')
+
+        self.assertIsNone(get_schema_version(self.db))
+
+        self.assertEqual(migrate(self.db, dry_run=True),
+                         [x.version for x in migrations])
+        self.assertIsNone(get_schema_version(self.db))
+
+        self.assertEqual(migrate(self.db),
+                         [x.version for x in migrations])
+        self.assertEqual(get_schema_version(self.db), latest)
+
+        # The job_count table should have been populated.
+        self.assertEqual(self.db.get_job_counts(['state']),
+                         {JSAProcState.QUEUED: 2})
+
+        # The job_obs table should have been populated.
+        self.assertEqual(
+            [x.tag for x in self.db.find_jobs(obsquery={'project': 'D01'})],
+            ['tag2'])
+
+        with self.db.db as c:
+            c.execute('SELECT name FROM sqlite_master WHERE type="index"')
+            indexes = set(x[0] for x in c.fetchall())
+
+        self.assertTrue(indexes.issuperset(
+            ['job_queue', 'job_queue_task', 'log_job_state']))
+
+        self.assertEqual(migrate(self.db), [])
+
+    def test_query_plan(self):
+        # Hot queries and the indexes which they should use, without
+        # needing a temporary b-tree for sorting.
+        queries = []
+
+        for (task, index) in [
+                (None, 'job_queue'),
+                ('test', 'job_queue_task')]:
+            (where, param) = self.db._find_jobs_where(
+                JSAProcState.QUEUED, 'JAC', task,
+                None, None, None, None)
+
+            queries.append((
+                'SELECT job.id FROM job WHERE ' + ' AND '.join(where) +
+                ' ORDER BY job.priority DESC, job.id ASC LIMIT 1',
+                param, index))
+
+        for table in ('log', 'qa'):
+            queries.append((
+                'SELECT * FROM ' + table + ' WHERE job_id = %s '
+                'ORDER BY id DESC LIMIT 1',
+                [1], table + '_job_id'))
+
+        queries.append((
+            'SELECT MAX(log.id) FROM log '
+            'WHERE log.job_id=%s AND log.state_new=%s',
+            [1, JSAProcState.ERROR], 'log_job_state'))
+
+        for (query, param, index) in queries:
+            with self.db.db as c:
+                c.execute('EXPLAIN QUERY PLAN ' + query, param)
+                plan = [x[-1] for x in c.fetchall()]
+
+            self.assertEqual(len(plan), 1, plan)
+            self.assertTrue(
+                re.search('USING (COVERING )?INDEX ' + index + ' ', plan[0]),
+                plan)
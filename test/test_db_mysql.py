@@ -0,0 +1,182 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from threading import Event, Thread
+import time
+from unittest import TestCase
+
+import mysql.connector
+
+from jsa_proc.db.mysql import JSAProcMySQLLock
+from jsa_proc.error import JSAProcError
+
+
+class DummyConnection():
+    """Connection-like object recording how it is used."""
+
+    def __init__(self, tables=()):
+        self.pings = 0
+        self.closed = False
+        self.tables = tables
+        self.queries = []
+
+    def cursor(self):
+        return DummyCursor(self)
+
+    def ping(self, **kwargs):
+        self.pings += 1
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class DummyCursor():
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def execute(self, query, *args):
+        self.conn.queries.append(query)
+
+        if query == 'SHOW TABLES':
+            self.rows = [(x,) for x in self.conn.tables]
+
+    def fetchone(self):
+        if self.rows:
+            return self.rows.pop(0)
+        return None
+
+    def close(self):
+        pass
+
+
+class MySQLPoolTestCase(TestCase):
+    def setUp(self):
+        self.connections = []
+
+    def connect(self):
+        conn = DummyConnection(tables=('job', 'log'))
+        self.connections.append(conn)
+        return conn
+
+    def test_pool(self):
+        lock = JSAProcMySQLLock(self.connect, locking='transaction',
+                                pool_size=2, check_interval=None)
+
+        # The first connection is made immediately and reused.
+        self.assertEqual(len(self.connections), 1)
+
+        for i in range(3):
+            with lock:
+                pass
+
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(self.connections[0].pings, 3)
+
+        # Concurrent blocks should use separate connections, up to
+        # the size of the pool.
+        entered = Event()
+        release = Event()
+
+        def worker():
+            with lock:
+                entered.set()
+                release.wait()
+
+        thread = Thread(target=worker)
+        thread.start()
+        entered.wait()
+
+        with lock:
+            self.assertEqual(len(self.connections), 2)
+
+        release.set()
+        thread.join()
+
+        # A connection on which a database error occurred should be
+        # discarded.
+        with self.assertRaises(JSAProcError):
+            with lock:
+                raise mysql.connector.Error('test error')
+
+        self.assertEqual(sum(1 for x in self.connections if x.closed), 1)
+
+        lock.close()
+        self.assertTrue(all(x.closed for x in self.connections))
+
+    def test_max_idle(self):
+        lock = JSAProcMySQLLock(self.connect, locking='transaction',
+                                max_idle=0.001)
+
+        time.sleep(0.01)
+
+        with lock:
+            pass
+
+        self.assertEqual(len(self.connections), 2)
+        self.assertTrue(self.connections[0].closed)
+        self.assertFalse(self.connections[1].closed)
+
+    def test_locking_table(self):
+        lock = JSAProcMySQLLock(self.connect, locking='table')
+        queries = self.connections[0].queries
+
+        self.assertEqual(queries, ['SHOW TABLES'])
+
+        # Rows are not locked individually as the tables are locked.
+        self.assertEqual(lock.for_update(), '')
+        self.assertEqual(lock.for_update(skip_locked=True), '')
+
+        with lock as c:
+            lock.begin_write(c)
+            self.assertEqual(queries[1:], ['LOCK TABLES job WRITE, log WRITE'])
+
+            lock.unlock()
+            self.assertEqual(queries[2:], ['UNLOCK TABLES'])
+
+        self.assertEqual(queries[3:], ['UNLOCK TABLES'])
+
+    def test_locking_transaction(self):
+        lock = JSAProcMySQLLock(self.connect, locking='transaction')
+        queries = self.connections[0].queries
+
+        self.assertEqual(lock.for_update(), ' FOR UPDATE')
+        self.assertEqual(lock.for_update(skip_locked=True),
+                         ' FOR UPDATE SKIP LOCKED')
+
+        # No tables are locked, so begin_write and unlock do nothing.
+        with lock as c:
+            lock.begin_write(c)
+            lock.unlock()
+
+        self.assertEqual(queries, [])
+
+        self.assertEqual(
+            lock.on_duplicate_increment(('task', 'state'), 'number'),
+            ' ON DUPLICATE KEY UPDATE number = number + VALUES(number)')
+
+        self.assertEqual(lock.utc_timestamp(), ('UTC_TIMESTAMP()', []))
+        self.assertEqual(
+            lock.utc_timestamp(60),
+            ('UTC_TIMESTAMP() - INTERVAL %s SECOND', [60]))
+
+        with self.assertRaises(JSAProcError):
+            JSAProcMySQLLock(self.connect, locking='row')
@@ -0,0 +1,83 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from jsa_proc.db.sqlite import JSAProcSQLite
+from jsa_proc.error import NoRowsError
+from jsa_proc.state import JSAProcState
+
+
+class ReplicaTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.primary = os.path.join(self.directory, 'primary.db')
+        self.replica = os.path.join(self.directory, 'replica.db')
+
+        with open('doc/schema.sql') as f:
+            schema = f.read()
+
+        for filename in (self.primary, self.replica):
+            db = JSAProcSQLite(filename, file_already_exists=False)
+            with db.db as c:
+                c.executescript(schema)
+            del db
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_routing(self):
+        db = JSAProcSQLite(self.primary, replica_filename=self.replica)
+
+        # Writes go to the primary database.
+        job_id = db.add_job('tag1', 'JAC', 'obs', 'RECIPE', 'test',
+                            input_file_names=['test1'],
+                            state=JSAProcState.QUEUED)
+
+        # Read-only methods use the replica, which does not (yet)
+        # contain the job, unless consistency is requested.
+        with self.assertRaises(NoRowsError):
+            db.get_job(job_id)
+
+        self.assertEqual(db.find_jobs(count=True), 0)
+        self.assertEqual(list(db.iter_jobs()), [])
+
+        self.assertEqual(db.get_job(job_id, consistent=True).tag, 'tag1')
+        self.assertEqual(db.find_jobs(count=True, consistent=True), 1)
+        self.assertEqual([x.id for x in db.iter_jobs(consistent=True)],
+                         [job_id])
+
+        # Reads within a write method use the primary database.
+        db.change_state(job_id, JSAProcState.WAITING, 'test',
+                        state_prev=JSAProcState.QUEUED)
+
+        self.assertEqual(db.get_job(job_id, consistent=True).state,
+                         JSAProcState.WAITING)
+
+        # After "replication" the replica can see the job.
+        del db
+        shutil.copyfile(self.primary, self.replica)
+
+        db = JSAProcSQLite(self.primary, replica_filename=self.replica)
+        self.assertEqual(db.get_job(job_id).state, JSAProcState.WAITING)
+
+        # Without a replica, the consistent argument is accepted
+        # but has no effect.
+        db = JSAProcSQLite(self.primary)
+        self.assertEqual(db.get_job(job_id).tag, 'tag1')
+        self.assertEqual(db.get_job(job_id, consistent=True).tag, 'tag1')
@@ -0,0 +1,130 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+try:
+    from configparser import SafeConfigParser
+except ImportError:
+    from ConfigParser import SafeConfigParser
+
+import jsa_proc.db.sqlite
+from jsa_proc.db.sqlite import get_sqlite_database, translate_query, \
+    JSAProcSQLite
+from jsa_proc.error import JSAProcError
+from jsa_proc.state import JSAProcState
+
+
+class SQLiteTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'jsa_proc.db')
+
+        with open('doc/schema.sql') as f:
+            schema = f.read()
+
+        db = JSAProcSQLite(self.filename, file_already_exists=False)
+        with db.db as c:
+            c.executescript(schema)
+        del db
+
+        self.config = SafeConfigParser()
+        self.config.add_section('database')
+        self.config.set('database', 'backend', 'sqlite')
+        self.config.set('database', 'filename', self.filename)
+        self.config.set('database', 'busy_timeout', '0.1')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_config(self):
+        self.config.set('database', 'sqlite_cache_size', '-1024')
+        db = get_sqlite_database(self.config)
+
+        with db.db as c:
+            pragmas = {}
+            for name in ('journal_mode', 'synchronous', 'cache_size',
+                         'foreign_keys'):
+                c.execute('PRAGMA ' + name)
+                pragmas[name] = c.fetchone()[0]
+
+        self.assertEqual(pragmas, {
+            'journal_mode': 'wal', 'synchronous': 1,
+            'cache_size': -1024, 'foreign_keys': 1})
+
+        self.config.set('database', 'sqlite_synchronous', 'OFF; DROP')
+        with self.assertRaises(JSAProcError):
+            get_sqlite_database(self.config)
+
+    def test_busy_timeout(self):
+        db1 = get_sqlite_database(self.config)
+        db2 = get_sqlite_database(self.config)
+
+        job_id = db1.add_job('tag1', 'JAC', 'obs', 'RECIPE', 'test',
+                             input_file_names=['test1'])
+
+        # While one connection is writing, another can read (using
+        # the WAL) but times out trying to write.
+        with db1.db as c:
+            db1.db.begin_write(c)
+            c.execute('UPDATE job SET priority = 1')
+
+            self.assertEqual(db2.get_job(job_id).priority, 0)
+
+            with self.assertRaises(JSAProcError):
+                db2.change_state(job_id, JSAProcState.QUEUED, 'test')
+
+        db2.change_state(job_id, JSAProcState.QUEUED, 'test')
+        job = db1.get_job(job_id)
+        self.assertEqual(job.state, JSAProcState.QUEUED)
+        self.assertEqual(job.priority, 1)
+
+    def test_begin_write(self):
+        db = get_sqlite_database(self.config)
+        job_id = db.add_job('tag1', 'JAC', 'obs', 'RECIPE', 'test',
+                            input_file_names=['test1'])
+
+        # The transaction is only started once per block.
+        for priority in (1, 2):
+            with db.db as c:
+                db.db.begin_write(c)
+                db.db.begin_write(c)
+                c.execute('UPDATE job SET priority = %s', (priority,))
+
+            self.assertEqual(db.get_job(job_id).priority, priority)
+
+        # Changes are discarded if the block fails.
+        with self.assertRaises(ZeroDivisionError):
+            with db.db as c:
+                db.db.begin_write(c)
+                c.execute('UPDATE job SET priority = 3')
+                1 / 0
+
+        self.assertEqual(db.get_job(job_id).priority, 2)
+
+    def test_translate_query(self):
+        jsa_proc.db.sqlite._query_cache.clear()
+
+        query = 'SELECT MAX(log.datetime) AS datetime FROM log ' \
+                'WHERE job_id = %s'
+        expect = 'SELECT MAX(log.datetime) AS "MAX [timestamp]" FROM log ' \
+                 'WHERE job_id = ?'
+
+        self.assertEqual(translate_query(query), expect)
+        self.assertEqual(jsa_proc.db.sqlite._query_cache, {query: expect})
+        self.assertEqual(translate_query(query), expect)
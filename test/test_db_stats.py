@@ -0,0 +1,81 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import shutil
+from tempfile import mkdtemp
+from unittest import TestCase
+
+from jsa_proc.db.sqlite import JSAProcSQLite
+from jsa_proc.db.stats import JSAProcDBStats, fingerprint, read_db_stats
+
+
+class DBStatsTestCase(TestCase):
+    def setUp(self):
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint('SELECT id FROM job\n  WHERE id IN (%s, %s, %s) '
+                        'AND state=\'Q\' LIMIT 10'),
+            'SELECT id FROM job WHERE id IN (?+) AND state=? LIMIT ?')
+
+    def test_stats(self):
+        stats = JSAProcDBStats(slow_query_time=None,
+                               directory=self.directory)
+
+        db = JSAProcSQLite(':memory:', stats=stats)
+
+        with open('doc/schema.sql') as f:
+            schema = f.read()
+
+        with db.db as c:
+            c.executescript(schema)
+
+        job_ids = [
+            db.add_job('tag{0}'.format(i), 'JAC', 'obs', 'REC', 'test',
+                       input_file_names=['file1'])
+            for i in range(3)]
+
+        self.assertEqual(len(db.find_jobs()), 3)
+
+        # Blocks should be recorded by the name of the calling method.
+        self.assertEqual(stats.blocks['add_jobs'][0], 3)
+        self.assertEqual(stats.blocks['find_jobs'][0], 1)
+
+        # Rows returned by the query should be counted.
+        queries = dict(
+            (query, values) for ((site, query), values)
+            in stats.queries.items() if site == 'find_jobs')
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(list(queries.values())[0][3], 3)
+
+        # Check the statistics can be written and read back.
+        stats.write()
+        stats.write_interval = 0.0
+        db.get_job(id_=job_ids[0])
+
+        combined = read_db_stats(self.directory)
+        self.assertEqual(combined.blocks['add_jobs'][0], 3)
+        self.assertEqual(combined.blocks['get_job'][0], 1)
+        self.assertEqual(sorted(combined.queries.keys()),
+                         sorted(stats.queries.keys()))
+
+        # Prevent the statistics being written at exit.
+        stats.filename = None
+
+        del db
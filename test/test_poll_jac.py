@@ -45,3 +45,87 @@ class PollJACTestCase(DBTestCase):
         self.assertEqual(self.db.get_job(job3).state, JSAProcState.ERROR)
         self.assertEqual(self.db.get_job(job4).state, JSAProcState.ERROR)
         self.assertEqual(self.db.get_job(job5).state, JSAProcState.ERROR)
+
+    def test_poll_jac_events(self):
+        job1 = self.db.add_job(
+            'tag1', 'JAC', 'obs', 'RECIPE_NAME', 'test', input_file_names=['f_1_01'])
+
+        since_id = self.db.get_last_event_id()
+
+        job2 = self.db.add_job(
+            'tag2', 'JAC', 'obs', 'RECIPE_NAME', 'test', input_file_names=['f_2_01'])
+        job3 = self.db.add_job(
+            'tag3', 'JAC', 'obs', 'RECIPE_NAME', 'test', input_file_names=[''])
+
+        # Only jobs which changed after the cursor should be considered.
+        sm = JSAProcStateMachine(self.db)
+        since_id = sm.poll_jac_events(since_id, timeout=0)
+
+        self.assertEqual(self.db.get_job(job1).state, JSAProcState.UNKNOWN)
+        self.assertEqual(self.db.get_job(job2).state, JSAProcState.QUEUED)
+        self.assertEqual(self.db.get_job(job3).state, JSAProcState.ERROR)
+
+        # The cursor should be before the state changes just made,
+        # so that the QUEUED job is seen next time.
+        (events, since_id) = self.db.wait_for_events(
+            since_id, states=[JSAProcState.QUEUED], timeout=0)
+        self.assertEqual([x.job_id for x in events], [job2])
+
+    def test_poll_jac_batch(self):
+        sm = JSAProcStateMachine(self.db)
+        self.assertEqual(list(sm.handlers.keys()),
+                         [JSAProcState.UNKNOWN, JSAProcState.QUEUED])
+
+        jobs = [
+            self.db.add_job(
+                'tag{0}'.format(i), 'JAC', 'obs', 'RECIPE_NAME', 'test',
+                input_file_names=['f_{0}_01'.format(i)], priority=priority)
+            for (i, priority) in enumerate((0, 2, 1))]
+
+        # Jobs in states without handlers should not be considered.
+        running = self.db.add_job(
+            'tag_running', 'JAC', 'obs', 'RECIPE_NAME', 'test',
+            input_file_names=['f_5_01'], state=JSAProcState.RUNNING)
+
+        # Only the highest priority jobs should be polled.
+        self.assertTrue(sm.poll_jac_jobs(batch_size=2))
+
+        self.assertEqual(
+            [self.db.get_job(x).state for x in jobs],
+            [JSAProcState.UNKNOWN, JSAProcState.QUEUED, JSAProcState.QUEUED])
+        self.assertEqual(self.db.get_job(running).state,
+                         JSAProcState.RUNNING)
+
+    def test_poll_jac_concurrent(self):
+        # A job which should pass validation and jobs which should not:
+        job1 = self.db.add_job(
+            'tag1', 'JAC', 'obs', 'RECIPE_NAME', 'test', input_file_names=['f_1_01'])
+        job2 = self.db.add_job(
+            'tag2', 'JAC', 'fortnight', 'RECIPE_NAME', 'test', input_file_names=['f_2_01'])
+        job3 = self.db.add_job(
+            'tag3', 'JAC', 'obs', 'RECIPE_NAME', 'test', input_file_names=['f_3_01.sdf'])
+
+        # Queued jobs: with data not present at JAC, with a parent
+        # which is not ready, and with an unrecognised file name.
+        job4 = self.db.add_job(
+            'tag4', 'JAC', 'obs', 'RECIPE_NAME', 'test',
+            input_file_names=['s8a20130401_00001_0001'],
+            state=JSAProcState.QUEUED)
+        job5 = self.db.add_job(
+            'tag5', 'JAC', 'obs', 'RECIPE_NAME', 'test',
+            parent_jobs=[job1], state=JSAProcState.QUEUED)
+        job6 = self.db.add_job(
+            'tag6', 'JAC', 'obs', 'RECIPE_NAME', 'test',
+            input_file_names=['f_6_01'], state=JSAProcState.QUEUED)
+
+        sm = JSAProcStateMachine(self.db, workers=4)
+        self.assertFalse(sm.poll_jac_jobs())
+
+        self.assertEqual(
+            [self.db.get_job(x).state
+             for x in (job1, job2, job3, job4, job5, job6)],
+            [JSAProcState.QUEUED, JSAProcState.ERROR, JSAProcState.ERROR,
+             JSAProcState.MISSING, JSAProcState.QUEUED, JSAProcState.QUEUED])
+
+        self.assertEqual(self.db.get_last_log(job2).message,
+                         'Job failed validation: invalid mode: fortnight')
@@ -0,0 +1,87 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from jsa_proc.admin.scheduler import JSAProcParentScheduler
+from jsa_proc.admin.statemachine import JSAProcStateMachine, \
+    state_handler
+from jsa_proc.state import JSAProcState
+
+from .db import DBTestCase
+
+
+class SchedulerTestCase(DBTestCase):
+    def test_scheduler(self):
+        (parent_1, parent_2) = [
+            self.db.add_job(
+                'parent{0}'.format(i), 'JAC', 'obs', 'RECIPE_NAME', 'test',
+                input_file_names=['f_{0}_01'.format(i)],
+                state=JSAProcState.RUNNING)
+            for i in (1, 2)]
+
+        child_1 = self.db.add_job(
+            'child1', 'JAC', 'obs', 'RECIPE_NAME', 'test',
+            parent_jobs=[parent_1, parent_2], state=JSAProcState.QUEUED)
+        child_2 = self.db.add_job(
+            'child2', 'JAC', 'obs', 'RECIPE_NAME', 'test',
+            parent_jobs=[parent_1], state=JSAProcState.QUEUED)
+        other = self.db.add_job(
+            'other', 'JAC', 'obs', 'RECIPE_NAME', 'test',
+            input_file_names=['s8a20130401_00001_0001'],
+            state=JSAProcState.QUEUED)
+
+        scheduler = JSAProcParentScheduler(self.db)
+
+        def queued():
+            return [x.id for x in scheduler.filter_jobs(
+                self.db.find_jobs(state=JSAProcState.QUEUED, sort=True))]
+
+        self.assertEqual(scheduler.update(), [])
+        self.assertEqual(queued(), [other])
+
+        # Children are released when all of their parents are ready.
+        self.db.change_state(parent_1, JSAProcState.PROCESSED, 'done')
+        self.assertEqual(scheduler.update(), [child_2])
+        self.assertEqual(queued(), [child_2, other])
+
+        self.db.change_state(parent_2, JSAProcState.PROCESSED, 'done')
+        self.assertEqual(scheduler.update(), [child_1])
+        self.assertEqual(queued(), [child_1, child_2, other])
+
+        # A parent which is no longer ready blocks its children again.
+        self.db.change_state(parent_1, JSAProcState.ERROR, 'failed')
+        self.assertEqual(scheduler.update(), [])
+        self.assertEqual(queued(), [other])
+
+        # Jobs leaving the queue are removed from the graph.
+        self.db.change_state(child_2, JSAProcState.DELETED, 'deleted')
+        self.db.change_state(parent_1, JSAProcState.PROCESSED, 'done')
+        self.assertEqual(scheduler.update(), [child_1])
+        self.assertEqual(queued(), [child_1, other])
+
+        # The state machine should only handle jobs which are not waiting
+        # for parents.
+        self.db.change_state(parent_2, JSAProcState.RUNNING, 'rerun')
+
+        handled = []
+
+        class TestStateMachine(JSAProcStateMachine):
+            @state_handler(JSAProcState.QUEUED)
+            def _handle_queued(self, jobs):
+                handled.extend(x.id for x in jobs)
+                return 0
+
+        sm = TestStateMachine(self.db, scheduler=scheduler)
+        self.assertTrue(sm.poll_jac_jobs())
+        self.assertEqual(handled, [other])
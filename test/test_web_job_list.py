@@ -0,0 +1,79 @@
+# Copyright (C) 2026 East Asian Observatory.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from flask import Flask
+
+from jsa_proc.jcmtobsinfo import ObsQueryDict
+from jsa_proc.web.job_list import prepare_job_list
+
+from .db import DBTestCase
+
+
+class JobListTestCase(DBTestCase):
+    def setUp(self):
+        super(JobListTestCase, self).setUp()
+
+        self.app = Flask(__name__)
+        for endpoint in ('job_list', 'job_info', 'job_qa', 'job_preview'):
+            self.app.add_url_rule(
+                '/' + endpoint, endpoint, lambda: '')
+
+    def _job_list(self, **kwargs):
+        args = {
+            'location': 'JAC', 'state': [], 'task': None,
+            'date_min': None, 'date_max': None, 'qa_state': None,
+            'sourcename': None, 'obsnum': None, 'project': None,
+            'mode': 'JSAProc', 'number': 4, 'tau_min': None, 'tau_max': None,
+            'tiles': None,
+        }
+        args.update((key, None) for key in ObsQueryDict)
+        args.update(kwargs)
+
+        with self.app.test_request_context():
+            result = prepare_job_list(self.db, **args)
+
+        return ([x['id'] for x in result['jobs']], result['pagination'])
+
+    def test_pagination(self):
+        # Vary the priority so that the index order does not match
+        # the identifier order.
+        job_ids = [
+            self.db.add_job('tag{0}'.format(i), 'JAC', 'obs', 'RECIPE',
+                            'test', input_file_names=['test1'],
+                            priority=(i % 3))
+            for i in range(10)]
+
+        (jobs, pagination) = self._job_list()
+        self.assertEqual(jobs, job_ids[0:4])
+        self.assertIsNone(pagination.first)
+        self.assertIsNone(pagination.prev)
+        self.assertIn('after_id={0}'.format(job_ids[3]), pagination.next)
+        self.assertIn('page=last', pagination.last)
+        self.assertEqual(pagination.count, 10)
+
+        (jobs, pagination) = self._job_list(after_id=job_ids[3])
+        self.assertEqual(jobs, job_ids[4:8])
+        self.assertIn('before_id={0}'.format(job_ids[4]), pagination.prev)
+        self.assertIn('after_id={0}'.format(job_ids[7]), pagination.next)
+
+        (jobs, pagination) = self._job_list(before_id=job_ids[4])
+        self.assertEqual(jobs, job_ids[0:4])
+        self.assertIsNone(pagination.prev)
+
+        (jobs, pagination) = self._job_list(page='last')
+        self.assertEqual(jobs, job_ids[6:10])
+        self.assertIn('before_id={0}'.format(job_ids[6]), pagination.prev)
+        self.assertIsNone(pagination.next)
+        self.assertIsNone(pagination.last)